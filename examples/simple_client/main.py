@@ -40,6 +40,8 @@ class Args:
     timing_file: pathlib.Path | None = None
     # Environment to run the policy in.
     env: EnvMode = EnvMode.ALOHA_SIM
+    # Transport used to exchange observations and actions. "shm" only works if the server runs on the same host.
+    transport: str = _websocket_client_policy.TRANSPORT_WEBSOCKET
 
 
 class TimingRecorder:
@@ -127,6 +129,7 @@ def main(args: Args) -> None:
         host=args.host,
         port=args.port,
         api_key=args.api_key,
+        transport=args.transport,
     )
     logger.info(f"Server metadata: {policy.get_server_metadata()}")
 
@@ -1,4 +1,5 @@
-from typing import Dict
+import concurrent.futures
+from typing import Dict, Optional
 
 import numpy as np
 import tree
@@ -12,19 +13,41 @@ class ActionChunkBroker(_base_policy.BasePolicy):
 
     Assumes that the first dimension of all action fields is the chunk size.
 
-    A new inference call to the inner policy is only made when the current
-    list of chunks is exhausted.
+    By default, a new inference call to the inner policy is only made when the
+    current list of chunks is exhausted.
+
+    If `prefetch_steps` is positive, the next inference call is started in the
+    background once only `prefetch_steps` actions of the current chunk remain.
+    The new chunk is used as soon as it arrives. Since its first action belongs
+    to the observation it was requested with, actions for the steps that have
+    elapsed in the meantime are skipped. The caller only waits if the current
+    chunk runs out before the new one arrives.
     """
 
-    def __init__(self, policy: _base_policy.BasePolicy, action_horizon: int):
+    def __init__(self, policy: _base_policy.BasePolicy, action_horizon: int, *, prefetch_steps: int = 0):
+        if not 0 <= prefetch_steps < action_horizon:
+            raise ValueError(f"prefetch_steps must be in [0, {action_horizon}), got {prefetch_steps}")
+
         self._policy = policy
         self._action_horizon = action_horizon
         self._cur_step: int = 0
 
         self._last_results: Dict[str, np.ndarray] | None = None
 
+        self._prefetch_steps = prefetch_steps
+        self._executor: Optional[concurrent.futures.Executor] = None
+        if prefetch_steps > 0:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="action_prefetch")
+        # Total number of steps served so far, used to align prefetched chunks.
+        self._step: int = 0
+        self._pending: Optional[concurrent.futures.Future] = None
+        self._pending_step: int = 0
+
     @override
     def infer(self, obs: Dict) -> Dict:  # noqa: UP006
+        if self._pending is not None and (self._pending.done() or self._last_results is None):
+            self._splice_pending()
+
         if self._last_results is None:
             self._last_results = self._policy.infer(obs)
             self._cur_step = 0
@@ -37,14 +60,49 @@ class ActionChunkBroker(_base_policy.BasePolicy):
 
         results = tree.map_structure(slicer, self._last_results)
         self._cur_step += 1
+        self._step += 1
 
         if self._cur_step >= self._action_horizon:
             self._last_results = None
+        elif (
+            self._executor is not None
+            and self._pending is None
+            and self._action_horizon - self._cur_step <= self._prefetch_steps
+        ):
+            # The caller may reuse its observation buffers, so the request gets its own copy.
+            obs = tree.map_structure(lambda x: x.copy() if isinstance(x, np.ndarray) else x, obs)
+            self._pending = self._executor.submit(self._policy.infer, obs)
+            # The first action of the new chunk belongs to the step that was just served.
+            self._pending_step = self._step - 1
 
         return results
 
     @override
     def reset(self) -> None:
+        self._discard_pending()
         self._policy.reset()
         self._last_results = None
         self._cur_step = 0
+        self._step = 0
+
+    def _splice_pending(self) -> None:
+        """Replaces the current chunk by the prefetched one, waiting for it if necessary."""
+        assert self._pending is not None
+        future, self._pending = self._pending, None
+        results = future.result()
+
+        offset = self._step - self._pending_step
+        if offset < self._action_horizon:
+            self._last_results = results
+            self._cur_step = offset
+        else:
+            # All actions of the prefetched chunk are stale, request a new one synchronously.
+            self._last_results = None
+
+    def _discard_pending(self) -> None:
+        if self._pending is None:
+            return
+        if not self._pending.cancel():
+            # Let the inner policy finish before it is used again, but ignore the result.
+            concurrent.futures.wait([self._pending])
+        self._pending = None
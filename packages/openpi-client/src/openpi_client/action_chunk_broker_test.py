@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+import pytest
+
+from openpi_client import action_chunk_broker
+from openpi_client import base_policy as _base_policy
+
+_ACTION_HORIZON = 8
+
+
+class _TimeIndexedPolicy(_base_policy.BasePolicy):
+    """Returns a chunk whose actions are the absolute step indices they are meant for."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.num_calls = 0
+
+    def infer(self, obs: dict) -> dict:
+        self.num_calls += 1
+        time.sleep(self.delay)
+        return {"actions": np.arange(_ACTION_HORIZON) + obs["step"], "info": "chunk"}
+
+
+@pytest.mark.parametrize("prefetch_steps", [0, 1, 3])
+@pytest.mark.parametrize("delay", [0.0, 0.01])
+def test_actions_are_aligned(prefetch_steps: int, delay: float):
+    policy = _TimeIndexedPolicy(delay)
+    broker = action_chunk_broker.ActionChunkBroker(policy, _ACTION_HORIZON, prefetch_steps=prefetch_steps)
+
+    num_steps = 5 * _ACTION_HORIZON
+    for step in range(num_steps):
+        result = broker.infer({"step": np.array(step)})
+        assert result["actions"] == step
+        assert result["info"] == "chunk"
+        time.sleep(0.002)
+
+    if prefetch_steps == 0:
+        assert policy.num_calls == num_steps // _ACTION_HORIZON
+    broker.reset()
+
+
+def test_prefetch_hides_latency():
+    delay = 0.05
+    policy = _TimeIndexedPolicy(delay)
+    broker = action_chunk_broker.ActionChunkBroker(policy, _ACTION_HORIZON, prefetch_steps=_ACTION_HORIZON // 2)
+
+    # The first call has to wait for the initial chunk.
+    broker.infer({"step": np.array(0)})
+    wait_times = []
+    for step in range(1, 4 * _ACTION_HORIZON):
+        # Simulate the control period.
+        time.sleep(delay / 2)
+        start = time.monotonic()
+        assert broker.infer({"step": np.array(step)})["actions"] == step
+        wait_times.append(time.monotonic() - start)
+
+    assert max(wait_times) < delay / 2
+
+
+def test_invalid_prefetch_steps():
+    with pytest.raises(ValueError, match="prefetch_steps"):
+        action_chunk_broker.ActionChunkBroker(_TimeIndexedPolicy(), _ACTION_HORIZON, prefetch_steps=_ACTION_HORIZON)
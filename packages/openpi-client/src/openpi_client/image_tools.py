@@ -1,6 +1,21 @@
+import functools
+import io
+from typing import Optional
+
 import numpy as np
 from PIL import Image
 
+# Image codecs supported by `encode_image` and `decode_image`. "raw" means that the image is not compressed.
+IMAGE_CODEC_RAW = "raw"
+IMAGE_CODEC_PNG = "png"
+IMAGE_CODEC_JPEG = "jpeg"
+IMAGE_CODECS = (IMAGE_CODEC_RAW, IMAGE_CODEC_PNG, IMAGE_CODEC_JPEG)
+# Codecs that reproduce images exactly.
+LOSSLESS_IMAGE_CODECS = (IMAGE_CODEC_RAW, IMAGE_CODEC_PNG)
+# Minimum height and width of the arrays that are compressed as images. Smaller uint8 arrays (e.g. masks or tokens) are
+# sent as they are.
+MIN_IMAGE_SIZE = 32
+
 
 def convert_to_uint8(img: np.ndarray) -> np.ndarray:
     """Converts an image to uint8 if it is a float image.
@@ -12,29 +27,162 @@ def convert_to_uint8(img: np.ndarray) -> np.ndarray:
     return img
 
 
-def resize_with_pad(images: np.ndarray, height: int, width: int, method=Image.BILINEAR) -> np.ndarray:
-    """Replicates tf.image.resize_with_pad for multiple images using PIL. Resizes a batch of images to a target height.
+def resize_with_pad(
+    images: np.ndarray, height: int, width: int, method=Image.BILINEAR, *, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Replicates tf.image.resize_with_pad for multiple images. Resizes a batch of images to a target height.
+
+    Every image is resized separately with PIL. See `resize_with_pad_numpy` for a faster bilinear implementation for
+    uint8 images whose results can differ from this one by one intensity level.
 
     Args:
         images: A batch of images in [..., height, width, channel] format.
         height: The target height of the image.
         width: The target width of the image.
         method: The interpolation method to use. Default is bilinear.
+        out: An optional array of shape [..., height, width, channel] to write the resized images to, e.g. a buffer
+            that is reused across calls.
 
     Returns:
-        The resized images in [..., height, width, channel].
+        The resized images in [..., height, width, channel]. This is `out` if it was given.
     """
     # If the images are already the correct size, return them as is.
     if images.shape[-3:-1] == (height, width):
-        return images
+        return _copy_to(images, out)
 
     original_shape = images.shape
+    if out is not None:
+        _check_output_shape(images, height, width, out)
+        for index in np.ndindex(original_shape[:-3]):
+            out[index] = _resize_with_pad_pil(Image.fromarray(images[index]), height, width, method=method)
+        return out
 
     images = images.reshape(-1, *original_shape[-3:])
     resized = np.stack([_resize_with_pad_pil(Image.fromarray(im), height, width, method=method) for im in images])
     return resized.reshape(*original_shape[:-3], *resized.shape[-3:])
 
 
+def resize_with_pad_numpy(
+    images: np.ndarray, height: int, width: int, *, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Like `resize_with_pad` with bilinear interpolation, but resizes uint8 images with NumPy instead of PIL.
+
+    Uses the same antialiased bilinear filter as PIL, applied to the whole batch as two banded matrix products (one per
+    axis). The matrices only depend on the source and target shapes and are cached, so resizing frames of a fixed
+    resolution only costs the matrix products, which release the GIL.
+
+    PIL rounds in fixed point, so pixels can differ from `resize_with_pad` by one intensity level. Only use this where
+    that is acceptable, e.g. not for inputs that must match the preprocessing of the training data bit for bit.
+    """
+    if images.dtype != np.uint8:
+        raise ValueError(f"Expected uint8 images, got {images.dtype}")
+    # If the images are already the correct size, return them as is.
+    if images.shape[-3:-1] == (height, width):
+        return _copy_to(images, out)
+
+    *batch_shape, cur_height, cur_width, channels = images.shape
+    if out is None:
+        out = np.empty((*batch_shape, height, width, channels), dtype=np.uint8)
+    else:
+        _check_output_shape(images, height, width, out)
+    plan = _resize_plan(cur_height, cur_width, height, width)
+
+    # Strided views (e.g. the RGB channels of RGBA images) are copied here, which is cheap while they are uint8.
+    images = images.reshape(-1, cur_height, cur_width * channels)
+    num_images = len(images)
+    # Each band of output rows is one product for the whole batch, with the wide [width * channel] rows last. Only the
+    # input rows of the band are converted to float32, so the converted rows are still in cache.
+    columns = np.empty((num_images, plan.resized_height, cur_width * channels), dtype=np.float32)
+    for out_slice, in_slice, block in plan.height_blocks:
+        np.matmul(block.T, images[:, in_slice].astype(np.float32), out=columns[:, out_slice])
+    # Moving the width last only copies the rows that are left after resizing the height.
+    rows = columns.reshape(num_images, plan.resized_height, cur_width, channels).transpose(0, 1, 3, 2)
+    rows = np.ascontiguousarray(rows).reshape(-1, cur_width)
+    resized = np.empty((len(rows), plan.resized_width), dtype=np.float32)
+    for out_slice, in_slice, block in plan.width_blocks:
+        np.matmul(rows[:, in_slice], block, out=resized[:, out_slice])
+    np.rint(resized, out=resized)
+    np.clip(resized, 0, 255, out=resized)
+
+    padded = (
+        out.reshape(num_images, height, width, channels)
+        if out.flags.c_contiguous
+        else np.empty((num_images, height, width, channels), dtype=np.uint8)
+    )
+    padded[...] = 0
+    padded[
+        :,
+        plan.pad_height : plan.pad_height + plan.resized_height,
+        plan.pad_width : plan.pad_width + plan.resized_width,
+    ] = resized.reshape(num_images, plan.resized_height, channels, plan.resized_width).transpose(0, 1, 3, 2)
+    if not out.flags.c_contiguous:
+        out[...] = padded.reshape(out.shape)
+    return out
+
+
+class _ResizePlan:
+    """The interpolation coefficients of one source and target shape."""
+
+    def __init__(self, cur_height: int, cur_width: int, height: int, width: int) -> None:
+        # Same rounding as `_resize_with_pad_pil`.
+        ratio = max(cur_width / width, cur_height / height)
+        self.resized_height = int(cur_height / ratio)
+        self.resized_width = int(cur_width / ratio)
+        self.pad_height = max(0, int((height - self.resized_height) / 2))
+        self.pad_width = max(0, int((width - self.resized_width) / 2))
+        self.height_blocks = _banded_blocks(_bilinear_weights(cur_height, self.resized_height))
+        self.width_blocks = _banded_blocks(_bilinear_weights(cur_width, self.resized_width))
+
+
+@functools.lru_cache(maxsize=32)
+def _resize_plan(cur_height: int, cur_width: int, height: int, width: int) -> _ResizePlan:
+    return _ResizePlan(cur_height, cur_width, height, width)
+
+
+def _bilinear_weights(in_size: int, out_size: int) -> np.ndarray:
+    """Returns the [out_size, in_size] matrix of PIL's bilinear filter, which is widened when downsampling."""
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    centers = (np.arange(out_size) + 0.5) * scale
+    # PIL only evaluates the filter within [start, stop) of every output, truncating the bounds towards zero.
+    starts = np.maximum((centers - filter_scale + 0.5).astype(np.int64), 0)
+    stops = np.minimum((centers + filter_scale + 0.5).astype(np.int64), in_size)
+    inputs = np.arange(in_size)
+    weights = np.maximum(1 - np.abs((inputs - centers[:, None] + 0.5) / filter_scale), 0)
+    weights *= (inputs >= starts[:, None]) & (inputs < stops[:, None])
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights.astype(np.float32)
+
+
+def _banded_blocks(weights: np.ndarray, block_size: int = 8) -> list:
+    """Splits a banded [out_size, in_size] matrix into blocks of `block_size` outputs.
+
+    Returns (output slice, input slice, block) tuples, where the input slice is the range of inputs with nonzero
+    coefficients and the block is the transposed [inputs, outputs] matrix of coefficients. Small blocks skip most of the
+    zeros of the band.
+    """
+    blocks = []
+    for start in range(0, weights.shape[0], block_size):
+        block = weights[start : start + block_size]
+        nonzero = np.flatnonzero(block.any(axis=0))
+        in_slice = slice(int(nonzero[0]), int(nonzero[-1]) + 1)
+        blocks.append((slice(start, start + len(block)), in_slice, np.ascontiguousarray(block[:, in_slice].T)))
+    return blocks
+
+
+def _check_output_shape(images: np.ndarray, height: int, width: int, out: np.ndarray) -> None:
+    expected_shape = (*images.shape[:-3], height, width, images.shape[-1])
+    if out.shape != expected_shape:
+        raise ValueError(f"Expected an output buffer of shape {expected_shape}, got {out.shape}")
+
+
+def _copy_to(images: np.ndarray, out: Optional[np.ndarray]) -> np.ndarray:
+    if out is None:
+        return images
+    out[...] = images
+    return out
+
+
 def _resize_with_pad_pil(image: Image.Image, height: int, width: int, method: int) -> Image.Image:
     """Replicates tf.image.resize_with_pad for one image using PIL. Resizes an image to a target height and
     width without distortion by padding with zeros.
@@ -56,3 +204,52 @@ def _resize_with_pad_pil(image: Image.Image, height: int, width: int, method: in
     zero_image.paste(resized_image, (pad_width, pad_height))
     assert zero_image.size == (width, height)
     return zero_image
+
+
+def is_encodable_image(img: np.ndarray, codec: str = IMAGE_CODEC_PNG) -> bool:
+    """Returns True if `img` is a single uint8 image that can be compressed with `codec` by `encode_image`.
+
+    Only [height, width, channel] color images and, with lossless codecs, [height, width] or [height, width, 1]
+    single-channel images are supported. Their height and width must be at least `MIN_IMAGE_SIZE`. Single-channel arrays
+    are often not photos (e.g. depth or segmentation maps), so lossy codecs would corrupt them.
+    """
+    if not isinstance(img, np.ndarray) or img.dtype != np.uint8 or img.ndim not in (2, 3):
+        return False
+    if min(img.shape[:2]) < MIN_IMAGE_SIZE:
+        return False
+    channels = img.shape[2] if img.ndim == 3 else 1
+    return channels == 3 or (channels == 1 and codec in LOSSLESS_IMAGE_CODECS)
+
+
+def encode_image(img: np.ndarray, codec: str, *, quality: int = 90) -> bytes:
+    """Compresses a single uint8 image. See `is_encodable_image` for the supported images.
+
+    Args:
+        img: The image to compress.
+        codec: One of `IMAGE_CODEC_PNG` or `IMAGE_CODEC_JPEG`.
+        quality: JPEG quality (1-95). Ignored by PNG, which is lossless.
+
+    Returns:
+        The compressed image. Use `decode_image` with the original shape to restore it.
+    """
+    if not is_encodable_image(img, codec):
+        raise ValueError(f"Cannot encode array with shape {img.shape} and dtype {img.dtype} as an image with {codec}.")
+    if img.ndim == 3 and img.shape[-1] == 1:
+        img = img[..., 0]
+
+    buffer = io.BytesIO()
+    if codec == IMAGE_CODEC_JPEG:
+        Image.fromarray(img).save(buffer, format="JPEG", quality=quality)
+    elif codec == IMAGE_CODEC_PNG:
+        # Favor speed over size, the images are sent once and decoded right away.
+        Image.fromarray(img).save(buffer, format="PNG", compress_level=1)
+    else:
+        raise ValueError(f"Unsupported image codec: {codec}")
+    return buffer.getvalue()
+
+
+def decode_image(data: bytes, shape: tuple) -> np.ndarray:
+    """Decompresses an image produced by `encode_image` and restores its original `shape`."""
+    with Image.open(io.BytesIO(data)) as image:
+        img = np.array(image)
+    return img.reshape(shape)
@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 
 import openpi_client.image_tools as image_tools
 
@@ -35,3 +36,103 @@ def test_resize_with_pad_shapes():
     resized_images = image_tools.resize_with_pad(images, height, width)
     assert resized_images.shape == (1, height, width, 3)
     assert np.all(resized_images == 0)
+
+
+def _smooth_image(shape):
+    # Smooth images compress well and survive lossy codecs with small errors.
+    height, width = shape[:2]
+    y, x = np.mgrid[:height, :width]
+    img = (x * 255 // max(width - 1, 1) + y * 64 // max(height - 1, 1)) % 256
+    return np.repeat(img[..., None], shape[2] if len(shape) == 3 else 1, axis=-1).reshape(shape).astype(np.uint8)
+
+
+@pytest.mark.parametrize("shape", [(32, 48, 3), (32, 48), (32, 48, 1)])
+def test_encode_decode_png_lossless(shape):
+    img = _smooth_image(shape)
+    data = image_tools.encode_image(img, image_tools.IMAGE_CODEC_PNG)
+    decoded = image_tools.decode_image(data, img.shape)
+    assert decoded.shape == img.shape
+    np.testing.assert_array_equal(decoded, img)
+
+
+def test_encode_rejects_lossy_single_channel():
+    with pytest.raises(ValueError, match="Cannot encode"):
+        image_tools.encode_image(_smooth_image((32, 48)), image_tools.IMAGE_CODEC_JPEG)
+
+
+def test_encode_decode_jpeg():
+    img = _smooth_image((64, 64, 3))
+    data = image_tools.encode_image(img, image_tools.IMAGE_CODEC_JPEG, quality=95)
+    assert len(data) < img.nbytes
+    decoded = image_tools.decode_image(data, img.shape)
+    assert decoded.shape == img.shape
+    assert np.abs(decoded.astype(np.int32) - img).mean() < 3
+
+
+def test_is_encodable_image():
+    jpeg = image_tools.IMAGE_CODEC_JPEG
+    assert image_tools.is_encodable_image(np.zeros((32, 48, 3), dtype=np.uint8), jpeg)
+    assert not image_tools.is_encodable_image(np.zeros((32, 48, 3), dtype=np.float32))
+    assert not image_tools.is_encodable_image(np.zeros((2, 32, 48, 3), dtype=np.uint8))
+    assert not image_tools.is_encodable_image(np.zeros((32, 48, 5), dtype=np.uint8))
+    # Too small, e.g. a mask or tokens.
+    assert not image_tools.is_encodable_image(np.zeros((8, 8, 3), dtype=np.uint8))
+    assert not image_tools.is_encodable_image(np.zeros((1, 256), dtype=np.uint8))
+    # Channels first.
+    assert not image_tools.is_encodable_image(np.zeros((3, 32, 48), dtype=np.uint8))
+    # Single-channel images are only compressed losslessly.
+    for shape in [(32, 48), (32, 48, 1)]:
+        assert image_tools.is_encodable_image(np.zeros(shape, dtype=np.uint8), image_tools.IMAGE_CODEC_PNG)
+        assert not image_tools.is_encodable_image(np.zeros(shape, dtype=np.uint8), jpeg)
+
+
+def test_resize_with_pad_out():
+    images = np.stack([_smooth_image((32, 48, 3)), _smooth_image((32, 48, 3))[::-1]])
+    out = np.empty((2, 20, 20, 3), dtype=np.uint8)
+    assert image_tools.resize_with_pad(images, 20, 20, out=out) is out
+    np.testing.assert_array_equal(out, image_tools.resize_with_pad(images, 20, 20))
+
+    same_size = np.empty_like(images)
+    image_tools.resize_with_pad(images, 32, 48, out=same_size)
+    np.testing.assert_array_equal(same_size, images)
+
+    with pytest.raises(ValueError, match="output buffer"):
+        image_tools.resize_with_pad(images, 20, 20, out=np.empty((2, 20, 21, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize(
+    ("shape", "height", "width"),
+    [
+        ((2, 720, 720, 3), 224, 224),
+        ((480, 640, 3), 224, 224),
+        ((1, 256, 320, 3), 60, 80),
+        ((2, 3, 10, 14, 3), 20, 20),
+        ((3, 100, 50, 3), 224, 224),
+    ],
+)
+def test_resize_with_pad_numpy_matches_pil(shape, height, width):
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 20, shape)
+    images = np.clip(noise + _smooth_image(shape[-3:]).astype(np.float64), 0, 255).astype(np.uint8)
+
+    expected = image_tools.resize_with_pad(images, height, width)
+    resized = image_tools.resize_with_pad_numpy(images, height, width)
+    assert resized.shape == expected.shape
+    assert np.abs(resized.astype(np.int32) - expected).max() <= 1
+    assert np.mean(resized != expected) < 0.25
+    # Images are resized independently of the rest of the batch.
+    flat = images.reshape(-1, *shape[-3:])
+    np.testing.assert_array_equal(
+        resized.reshape(-1, *resized.shape[-3:])[-1], image_tools.resize_with_pad_numpy(flat[-1], height, width)
+    )
+
+
+def test_resize_with_pad_numpy_views():
+    rgba = np.random.default_rng(0).integers(0, 256, (2, 64, 48, 4), dtype=np.uint8)
+    expected = image_tools.resize_with_pad_numpy(np.ascontiguousarray(rgba[..., :3]), 32, 32)
+    np.testing.assert_array_equal(image_tools.resize_with_pad_numpy(rgba[..., :3], 32, 32), expected)
+
+    # Non-contiguous output buffers.
+    out = np.zeros((32, 32, 2, 3), dtype=np.uint8).transpose(2, 0, 1, 3)
+    image_tools.resize_with_pad_numpy(rgba[..., :3], 32, 32, out=out)
+    np.testing.assert_array_equal(out, expected)
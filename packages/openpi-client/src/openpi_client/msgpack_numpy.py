@@ -10,12 +10,47 @@ msgpack is good for (de)serializing data over a network for multiple reasons:
 
 The code below is adapted from https://github.com/lebedov/msgpack-numpy. The reason not to use that library directly is
 that it falls back to pickle for object arrays.
+
+In addition to plain msgpack messages, this module implements an out-of-band ("oob") framing that avoids copying array
+data. `pack_frames` produces a list of frames: a small header frame followed by the raw array buffers, which can be
+handed directly to a scatter-write API such as fragmented websocket messages. `unpack_frames` copies the incoming
+frames straight into a single aligned buffer and returns writable arrays that are views into it. The layout is:
+
+    [prefix][msgpack header][padding][array 0][padding][array 1]...
+
+The 16-byte prefix holds a magic number, the format version, the header length and the payload length. The first byte
+of the magic number (0xc1) is never used by msgpack, so oob messages can't be confused with plain msgpack messages.
+Array data starts at `ALIGNMENT`-byte aligned offsets relative to the start of the payload.
+
+Single uint8 images can optionally be compressed with one of the codecs in `image_tools.IMAGE_CODECS` (see
+`make_pack_array`). Compressed images are always sent in-band. They are decoded transparently while unpacking, or
+returned as `EncodedImage` placeholders when `lazy_images=True` so that the caller can decode them in parallel (see
+`decode_images`).
 """
 
 import functools
+import itertools
+import struct
+from typing import Any, Callable, Iterable, List, Tuple, Union
 
 import msgpack
 import numpy as np
+import tree
+
+from openpi_client import image_tools
+
+# Wire formats understood by this module, in order of preference.
+WIRE_FORMAT_MSGPACK = "msgpack"
+WIRE_FORMAT_OOB = "msgpack_oob"
+WIRE_FORMATS = (WIRE_FORMAT_OOB, WIRE_FORMAT_MSGPACK)
+
+OOB_VERSION = 1
+# Alignment (in bytes) of every array buffer inside an oob payload.
+ALIGNMENT = 64
+
+_OOB_MAGIC = b"\xc1NP"
+# magic, version, header length, payload length.
+_OOB_PREFIX = struct.Struct("<3sBIQ")
 
 
 def pack_array(obj):
@@ -40,7 +75,63 @@ def pack_array(obj):
     return obj
 
 
-def unpack_array(obj):
+def make_pack_array(image_codec: str = image_tools.IMAGE_CODEC_RAW, *, image_quality: int = 90) -> Callable:
+    """Returns a msgpack `default` hook that behaves like `pack_array` but compresses images with `image_codec`.
+
+    Only arrays accepted by `image_tools.is_encodable_image` are compressed; all other arrays are packed as usual.
+    """
+    if image_codec not in image_tools.IMAGE_CODECS:
+        raise ValueError(f"Unsupported image codec: {image_codec}")
+    if image_codec == image_tools.IMAGE_CODEC_RAW:
+        return pack_array
+
+    def pack(obj):
+        if image_tools.is_encodable_image(obj, image_codec):
+            return {
+                b"__ndarray__": True,
+                b"codec": image_codec,
+                b"data": image_tools.encode_image(obj, image_codec, quality=image_quality),
+                b"dtype": obj.dtype.str,
+                b"shape": obj.shape,
+            }
+        return pack_array(obj)
+
+    return pack
+
+
+class EncodedImage:
+    """A compressed image that was not decoded yet. Returned when unpacking with `lazy_images=True`."""
+
+    def __init__(self, codec: str, data: bytes, shape: Tuple[int, ...]) -> None:
+        self.codec = codec
+        self.data = data
+        self.shape = shape
+
+    def decode(self) -> np.ndarray:
+        return image_tools.decode_image(self.data, self.shape)
+
+
+def decode_images(obj: Any, map_fn: Callable = map) -> Any:
+    """Decodes all `EncodedImage` leaves in `obj`.
+
+    Args:
+        obj: A tree returned by one of the unpack functions with `lazy_images=True`.
+        map_fn: Used to decode the images, e.g. `executor.map` to decode them in a thread pool.
+    """
+    leaves = tree.flatten(obj)
+    indices = [i for i, leaf in enumerate(leaves) if isinstance(leaf, EncodedImage)]
+    if not indices:
+        return obj
+    for i, image in zip(indices, map_fn(EncodedImage.decode, [leaves[i] for i in indices])):
+        leaves[i] = image
+    return tree.unflatten_as(obj, leaves)
+
+
+def unpack_array(obj, *, lazy_images: bool = False):
+    if b"__ndarray__" in obj and b"codec" in obj:
+        image = EncodedImage(obj[b"codec"], obj[b"data"], tuple(obj[b"shape"]))
+        return image if lazy_images else image.decode()
+
     if b"__ndarray__" in obj:
         return np.ndarray(buffer=obj[b"data"], dtype=np.dtype(obj[b"dtype"]), shape=obj[b"shape"])
 
@@ -55,3 +146,147 @@ packb = functools.partial(msgpack.packb, default=pack_array)
 
 Unpacker = functools.partial(msgpack.Unpacker, object_hook=unpack_array)
 unpackb = functools.partial(msgpack.unpackb, object_hook=unpack_array)
+
+
+def is_oob(data: Union[bytes, bytearray, memoryview]) -> bool:
+    """Returns True if `data` is (the first frame of) an oob message."""
+    return bytes(data[: len(_OOB_MAGIC)]) == _OOB_MAGIC
+
+
+def pack_frames(
+    obj: Any, *, image_codec: str = image_tools.IMAGE_CODEC_RAW, image_quality: int = 90
+) -> List[Union[bytes, memoryview]]:
+    """Packs `obj` into a list of oob frames without copying the data of contiguous arrays.
+
+    The returned frames hold references to the array memory, so the arrays must not be modified until the frames have
+    been sent. Concatenating the frames yields a message that can be decoded by `unpackb_oob`. If `image_codec` is not
+    "raw", images are compressed and sent in-band instead (see `make_pack_array`).
+    """
+    buffers = []
+    offset = 0
+    pack_in_band = make_pack_array(image_codec, image_quality=image_quality)
+
+    def pack_oob_array(obj):
+        nonlocal offset
+        if image_codec != image_tools.IMAGE_CODEC_RAW and image_tools.is_encodable_image(obj, image_codec):
+            return pack_in_band(obj)
+        if isinstance(obj, np.ndarray) and obj.dtype.kind not in ("V", "O", "c", "U", "S"):
+            data = np.ascontiguousarray(obj).reshape(-1).view(np.uint8)
+            offset = _align(offset)
+            buffers.append((offset, data))
+            offset += data.nbytes
+            return {
+                b"__oob_ndarray__": len(buffers) - 1,
+                b"offset": buffers[-1][0],
+                b"dtype": obj.dtype.str,
+                b"shape": obj.shape,
+            }
+        return pack_array(obj)
+
+    header = msgpack.packb(obj, default=pack_oob_array)
+    payload_size = _align(offset)
+    prefix = _OOB_PREFIX.pack(_OOB_MAGIC, OOB_VERSION, len(header), payload_size)
+    head = prefix + header
+    frames: List[Union[bytes, memoryview]] = [head + bytes(_align(len(head)) - len(head))]
+
+    position = 0
+    for buffer_offset, data in buffers:
+        if buffer_offset > position:
+            frames.append(bytes(buffer_offset - position))
+        frames.append(memoryview(data))
+        position = buffer_offset + data.nbytes
+    if payload_size > position:
+        frames.append(bytes(payload_size - position))
+    return frames
+
+
+def unpack_frames(frames: Iterable[Union[bytes, bytearray, memoryview]], *, lazy_images: bool = False) -> Any:
+    """Unpacks a message that was received as a sequence of frames.
+
+    Handles both oob messages (see `pack_frames`) and plain msgpack messages. For oob messages, the frames are copied
+    into a single aligned buffer as they arrive and the returned arrays are writable views into that buffer. Frame
+    boundaries don't need to match the ones produced by `pack_frames`. If `lazy_images` is True, compressed images are
+    returned as `EncodedImage` placeholders.
+    """
+    frames = iter(frames)
+    first = next(frames)
+    if not is_oob(first):
+        rest = list(frames)
+        return msgpack.unpackb(
+            b"".join([first, *rest]) if rest else first,
+            object_hook=functools.partial(unpack_array, lazy_images=lazy_images),
+        )
+
+    # Only the prefix and the header are collected in `head`; array data is copied straight into the payload buffer.
+    head = bytearray()
+    head_size = _OOB_PREFIX.size
+    header_size = payload_size = None
+    rest = memoryview(first)
+    while True:
+        take = head_size - len(head)
+        head += rest[:take]
+        rest = rest[take:]
+        if len(head) == head_size:
+            if payload_size is not None:
+                break
+            _, header_size, payload_size = _parse_prefix(head)
+            head_size = _align(_OOB_PREFIX.size + header_size)
+            continue
+        rest = memoryview(next(frames))
+
+    payload = _aligned_empty(payload_size)
+    position = 0
+    for frame in itertools.chain([rest], frames):
+        size = len(frame)
+        if position + size > payload_size:
+            raise ValueError("Received more data than announced in the oob message header.")
+        payload[position : position + size] = np.frombuffer(frame, dtype=np.uint8)
+        position += size
+    if position != payload_size:
+        raise ValueError(f"Incomplete oob message: expected {payload_size} payload bytes, got {position}.")
+
+    return _unpack_header(head[_OOB_PREFIX.size : _OOB_PREFIX.size + header_size], payload, lazy_images)
+
+
+def unpackb_oob(data: Union[bytes, bytearray, memoryview], *, lazy_images: bool = False) -> Any:
+    """Unpacks a complete oob message without copying.
+
+    The returned arrays are views into `data`. They are read-only if `data` is immutable (e.g. `bytes`).
+    """
+    _, header_size, payload_size = _parse_prefix(data)
+    head_size = _align(_OOB_PREFIX.size + header_size)
+    payload = np.frombuffer(data, dtype=np.uint8, count=payload_size, offset=head_size)
+    return _unpack_header(data[_OOB_PREFIX.size : _OOB_PREFIX.size + header_size], payload, lazy_images)
+
+
+def _parse_prefix(data: Union[bytes, bytearray, memoryview]) -> Tuple[int, int, int]:
+    magic, version, header_size, payload_size = _OOB_PREFIX.unpack_from(data)
+    if magic != _OOB_MAGIC:
+        raise ValueError("Not an oob message.")
+    if version != OOB_VERSION:
+        raise ValueError(f"Unsupported oob message version: {version}")
+    return version, header_size, payload_size
+
+
+def _unpack_header(header: Union[bytes, bytearray, memoryview], payload: np.ndarray, lazy_images: bool) -> Any:
+    def unpack_oob_array(obj):
+        if b"__oob_ndarray__" in obj:
+            dtype = np.dtype(obj[b"dtype"])
+            shape = tuple(obj[b"shape"])
+            offset = obj[b"offset"]
+            nbytes = dtype.itemsize * int(np.prod(shape))
+            return payload[offset : offset + nbytes].view(dtype).reshape(shape)
+        return unpack_array(obj, lazy_images=lazy_images)
+
+    return msgpack.unpackb(header, object_hook=unpack_oob_array)
+
+
+def _align(size: int) -> int:
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _aligned_empty(size: int) -> np.ndarray:
+    """Allocates an uninitialized uint8 buffer whose first byte is `ALIGNMENT`-byte aligned."""
+    raw = np.empty(size + ALIGNMENT, dtype=np.uint8)
+    start = -raw.ctypes.data % ALIGNMENT
+    return raw[start : start + size]
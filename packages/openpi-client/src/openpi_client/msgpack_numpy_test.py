@@ -14,32 +14,90 @@ def _check(expected, actual):
         assert expected == actual
 
 
-@pytest.mark.parametrize(
-    "data",
-    [
-        1,  # int
-        1.0,  # float
-        "hello",  # string
-        np.bool_(True),  # boolean scalar
-        np.array([1, 2, 3])[0],  # int scalar
-        np.str_("asdf"),  # string scalar
-        [1, 2, 3],  # list
-        {"key": "value"},  # dict
-        {"key": [1, 2, 3]},  # nested dict
-        np.array(1.0),  # 0D array
-        np.array([1, 2, 3], dtype=np.int32),  # 1D integer array
-        np.array(["asdf", "qwer"]),  # string array
-        np.array([True, False]),  # boolean array
-        np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32),  # 2D float array
-        np.array([[[1, 2], [3, 4]], [[5, 6], [7, 8]]], dtype=np.int16),  # 3D integer array
-        np.array([np.nan, np.inf, -np.inf]),  # special float values
-        {"arr": np.array([1, 2, 3]), "nested": {"arr": np.array([4, 5, 6])}},  # nested dict with arrays
-        [np.array([1, 2]), np.array([3, 4])],  # list of arrays
-        np.zeros((3, 4, 5), dtype=np.float32),  # 3D zeros
-        np.ones((2, 3), dtype=np.float64),  # 2D ones with double precision
-    ],
-)
+_TEST_DATA = [
+    1,  # int
+    1.0,  # float
+    "hello",  # string
+    np.bool_(True),  # boolean scalar
+    np.array([1, 2, 3])[0],  # int scalar
+    np.str_("asdf"),  # string scalar
+    [1, 2, 3],  # list
+    {"key": "value"},  # dict
+    {"key": [1, 2, 3]},  # nested dict
+    np.array(1.0),  # 0D array
+    np.array([1, 2, 3], dtype=np.int32),  # 1D integer array
+    np.array(["asdf", "qwer"]),  # string array
+    np.array([True, False]),  # boolean array
+    np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32),  # 2D float array
+    np.array([[[1, 2], [3, 4]], [[5, 6], [7, 8]]], dtype=np.int16),  # 3D integer array
+    np.array([np.nan, np.inf, -np.inf]),  # special float values
+    {"arr": np.array([1, 2, 3]), "nested": {"arr": np.array([4, 5, 6])}},  # nested dict with arrays
+    [np.array([1, 2]), np.array([3, 4])],  # list of arrays
+    np.zeros((3, 4, 5), dtype=np.float32),  # 3D zeros
+    np.ones((2, 3), dtype=np.float64),  # 2D ones with double precision
+    np.arange(12, dtype=np.float32).reshape(3, 4).T,  # non-contiguous array
+    np.zeros((0, 3), dtype=np.uint8),  # empty array
+    {"image": np.zeros((224, 224, 3), dtype=np.uint8), "state": np.ones(23), "prompt": "do something"},
+]
+
+
+@pytest.mark.parametrize("data", _TEST_DATA)
 def test_pack_unpack(data):
     packed = msgpack_numpy.packb(data)
     unpacked = msgpack_numpy.unpackb(packed)
     tree.map_structure(_check, data, unpacked)
+
+
+@pytest.mark.parametrize("data", _TEST_DATA)
+def test_pack_unpack_frames(data):
+    frames = msgpack_numpy.pack_frames(data)
+    assert msgpack_numpy.is_oob(frames[0])
+
+    unpacked = msgpack_numpy.unpack_frames(frames)
+    tree.map_structure(_check, data, unpacked)
+
+    # The frames can also be concatenated into a single message.
+    unpacked = msgpack_numpy.unpackb_oob(b"".join(frames))
+    tree.map_structure(_check, data, unpacked)
+
+
+def test_unpack_frames_writable_and_aligned():
+    data = {"a": np.arange(5, dtype=np.uint8), "b": np.ones((3, 7), dtype=np.float32)}
+    message = b"".join(msgpack_numpy.pack_frames(data))
+
+    # Split the message at arbitrary boundaries; the decoder must not depend on the sender's framing.
+    chunks = [message[i : i + 13] for i in range(0, len(message), 13)]
+    unpacked = msgpack_numpy.unpack_frames(chunks)
+    for key in data:
+        assert unpacked[key].flags.writeable
+        assert unpacked[key].ctypes.data % msgpack_numpy.ALIGNMENT == 0
+        np.testing.assert_array_equal(unpacked[key], data[key])
+
+
+def test_unpack_frames_plain_msgpack():
+    data = {"arr": np.array([1, 2, 3]), "prompt": "hello"}
+    unpacked = msgpack_numpy.unpack_frames([msgpack_numpy.packb(data)])
+    tree.map_structure(_check, data, unpacked)
+
+
+def test_pack_frames_no_copy():
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    frames = msgpack_numpy.pack_frames({"image": image})
+    assert any(isinstance(f, memoryview) and np.shares_memory(np.asarray(f), image) for f in frames)
+
+
+@pytest.mark.parametrize("oob", [False, True])
+def test_image_codec(oob):
+    image = np.tile(np.arange(64, dtype=np.uint8)[None, :, None], (48, 1, 3))
+    data = {"image": image, "state": np.ones(23), "prompt": "do something"}
+
+    if oob:
+        frames = msgpack_numpy.pack_frames(data, image_codec="png")
+        lazy = msgpack_numpy.unpack_frames(frames, lazy_images=True)
+    else:
+        packed = msgpack_numpy.packb(data, default=msgpack_numpy.make_pack_array("png"))
+        assert len(packed) < image.nbytes
+        lazy = msgpack_numpy.unpack_frames([packed], lazy_images=True)
+
+    assert isinstance(lazy["image"], msgpack_numpy.EncodedImage)
+    tree.map_structure(_check, data, msgpack_numpy.decode_images(lazy))
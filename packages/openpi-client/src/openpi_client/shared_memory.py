@@ -0,0 +1,161 @@
+"""Shared-memory transport for clients and servers running on the same host.
+
+Observations and actions are written into a POSIX shared-memory segment (`/dev/shm` on Linux) that is created by the
+client and attached by the server. The websocket connection is only used as a lightweight control channel: instead of
+the message itself, it carries a small msgpack message naming the slot and the size of the data.
+
+Segments start with a header holding a magic number and the layout of the ring, which the attaching process checks
+before it uses the segment. The server only lets clients on the same host attach, and only to segments whose name
+starts with a random prefix it issued to the connection, so that clients can't make it write into unrelated segments.
+
+After the header, the segment is split into `num_slots` slots. Every slot consists of a request area followed by a response area of
+`slot_size` bytes each, and the response to a request is always written to the response area of the request's slot.
+A slot is therefore in use from the moment its request is written until its response has been read, which bounds the
+number of requests in flight to `num_slots`. Messages use the oob layout of `msgpack_numpy.pack_frames`, so writing a
+message is a single copy of every array into shared memory, and reading it is a single copy out of it. Messages that
+don't fit into a slot are sent over the websocket connection as usual.
+"""
+
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import queue
+import secrets
+import struct
+from typing import Any, Dict, Optional, Set
+
+from openpi_client import msgpack_numpy
+
+# Key of the control messages that refer to data in shared memory.
+SHM_KEY = "__shm__"
+# Key of the message that asks the server to attach to a segment, and of its answer.
+SHM_ATTACH_KEY = "__shm_attach__"
+
+REQUEST = 0
+RESPONSE = 1
+
+# Magic number, number of slots and slot size at the start of every segment.
+_HEADER = struct.Struct("<8sIQ")
+_MAGIC = b"OPISHM\x00\x01"
+_HEADER_SIZE = msgpack_numpy.ALIGNMENT
+
+# Names of the segments created by this process, which are tracked by this process' resource tracker.
+_created_names: Set[str] = set()
+
+
+class SharedMemoryRing:
+    """A shared-memory segment holding a fixed number of request/response slots."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, num_slots: int, slot_size: int, *, owner: bool) -> None:
+        if shm.size < _HEADER_SIZE + 2 * num_slots * slot_size:
+            raise ValueError(
+                f"Shared memory segment {shm.name} is too small for {num_slots} slots of {slot_size} bytes"
+            )
+        self._shm = shm
+        self._num_slots = num_slots
+        self._slot_size = slot_size
+        self._owner = owner
+
+        # Slots that are not used by a pending request. Only used by the owner of the segment.
+        self._free_slots: queue.Queue[int] = queue.Queue()
+        for slot in range(num_slots):
+            self._free_slots.put(slot)
+
+    @classmethod
+    def create(cls, num_slots: int, slot_size: int, *, name_prefix: Optional[str] = None) -> "SharedMemoryRing":
+        """Creates a new segment, named with `name_prefix` and a random suffix. It is removed when the ring is closed."""
+        if num_slots < 1 or slot_size < 1:
+            raise ValueError("num_slots and slot_size must be positive")
+        slot_size = msgpack_numpy.ALIGNMENT * -(-slot_size // msgpack_numpy.ALIGNMENT)
+        name = None if name_prefix is None else name_prefix + secrets.token_hex(8)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER_SIZE + 2 * num_slots * slot_size)
+        _created_names.add(shm.name)
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, num_slots, slot_size)
+        return cls(shm, num_slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(
+        cls, name: str, num_slots: int, slot_size: int, *, name_prefix: Optional[str] = None
+    ) -> "SharedMemoryRing":
+        """Attaches to a segment created by another process.
+
+        Raises:
+            ValueError: If the name doesn't start with `name_prefix`, or the segment is not a ring with this layout.
+        """
+        if name_prefix is not None and not name.startswith(name_prefix):
+            raise ValueError(f"Shared memory segment {name} does not start with the issued prefix {name_prefix}")
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name not in _created_names:
+            # The resource tracker would otherwise remove the segment when this process exits, although it is owned by
+            # the process that created it (see https://bugs.python.org/issue38119).
+            resource_tracker.unregister(shm._name, "shared_memory")  # noqa: SLF001
+        try:
+            ring = cls(shm, num_slots, slot_size, owner=False)
+            ring._check_header()  # noqa: SLF001
+        except ValueError:
+            shm.close()
+            raise
+        return ring
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def describe(self) -> Dict:
+        """Returns the information the peer needs to attach to this ring."""
+        return {"name": self.name, "num_slots": self._num_slots, "slot_size": self._slot_size}
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Returns a free slot, waiting until one becomes available, or None if none became available in time."""
+        try:
+            return self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int) -> None:
+        self._free_slots.put(slot)
+
+    def write(self, slot: int, area: int, obj: Any) -> Optional[int]:
+        """Writes `obj` to the request or response area of `slot`.
+
+        Returns:
+            The number of bytes written, or None if `obj` doesn't fit into the slot.
+        """
+        frames = msgpack_numpy.pack_frames(obj)
+        size = sum(len(frame) for frame in frames)
+        if size > self._slot_size:
+            return None
+        self._check_header()
+        position = self._offset(slot, area)
+        for frame in frames:
+            self._shm.buf[position : position + len(frame)] = frame
+            position += len(frame)
+        return size
+
+    def read(self, slot: int, area: int, size: int, *, lazy_images: bool = False) -> Any:
+        """Reads a message of `size` bytes from the request or response area of `slot`.
+
+        The returned arrays are copies, so the slot can be reused right away.
+        """
+        if not 0 < size <= self._slot_size:
+            raise ValueError(f"Invalid message size: {size}")
+        offset = self._offset(slot, area)
+        view = self._shm.buf[offset : offset + size]
+        obj = msgpack_numpy.unpack_frames([view], lazy_images=lazy_images)
+        # The segment can't be closed while views into it exist.
+        view.release()
+        return obj
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+            _created_names.discard(self._shm.name)
+
+    def _check_header(self) -> None:
+        if _HEADER.unpack_from(self._shm.buf, 0) != (_MAGIC, self._num_slots, self._slot_size):
+            raise ValueError(f"Shared memory segment {self._shm.name} is not a ring with the expected layout")
+
+    def _offset(self, slot: int, area: int) -> int:
+        if not 0 <= slot < self._num_slots:
+            raise ValueError(f"Invalid slot: {slot}")
+        return _HEADER_SIZE + (2 * slot + area) * self._slot_size
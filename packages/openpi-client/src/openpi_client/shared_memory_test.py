@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from openpi_client import shared_memory
+
+
+def test_write_read():
+    ring = shared_memory.SharedMemoryRing.create(num_slots=2, slot_size=1 << 16)
+    peer = shared_memory.SharedMemoryRing.attach(**ring.describe())
+    try:
+        obs = {"image": np.random.randint(256, size=(32, 32, 3), dtype=np.uint8), "state": np.arange(7.0), "x": "y"}
+        size = ring.write(1, shared_memory.REQUEST, obs)
+        assert size is not None
+
+        result = peer.read(1, shared_memory.REQUEST, size)
+        np.testing.assert_array_equal(result["image"], obs["image"])
+        np.testing.assert_array_equal(result["state"], obs["state"])
+        assert result["x"] == "y"
+
+        # The result doesn't share memory with the slot, so the slot can be reused.
+        peer.write(1, shared_memory.REQUEST, {"state": np.zeros(7)})
+        np.testing.assert_array_equal(result["state"], obs["state"])
+    finally:
+        peer.close()
+        ring.close()
+
+
+def test_too_large():
+    ring = shared_memory.SharedMemoryRing.create(num_slots=1, slot_size=1024)
+    try:
+        assert ring.write(0, shared_memory.RESPONSE, {"data": np.zeros(1024, dtype=np.uint8)}) is None
+        with pytest.raises(ValueError, match="slot"):
+            ring.write(1, shared_memory.RESPONSE, {})
+    finally:
+        ring.close()
+
+
+def test_acquire_release():
+    ring = shared_memory.SharedMemoryRing.create(num_slots=2, slot_size=1024)
+    try:
+        slots = {ring.acquire(), ring.acquire()}
+        assert slots == {0, 1}
+        assert ring.acquire(timeout=0.01) is None
+        ring.release(1)
+        assert ring.acquire() == 1
+    finally:
+        ring.close()
+
+
+def test_attach_checks_name_and_header():
+    ring = shared_memory.SharedMemoryRing.create(num_slots=2, slot_size=1024, name_prefix="openpi_test_")
+    try:
+        assert ring.name.startswith("openpi_test_")
+        with pytest.raises(ValueError, match="prefix"):
+            shared_memory.SharedMemoryRing.attach(**ring.describe(), name_prefix="other_")
+        with pytest.raises(ValueError, match="layout"):
+            shared_memory.SharedMemoryRing.attach(ring.name, num_slots=1, slot_size=1024)
+
+        peer = shared_memory.SharedMemoryRing.attach(**ring.describe(), name_prefix="openpi_test_")
+        # A segment whose header was overwritten is not written to anymore.
+        ring._shm.buf[:8] = bytes(8)  # noqa: SLF001
+        with pytest.raises(ValueError, match="layout"):
+            peer.write(0, shared_memory.RESPONSE, {})
+        peer.close()
+    finally:
+        ring.close()
@@ -1,31 +1,155 @@
+import asyncio
+import collections
+import concurrent.futures
+import itertools
 import logging
+import threading
 import time
-from typing import Dict, Optional, Tuple
+from typing import Deque, Dict, Optional, Tuple
 
 from typing_extensions import override
+import websockets.protocol
 import websockets.sync.client
 
 from openpi_client import base_policy as _base_policy
+from openpi_client import image_tools
 from openpi_client import msgpack_numpy
+from openpi_client import shared_memory as _shared_memory
+
+# Transports that can be selected with the `transport` argument of `WebsocketClientPolicy`.
+TRANSPORT_WEBSOCKET = "websocket"
+TRANSPORT_SHM = "shm"
+TRANSPORTS = (TRANSPORT_WEBSOCKET, TRANSPORT_SHM)
+
+# Key under which pipelined requests and their responses carry the request id.
+REQUEST_ID_KEY = "__request_id__"
+# Key under which requests carry their time budget in milliseconds, counted from when the server received them.
+DEADLINE_KEY = "__deadline_ms__"
+# Key of the flag that allows the server to drop a queued request of the same connection when a newer one arrives.
+COALESCE_KEY = "__coalesce__"
+# Key under which the server reports that a request was dropped instead of answered, and the possible reasons.
+STATUS_KEY = "__status__"
+STATUS_EXPIRED = "expired"
+STATUS_SUPERSEDED = "superseded"
+
+# Interval in seconds at which a request waiting for a free shared-memory slot checks whether the connection failed.
+_SLOT_POLL_INTERVAL = 0.1
+
+
+class RequestDroppedError(RuntimeError):
+    """The server dropped a request without running the policy, because it expired or was superseded."""
+
+    def __init__(self, status: str, server_timing: Optional[Dict] = None) -> None:
+        super().__init__(f"The policy server dropped the request: {status}")
+        self.status = status
+        self.server_timing = server_timing or {}
 
 
 class WebsocketClientPolicy(_base_policy.BasePolicy):
     """Implements the Policy interface by communicating with a server over websocket.
 
     See WebsocketPolicyServer for a corresponding server implementation.
+
+    The wire format used for observations and actions is negotiated during the metadata handshake: the server lists the
+    formats it understands under `metadata["transport"]["wire_formats"]` and the client picks the first format from
+    `msgpack_numpy.WIRE_FORMATS` that the server supports. Servers that don't advertise any formats only receive plain
+    msgpack messages. Likewise, images are only compressed with codecs listed under
+    `metadata["transport"]["image_codecs"]`.
+
+    `infer_async` (and its asyncio counterpart `ainfer`) allow several requests to be in flight on the same connection,
+    e.g. to capture and preprocess the next observation while the previous one is being processed. Requests are tagged
+    with a request id if the server advertises `metadata["transport"]["request_ids"]`, in which case the server may
+    answer them out of order. Otherwise, responses are matched to requests in the order they were sent.
+
+    With `transport="shm"`, observations and actions are exchanged through shared memory and the websocket connection
+    only carries small control messages (see `shared_memory.py`). This requires the server to run on the same host; if
+    it doesn't advertise a segment name prefix under `metadata["transport"]["shared_memory"]` or can't attach to the
+    segment, the client falls back to the websocket transport.
+
+    For closed-loop control, requests can carry a deadline (`deadline_ms`): the server drops requests that have waited
+    longer than that without running the policy. With `coalesce=True`, a request that is still queued on the server is
+    also dropped as soon as a newer request of the same client arrives, so that only the newest observation is
+    evaluated. Dropped requests raise `RequestDroppedError`. Both require the server to advertise
+    `metadata["transport"]["deadlines"]` and are ignored otherwise.
     """
 
-    def __init__(self, host: str = "0.0.0.0", port: Optional[int] = None, api_key: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: Optional[int] = None,
+        api_key: Optional[str] = None,
+        wire_format: Optional[str] = None,
+        image_codec: str = image_tools.IMAGE_CODEC_RAW,
+        image_quality: int = 90,
+        transport: str = TRANSPORT_WEBSOCKET,
+        shm_num_slots: int = 2,
+        shm_slot_size: int = 16 * 1024 * 1024,
+        deadline_ms: Optional[float] = None,
+        coalesce: bool = False,
+    ) -> None:
+        """Connects to the server.
+
+        Args:
+            host: Host of the policy server.
+            port: Port of the policy server.
+            api_key: Optional API key sent in the `Authorization` header.
+            wire_format: Force a specific wire format (see `msgpack_numpy.WIRE_FORMATS`). If None, the best format
+                supported by the server is used.
+            image_codec: Codec used to compress uint8 images before sending them (see `image_tools.IMAGE_CODECS`).
+                Compression trades client and server CPU time for bandwidth, so it mostly pays off on slow networks.
+            image_quality: JPEG quality (1-95). Only used if `image_codec` is "jpeg".
+            transport: One of `TRANSPORTS`. "shm" passes arrays through shared memory and only works if the server
+                runs on the same host. Images are never compressed when they are sent through shared memory.
+            shm_num_slots: Number of shared-memory slots, i.e. the maximum number of requests in flight.
+            shm_slot_size: Size in bytes of the request and response areas of every slot. Larger messages are sent
+                over the websocket connection.
+            deadline_ms: Default time budget of every request in milliseconds, counted from when the server received
+                it. Requests that can't be started within their budget are dropped. If None, requests never expire.
+            coalesce: Let the server drop queued requests of this client that are superseded by a newer one.
+        """
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unsupported transport: {transport}")
         self._uri = f"ws://{host}"
         if port is not None:
             self._uri += f":{port}"
-        self._packer = msgpack_numpy.Packer()
         self._api_key = api_key
         self._ws, self._server_metadata = self._wait_for_server()
+        self._wire_format = self._negotiate_wire_format(wire_format)
+        self._image_codec = self._negotiate_image_codec(image_codec)
+        self._image_quality = image_quality
+        self._packer = msgpack_numpy.Packer(
+            default=msgpack_numpy.make_pack_array(self._image_codec, image_quality=image_quality)
+        )
+        self._shm: Optional[_shared_memory.SharedMemoryRing] = None
+        if transport == TRANSPORT_SHM:
+            self._shm = self._attach_shared_memory(shm_num_slots, shm_slot_size)
+        self._supports_deadlines = bool(self._server_metadata.get("transport", {}).get("deadlines", False))
+        if (deadline_ms is not None or coalesce) and not self._supports_deadlines:
+            logging.warning("The server does not support deadlines, requests will never be dropped.")
+        self._deadline_ms = deadline_ms
+        self._coalesce = coalesce
+
+        # State used by pipelined requests. The receiver thread is only started by the first `infer_async` call.
+        self._use_request_ids = bool(self._server_metadata.get("transport", {}).get("request_ids", False))
+        self._request_ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, concurrent.futures.Future] = {}
+        self._pending_in_order: Deque[concurrent.futures.Future] = collections.deque()
+        self._receiver: Optional[threading.Thread] = None
+        self._receiver_error: Optional[BaseException] = None
 
     def get_server_metadata(self) -> Dict:
         return self._server_metadata
 
+    @property
+    def wire_format(self) -> str:
+        return self._wire_format
+
+    @property
+    def transport(self) -> str:
+        """The transport that is actually used, which may differ from the requested one."""
+        return TRANSPORT_WEBSOCKET if self._shm is None else TRANSPORT_SHM
+
     def _wait_for_server(self) -> Tuple[websockets.sync.client.ClientConnection, Dict]:
         logging.info(f"Waiting for server at {self._uri}...")
         while True:
@@ -40,16 +164,183 @@ class WebsocketClientPolicy(_base_policy.BasePolicy):
                 logging.info("Still waiting for server...")
                 time.sleep(5)
 
+    def _negotiate_image_codec(self, image_codec: str) -> str:
+        if image_codec == image_tools.IMAGE_CODEC_RAW:
+            return image_codec
+        server_codecs = self._server_metadata.get("transport", {}).get("image_codecs", [])
+        if image_codec not in server_codecs:
+            raise ValueError(f"Image codec {image_codec!r} is not supported by the server: {server_codecs}")
+        return image_codec
+
+    def _negotiate_wire_format(self, wire_format: Optional[str]) -> str:
+        transport = self._server_metadata.get("transport", {})
+        server_formats = transport.get("wire_formats", [msgpack_numpy.WIRE_FORMAT_MSGPACK])
+        if wire_format is not None:
+            if wire_format not in server_formats:
+                raise ValueError(f"Wire format {wire_format!r} is not supported by the server: {server_formats}")
+            return wire_format
+        return next(f for f in msgpack_numpy.WIRE_FORMATS if f in server_formats)
+
+    def _attach_shared_memory(self, num_slots: int, slot_size: int) -> Optional[_shared_memory.SharedMemoryRing]:
+        shm_metadata = self._server_metadata.get("transport", {}).get("shared_memory", False)
+        if not isinstance(shm_metadata, dict):
+            # Also the case for servers on other hosts.
+            logging.warning("The server does not offer the shared-memory transport, using websocket instead.")
+            return None
+        ring = _shared_memory.SharedMemoryRing.create(num_slots, slot_size, name_prefix=shm_metadata["name_prefix"])
+        self._ws.send(msgpack_numpy.packb({_shared_memory.SHM_ATTACH_KEY: ring.describe()}))
+        reply = msgpack_numpy.unpackb(self._ws.recv())
+        if not reply[_shared_memory.SHM_ATTACH_KEY]:
+            # Typically because the server runs on a different host.
+            logging.warning(f"The server could not attach to shared memory, using websocket instead: {reply['error']}")
+            ring.close()
+            return None
+        return ring
+
     @override
     def infer(self, obs: Dict) -> Dict:  # noqa: UP006
-        data = self._packer.pack(obs)
-        self._ws.send(data)
-        response = self._ws.recv()
-        if isinstance(response, str):
+        if self._receiver is not None:
+            # Responses are consumed by the receiver thread once pipelining is in use.
+            return self.infer_async(obs).result()
+        self._send(self._add_deadline(obs, self._deadline_ms), self._acquire_slot())
+        return _check_status(self._recv())
+
+    def infer_async(self, obs: Dict, *, deadline_ms: Optional[float] = None) -> concurrent.futures.Future:  # noqa: UP006
+        """Sends an observation without waiting for the response.
+
+        The observation must not be modified until the returned future is done. Can be called from any thread.
+
+        Args:
+            obs: The observation.
+            deadline_ms: Overrides the default deadline of the client for this request.
+
+        Returns:
+            A future that resolves to the same result `infer` would return, or fails with `RequestDroppedError` if the
+            server dropped the request.
+        """
+        obs = self._add_deadline(obs, self._deadline_ms if deadline_ms is None else deadline_ms)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        # Waiting for a slot must not hold the send lock, which the receiver needs to fail the pending requests.
+        slot = self._acquire_slot()
+        with self._send_lock:
+            if self._receiver_error is not None:
+                if slot is not None:
+                    self._shm.release(slot)
+                raise RuntimeError("The connection to the policy server failed.") from self._receiver_error
+            if self._receiver is None:
+                self._receiver = threading.Thread(target=self._receive_loop, name="policy_client_receiver", daemon=True)
+                self._receiver.start()
+
+            if self._use_request_ids:
+                request_id = next(self._request_ids)
+                self._pending[request_id] = future
+                obs = {**obs, REQUEST_ID_KEY: request_id}
+            else:
+                self._pending_in_order.append(future)
+            self._send(obs, slot)
+        return future
+
+    async def ainfer(self, obs: Dict, *, deadline_ms: Optional[float] = None) -> Dict:  # noqa: UP006
+        """Asyncio variant of `infer_async`. Several calls can be awaited concurrently."""
+        return await asyncio.wrap_future(self.infer_async(obs, deadline_ms=deadline_ms))
+
+    def close(self) -> None:
+        """Closes the connection. Pending requests fail with a `ConnectionClosed` error."""
+        self._ws.close()
+        if self._receiver is not None:
+            self._receiver.join()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def _add_deadline(self, obs: Dict, deadline_ms: Optional[float]) -> Dict:  # noqa: UP006
+        if not self._supports_deadlines or (deadline_ms is None and not self._coalesce):
+            return obs
+        obs = dict(obs)
+        if deadline_ms is not None:
+            obs[DEADLINE_KEY] = deadline_ms
+        if self._coalesce:
+            obs[COALESCE_KEY] = True
+        return obs
+
+    def _acquire_slot(self) -> Optional[int]:
+        """Waits for a free shared-memory slot, or returns None if shared memory is not used.
+
+        Raises:
+            RuntimeError: If the connection fails while waiting, in which case the busy slots are never freed.
+        """
+        if self._shm is None:
+            return None
+        while True:
+            slot = self._shm.acquire(timeout=_SLOT_POLL_INTERVAL)
+            if slot is not None:
+                return slot
+            if self._receiver_error is not None:
+                raise RuntimeError("The connection to the policy server failed.") from self._receiver_error
+            if self._ws.protocol.state is websockets.protocol.State.CLOSED:
+                raise RuntimeError("The connection to the policy server is closed.")
+
+    def _send(self, obs: Dict, slot: Optional[int]) -> None:  # noqa: UP006
+        if self._shm is not None and slot is not None:
+            size = self._shm.write(slot, _shared_memory.REQUEST, obs)
+            if size is not None:
+                self._ws.send(msgpack_numpy.packb({_shared_memory.SHM_KEY: {"slot": slot, "size": size}}))
+                return
+            # Too large for shared memory, the server answers without referring to the slot.
+            self._shm.release(slot)
+
+        if self._wire_format == msgpack_numpy.WIRE_FORMAT_OOB:
+            self._ws.send(
+                msgpack_numpy.pack_frames(obs, image_codec=self._image_codec, image_quality=self._image_quality)
+            )
+        else:
+            self._ws.send(self._packer.pack(obs))
+
+    def _receive_loop(self) -> None:
+        try:
+            while True:
+                response = self._recv()
+                if self._use_request_ids:
+                    future = self._pending.pop(response.pop(REQUEST_ID_KEY))
+                else:
+                    future = self._pending_in_order.popleft()
+                try:
+                    future.set_result(_check_status(response))
+                except RequestDroppedError as e:
+                    future.set_exception(e)
+        except Exception as e:
+            with self._send_lock:
+                self._receiver_error = e
+                futures = [*self._pending.values(), *self._pending_in_order]
+                self._pending.clear()
+                self._pending_in_order.clear()
+            for future in futures:
+                future.set_exception(e)
+
+    def _recv(self) -> Dict:
+        frames = self._ws.recv_streaming()
+        first = next(frames)
+        if isinstance(first, str):
             # we're expecting bytes; if the server sends a string, it's an error.
+            response = first + "".join(frames)
             raise RuntimeError(f"Error in inference server:\n{response}")
-        return msgpack_numpy.unpackb(response)
+        response = msgpack_numpy.unpack_frames(itertools.chain([first], frames))
+
+        control = response.pop(_shared_memory.SHM_KEY, None)
+        if control is not None:
+            assert self._shm is not None
+            if "size" in control:
+                response = self._shm.read(control["slot"], _shared_memory.RESPONSE, control["size"])
+            self._shm.release(control["slot"])
+        return response
 
     @override
     def reset(self) -> None:
         pass
+
+
+def _check_status(response: Dict) -> Dict:  # noqa: UP006
+    status = response.pop(STATUS_KEY, None)
+    if status is not None:
+        raise RequestDroppedError(status, response.get("server_timing"))
+    return response
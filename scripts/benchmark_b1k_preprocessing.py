@@ -0,0 +1,94 @@
+"""Measures the host CPU time the B1K evaluation wrappers spend turning an observation into policy inputs.
+
+Compares the previous path (one PIL resize per camera, stacking, a deep copy and a transpose check before every
+inference) with `B1KPreprocessor`. Both include the shallow tree copy `Policy.infer` makes of its inputs. The amortized
+time also accounts for the previous path preprocessing every step, while the wrappers now only preprocess the
+observation on the steps that run the policy.
+"""
+
+import copy
+import dataclasses
+import time
+
+import jax
+import numpy as np
+from openpi_client import image_tools
+import tyro
+
+from openpi.shared import b1k_preprocessing
+
+
+@dataclasses.dataclass
+class Args:
+    # Camera resolutions of the environment.
+    head_size: int = 720
+    wrist_size: int = 480
+    # Number of timed steps per path.
+    num_steps: int = 200
+    # Steps between inferences, as in the "fine" config of `B1KPolicyWrapper`.
+    replan_interval: int = 12
+
+
+def _make_obs(args: Args, rng: np.random.Generator) -> dict:
+    sizes = [args.head_size, args.wrist_size, args.wrist_size]
+    obs = {
+        obs_key: rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+        for obs_key, size in zip(b1k_preprocessing.CAMERA_KEYS.values(), sizes, strict=True)
+    }
+    obs[b1k_preprocessing.PROPRIO_KEY] = rng.random(256)
+    obs["task_id"] = 0
+    return obs
+
+
+def _legacy_preprocess(obs: dict) -> dict:
+    img_obs = np.stack(
+        [
+            image_tools.resize_with_pad(obs[obs_key][None, ..., :3], 224, 224)
+            for obs_key in b1k_preprocessing.CAMERA_KEYS.values()
+        ],
+        axis=1,
+    )
+    processed = {
+        "observation": img_obs,
+        "proprio": obs[b1k_preprocessing.PROPRIO_KEY][None],
+        "prompt": "do something",
+        "task_index": int(obs["task_id"]),
+    }
+    nbatch = copy.deepcopy(processed)
+    if nbatch["observation"].shape[-1] != 3:
+        nbatch["observation"] = np.transpose(nbatch["observation"], (0, 1, 3, 4, 2))
+    return {
+        "observation/egocentric_camera": nbatch["observation"][0, 0],
+        "observation/wrist_image_left": nbatch["observation"][0, 1],
+        "observation/wrist_image_right": nbatch["observation"][0, 2],
+        "observation/state": nbatch["proprio"][0],
+        "prompt": processed["prompt"],
+        "task_index": processed["task_index"],
+    }
+
+
+def _time_ms(fn, observations: list[dict]) -> float:
+    fn(observations[0])
+    start = time.process_time()
+    for obs in observations:
+        # The copy made by `Policy.infer`.
+        jax.tree.map(lambda x: x, fn(obs))
+    return (time.process_time() - start) / len(observations) * 1000
+
+
+def main(args: Args) -> None:
+    rng = np.random.default_rng(0)
+    observations = [_make_obs(args, rng) for _ in range(args.num_steps)]
+    preprocessor = b1k_preprocessing.B1KPreprocessor()
+
+    legacy_ms = _time_ms(_legacy_preprocess, observations)
+    new_ms = _time_ms(lambda obs: preprocessor(obs, "do something"), observations)
+
+    print(f"cameras: head {args.head_size}x{args.head_size}, wrists {args.wrist_size}x{args.wrist_size}")
+    print(f"{'path':>15} {'CPU ms/inference':>17} {'CPU ms/step':>12}")
+    print(f"{'previous':>15} {legacy_ms:>17.3f} {legacy_ms:>12.3f}")
+    print(f"{'preprocessor':>15} {new_ms:>17.3f} {new_ms / args.replan_interval:>12.3f}")
+
+
+if __name__ == "__main__":
+    main(tyro.cli(Args))
@@ -0,0 +1,128 @@
+"""Compares the image codecs supported by the websocket transport.
+
+For every codec, reports the number of bytes sent per request, the client-side encode time, the server-side decode time
+and the end-to-end round-trip latency. By default a local server with a stub policy is started, so only the transport is
+measured. Pass `--host` to benchmark against a running policy server instead (the observations must then match the
+inputs expected by that policy).
+"""
+
+import dataclasses
+import logging
+import socket
+import threading
+import time
+
+import numpy as np
+from openpi_client import base_policy as _base_policy
+from openpi_client import image_tools
+from openpi_client import msgpack_numpy
+from openpi_client import websocket_client_policy as _websocket_client_policy
+import tyro
+
+from openpi.serving import websocket_policy_server
+
+
+@dataclasses.dataclass
+class Args:
+    # Host of a running policy server. If None, a local server with a stub policy is started.
+    host: str | None = None
+    # Port of the policy server.
+    port: int = 8000
+    # Codecs to compare.
+    codecs: tuple[str, ...] = image_tools.IMAGE_CODECS
+    # Wire format used by the client.
+    wire_format: str = msgpack_numpy.WIRE_FORMAT_OOB
+    # JPEG quality.
+    quality: int = 90
+    # Number of cameras in each observation.
+    num_cameras: int = 3
+    # Image resolution.
+    height: int = 224
+    width: int = 224
+    # Number of timed requests per codec.
+    num_requests: int = 100
+
+
+class _StubPolicy(_base_policy.BasePolicy):
+    def infer(self, obs: dict) -> dict:
+        return {"actions": np.zeros((50, 23), dtype=np.float32)}
+
+
+def _make_observation(args: Args, rng: np.random.Generator) -> dict:
+    # Smooth gradients with a bit of sensor noise compress roughly like real camera frames; uniform noise would not
+    # compress at all.
+    y, x = np.mgrid[: args.height, : args.width]
+    obs = {}
+    for i in range(args.num_cameras):
+        base = np.stack([x * (1 + i), y * (2 + i), x + y], axis=-1) * 255.0 / (args.height + args.width)
+        image = np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+        obs[f"observation/camera_{i}"] = image
+    obs["observation/state"] = rng.random(23)
+    obs["prompt"] = "pick up the radio"
+    return obs
+
+
+def _pack(obs: dict, args: Args, codec: str) -> list:
+    if args.wire_format == msgpack_numpy.WIRE_FORMAT_OOB:
+        return msgpack_numpy.pack_frames(obs, image_codec=codec, image_quality=args.quality)
+    return [msgpack_numpy.packb(obs, default=msgpack_numpy.make_pack_array(codec, image_quality=args.quality))]
+
+
+def _is_listening(port: int) -> bool:
+    try:
+        with socket.create_connection(("localhost", port), timeout=0.1):
+            return True
+    except OSError:
+        return False
+
+
+def _start_local_server(port: int) -> None:
+    server = websocket_policy_server.WebsocketPolicyServer(_StubPolicy(), host="localhost", port=port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    while not _is_listening(port):
+        time.sleep(0.05)
+
+
+def main(args: Args) -> None:
+    host = args.host
+    if host is None:
+        host = "localhost"
+        _start_local_server(args.port)
+
+    rng = np.random.default_rng(0)
+    observations = [_make_observation(args, rng) for _ in range(8)]
+
+    print(f"{'codec':>6} {'bytes/req':>12} {'encode ms':>10} {'decode ms':>10} {'e2e p50 ms':>11} {'e2e p99 ms':>11}")
+    for codec in args.codecs:
+        sizes, encode_ms, decode_ms = [], [], []
+        for obs in observations:
+            start = time.perf_counter()
+            frames = _pack(obs, args, codec)
+            encode_ms.append((time.perf_counter() - start) * 1000)
+            sizes.append(sum(memoryview(f).nbytes for f in frames))
+
+            start = time.perf_counter()
+            msgpack_numpy.decode_images(msgpack_numpy.unpack_frames(frames, lazy_images=True))
+            decode_ms.append((time.perf_counter() - start) * 1000)
+
+        client = _websocket_client_policy.WebsocketClientPolicy(
+            host=host, port=args.port, wire_format=args.wire_format, image_codec=codec, image_quality=args.quality
+        )
+        # Warm up the connection (and the policy, if a real server is used).
+        client.infer(observations[0])
+        latencies = []
+        for i in range(args.num_requests):
+            start = time.perf_counter()
+            client.infer(observations[i % len(observations)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        print(
+            f"{codec:>6} {np.mean(sizes):>12.0f} {np.mean(encode_ms):>10.2f} {np.mean(decode_ms):>10.2f} "
+            f"{np.percentile(latencies, 50):>11.2f} {np.percentile(latencies, 99):>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    # Keep the connection logs from interleaving with the results table.
+    logging.basicConfig(level=logging.WARNING, force=True)
+    main(tyro.cli(Args))
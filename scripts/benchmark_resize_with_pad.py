@@ -0,0 +1,73 @@
+"""Compares `openpi_client.image_tools.resize_with_pad` (PIL) with the opt-in `resize_with_pad_numpy`.
+
+For every source resolution and batch size, reports the time per batch of both implementations, the one-time cost of
+building the NumPy resize plan, and how far the NumPy results are from PIL's.
+"""
+
+import dataclasses
+import time
+import timeit
+
+import numpy as np
+from openpi_client import image_tools
+import tyro
+
+
+@dataclasses.dataclass
+class Args:
+    # Source resolutions as (height, width).
+    sources: tuple[tuple[int, int], ...] = ((720, 720), (480, 480), (480, 640))
+    # Target resolution.
+    height: int = 224
+    width: int = 224
+    # Numbers of images resized per call.
+    batch_sizes: tuple[int, ...] = (1, 3, 8)
+    # Number of timed calls per configuration.
+    num_calls: int = 20
+
+
+def _make_images(batch_size: int, height: int, width: int, rng: np.random.Generator) -> np.ndarray:
+    y, x = np.mgrid[:height, :width]
+    base = np.stack([x, y, x + y], axis=-1) * 255.0 / (height + width)
+    return np.clip(base + rng.normal(0, 8, (batch_size, height, width, 3)), 0, 255).astype(np.uint8)
+
+
+def _time_ms(fn, num_calls: int) -> float:
+    # The fastest of several repeats, since other processes add a lot of noise to single runs.
+    return min(timeit.repeat(fn, number=max(num_calls // 5, 1), repeat=5)) / max(num_calls // 5, 1) * 1000
+
+
+def _compare(args: Args, images: np.ndarray) -> tuple[float, float, float, int]:
+    src_height, src_width = images.shape[1:3]
+    image_tools._resize_plan.cache_clear()  # noqa: SLF001
+    start = time.perf_counter()
+    image_tools._resize_plan(src_height, src_width, args.height, args.width)  # noqa: SLF001
+    plan_ms = (time.perf_counter() - start) * 1000
+
+    expected = image_tools.resize_with_pad(images, args.height, args.width)
+    out = np.empty_like(expected)
+    image_tools.resize_with_pad_numpy(images, args.height, args.width, out=out)
+    max_diff = int(np.abs(out.astype(np.int32) - expected).max())
+
+    pil_ms = _time_ms(lambda: image_tools.resize_with_pad(images, args.height, args.width), args.num_calls)
+    numpy_ms = _time_ms(
+        lambda: image_tools.resize_with_pad_numpy(images, args.height, args.width, out=out), args.num_calls
+    )
+    return pil_ms, numpy_ms, plan_ms, max_diff
+
+
+def main(args: Args) -> None:
+    rng = np.random.default_rng(0)
+    print(f"{'source':>10} {'batch':>6} {'PIL ms':>9} {'NumPy ms':>9} {'speedup':>8} {'plan ms':>8} {'max diff':>9}")
+    for src_height, src_width in args.sources:
+        for batch_size in args.batch_sizes:
+            images = _make_images(batch_size, src_height, src_width, rng)
+            pil_ms, numpy_ms, plan_ms, max_diff = _compare(args, images)
+            print(
+                f"{f'{src_height}x{src_width}':>10} {batch_size:>6} {pil_ms:>9.2f} {numpy_ms:>9.2f} "
+                f"{pil_ms / numpy_ms:>7.1f}x {plan_ms:>8.2f} {max_diff:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main(tyro.cli(Args))
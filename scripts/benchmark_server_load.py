@@ -0,0 +1,294 @@
+"""Load-tests a policy server with simulated closed-loop clients.
+
+Every client sends an observation at a fixed control rate and waits for the action before it sends the next one, like
+a robot control loop. A step whose response arrives later than one control period after it was due counts as a
+deadline miss, and the steps that were due in the meantime are skipped. Observations are replayed from a
+`PolicyRecorder` directory or synthesized.
+
+Reports the throughput, the end-to-end latency percentiles, the deadline misses, and the mean and p99 of every stage
+reported by the server (`server_timing`) and the policy (`policy_timing`).
+
+By default a local server with a stub policy is started, so only the transport and the server are measured and no
+accelerator is needed. Use `--stub-latency-ms` to emulate the model's inference time. Pass `--host` to load-test a
+running policy server instead.
+"""
+
+import concurrent.futures
+import dataclasses
+import enum
+import json
+import logging
+import pathlib
+import socket
+import threading
+import time
+
+import numpy as np
+from openpi_client import base_policy as _base_policy
+from openpi_client import image_tools
+from openpi_client import websocket_client_policy as _websocket_client_policy
+import tyro
+
+from openpi.policies import policy_records as _policy_records
+from openpi.serving import websocket_policy_server
+
+
+class Source(enum.Enum):
+    """Where the observations come from."""
+
+    # Random observations from `b1k_policy.make_b1k_example`.
+    B1K = "b1k"
+    # Smooth random images with `--num-cameras` cameras, without any robot-specific dependencies.
+    SYNTHETIC = "synthetic"
+    # Inputs recorded by `PolicyRecorder` in `--records-dir`.
+    RECORDS = "records"
+
+
+@dataclasses.dataclass
+class Args:
+    # Host of a running policy server. If None, a local server with a stub policy is started.
+    host: str | None = None
+    # Port of the policy server.
+    port: int = 8000
+
+    # Where the observations come from.
+    source: Source = Source.B1K
+    # Directory written by `PolicyRecorder`, used with `--source records`.
+    records_dir: pathlib.Path | None = None
+    # Maximum number of recorded steps to replay.
+    max_records: int = 1000
+    # Number of cameras of synthetic observations.
+    num_cameras: int = 3
+
+    # Number of concurrent clients.
+    num_clients: int = 4
+    # Control rate of every client.
+    hz: float = 15.0
+    # Duration of the measurement, after one warmup request per client.
+    duration_s: float = 30.0
+    # Let the server drop requests that can't be started within one control period (see `deadline_ms` of the client).
+    server_deadlines: bool = False
+    # Client options.
+    image_codec: str = image_tools.IMAGE_CODEC_RAW
+    transport: str = _websocket_client_policy.TRANSPORT_WEBSOCKET
+
+    # Options of the local stub server.
+    stub_latency_ms: float = 0.0
+    max_batch_size: int = 1
+    max_batch_wait_ms: float = 5.0
+
+    # Write the report to this JSON file.
+    output: pathlib.Path | None = None
+
+
+class _StubPolicy(_base_policy.BasePolicy):
+    """Sleeps instead of running a model. Batches take as long as single observations, like on an accelerator."""
+
+    def __init__(self, latency_ms: float) -> None:
+        self._latency_s = latency_ms / 1000
+
+    def infer(self, obs: dict) -> dict:
+        return self.infer_batch([obs])[0]
+
+    def infer_batch(self, obs: list[dict]) -> list[dict]:
+        time.sleep(self._latency_s)
+        return [{"actions": np.zeros((50, 23), dtype=np.float32)} for _ in obs]
+
+
+@dataclasses.dataclass
+class _ClientStats:
+    latencies_ms: list[float] = dataclasses.field(default_factory=list)
+    timings: list[dict[str, float]] = dataclasses.field(default_factory=list)
+    deadline_misses: int = 0
+    skipped_steps: int = 0
+    dropped: dict[str, int] = dataclasses.field(default_factory=dict)
+
+
+def load_observations(args: Args) -> list[dict]:
+    match args.source:
+        case Source.B1K:
+            # Imported here since it requires the BEHAVIOR dependencies.
+            from openpi.policies import b1k_policy
+
+            return [b1k_policy.make_b1k_example() for _ in range(16)]
+        case Source.SYNTHETIC:
+            rng = np.random.default_rng(0)
+            return [_synthetic_observation(args.num_cameras, rng) for _ in range(16)]
+        case Source.RECORDS:
+            if args.records_dir is None:
+                raise ValueError("--records-dir is required with --source records")
+            reader = _policy_records.RecordReader(args.records_dir)
+            if len(reader) == 0:
+                raise ValueError(f"No records in {args.records_dir}")
+            keys = [key for key in reader.keys if key.startswith("inputs/")]
+            data = reader.read(0, args.max_records, keys=keys)
+            # Keys of the observation itself may contain "/", so only the "inputs" level is removed.
+            flat = {key.removeprefix("inputs/"): value for key, value in data.items()}
+            num_steps = len(next(iter(flat.values())))
+            return [{key: _to_python(value[i]) for key, value in flat.items()} for i in range(num_steps)]
+
+
+def _synthetic_observation(num_cameras: int, rng: np.random.Generator) -> dict:
+    y, x = np.mgrid[:224, :224]
+    obs = {}
+    for i in range(num_cameras):
+        base = np.stack([x * (1 + i), y * (2 + i), x + y], axis=-1) * 255.0 / 448
+        obs[f"observation/camera_{i}"] = np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+    obs["observation/joint_position"] = rng.random(23)
+    obs["prompt"] = "pick up the radio"
+    return obs
+
+
+def _to_python(value: np.ndarray):
+    # Strings are recorded as numpy string arrays.
+    return str(value) if value.dtype.kind in "SU" else value
+
+
+def _start_local_server(args: Args) -> None:
+    server = websocket_policy_server.WebsocketPolicyServer(
+        _StubPolicy(args.stub_latency_ms),
+        host="localhost",
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_batch_wait_ms=args.max_batch_wait_ms,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    while True:
+        with socket.socket() as sock:
+            if sock.connect_ex(("localhost", args.port)) == 0:
+                return
+        time.sleep(0.05)
+
+
+def run_client(args: Args, host: str, observations: list[dict], offset: int, start_time: float) -> _ClientStats:
+    period = 1.0 / args.hz
+    client = _websocket_client_policy.WebsocketClientPolicy(
+        host=host,
+        port=args.port,
+        image_codec=args.image_codec,
+        transport=args.transport,
+        deadline_ms=period * 1000 if args.server_deadlines else None,
+    )
+    # Spread the clients over the control period so that they don't all send at once.
+    next_step = start_time + period * offset / args.num_clients
+    stats = _ClientStats()
+    step = offset
+    try:
+        while next_step < start_time + args.duration_s:
+            time.sleep(max(next_step - time.monotonic(), 0))
+            sent = time.monotonic()
+            try:
+                result = client.infer(observations[step % len(observations)])
+            except _websocket_client_policy.RequestDroppedError as e:
+                stats.dropped[e.status] = stats.dropped.get(e.status, 0) + 1
+                stats.deadline_misses += 1
+            else:
+                latency = time.monotonic() - sent
+                stats.latencies_ms.append(latency * 1000)
+                stats.timings.append(
+                    {
+                        **{f"server/{k}": v for k, v in result.get("server_timing", {}).items()},
+                        **{f"policy/{k}": v for k, v in result.get("policy_timing", {}).items()},
+                    }
+                )
+                if time.monotonic() > next_step + period:
+                    stats.deadline_misses += 1
+            step += 1
+            next_step += period
+            # Steps that were due while waiting for the response are skipped, like a control loop would.
+            while next_step < time.monotonic():
+                next_step += period
+                stats.skipped_steps += 1
+    finally:
+        client.close()
+    return stats
+
+
+def summarize(args: Args, stats: list[_ClientStats]) -> dict:
+    latencies = np.concatenate([s.latencies_ms for s in stats]) if any(s.latencies_ms for s in stats) else np.zeros(0)
+    num_steps = sum(len(s.latencies_ms) + sum(s.dropped.values()) for s in stats)
+    dropped: dict[str, int] = {}
+    for s in stats:
+        for status, count in s.dropped.items():
+            dropped[status] = dropped.get(status, 0) + count
+
+    stages: dict[str, list[float]] = {}
+    for s in stats:
+        for timings in s.timings:
+            for key, value in timings.items():
+                # `prev_total_ms` refers to the previous request and duplicates the end-to-end latency.
+                if key.endswith("_ms") and key != "server/prev_total_ms":
+                    stages.setdefault(key, []).append(value)
+
+    report = {
+        "num_clients": args.num_clients,
+        "hz": args.hz,
+        "target_throughput": args.num_clients * args.hz,
+        "throughput": len(latencies) / args.duration_s,
+        "num_steps": num_steps,
+        "deadline_misses": sum(s.deadline_misses for s in stats),
+        "skipped_steps": sum(s.skipped_steps for s in stats),
+        "dropped": dropped,
+        "latency_ms": _percentiles(latencies),
+        "stages_ms": {key: _percentiles(np.asarray(values)) for key, values in sorted(stages.items())},
+    }
+    report["deadline_miss_rate"] = report["deadline_misses"] / max(num_steps, 1)
+    return report
+
+
+def _percentiles(values: np.ndarray) -> dict[str, float]:
+    if len(values) == 0:
+        return {}
+    return {
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['num_clients']} clients at {report['hz']:g} Hz: {report['throughput']:.1f} req/s "
+        f"(target {report['target_throughput']:.1f}), {report['deadline_misses']} deadline misses "
+        f"({report['deadline_miss_rate']:.1%}), {report['skipped_steps']} skipped steps, dropped {report['dropped']}"
+    )
+    print(f"{'stage':>34} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, values in [("end-to-end", report["latency_ms"]), *report["stages_ms"].items()]:
+        if values:
+            print(
+                f"{name:>34} {values['mean']:>9.2f} {values['p50']:>9.2f} {values['p90']:>9.2f} "
+                f"{values['p99']:>9.2f} {values['max']:>9.2f}"
+            )
+
+
+def main(args: Args) -> None:
+    host = args.host
+    if host is None:
+        host = "localhost"
+        _start_local_server(args)
+
+    observations = load_observations(args)
+    # Warm up the server (and compile the policy, if a real server is used) before measuring.
+    warmup_client = _websocket_client_policy.WebsocketClientPolicy(host=host, port=args.port)
+    warmup_client.infer(observations[0])
+    warmup_client.close()
+
+    start_time = time.monotonic() + 1.0
+    with concurrent.futures.ThreadPoolExecutor(args.num_clients) as executor:
+        futures = [
+            executor.submit(run_client, args, host, observations, i, start_time) for i in range(args.num_clients)
+        ]
+        stats = [future.result() for future in futures]
+
+    report = summarize(args, stats)
+    print_report(report)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    # Keep the connection logs from interleaving with the report.
+    logging.basicConfig(level=logging.WARNING, force=True)
+    main(tyro.cli(Args))
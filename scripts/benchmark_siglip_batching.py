@@ -0,0 +1,76 @@
+"""Compares encoding the cameras with one SigLIP call per camera and with a single call on the stacked cameras.
+
+For every batch size, reports the time per batch of both paths, each compiled into one program as in
+`Pi0.embed_prefix`, and the largest difference between their image tokens. The weights are random, which doesn't
+affect the timings.
+"""
+
+import dataclasses
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import tyro
+
+import openpi.models.siglip as _siglip
+
+
+@dataclasses.dataclass
+class Args:
+    # Numbers of observations per batch.
+    batch_sizes: tuple[int, ...] = (1, 8, 32)
+    num_cameras: int = 3
+    resolution: int = 224
+    # SigLIP variant and dtype of the matmuls, as used by Pi0.
+    variant: str = "So400m/14"
+    dtype: str = "bfloat16"
+    # Number of timed calls per path and batch size.
+    num_calls: int = 10
+
+
+def _time_ms(fn, *args, num_calls: int) -> float:
+    jax.block_until_ready(fn(*args))
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        jax.block_until_ready(fn(*args))
+    return (time.perf_counter() - start) / num_calls * 1000
+
+
+def main(args: Args) -> None:
+    module = _siglip.Module(num_classes=2048, variant=args.variant, pool_type="none", scan=True, dtype_mm=args.dtype)
+    image_shape = (1, args.resolution, args.resolution, 3)
+    params = jax.jit(module.init, static_argnames="train")(jax.random.key(0), jnp.zeros(image_shape), train=False)
+
+    def encode(image):
+        return module.apply(params, image, train=False)
+
+    @jax.jit
+    def per_camera(images):
+        return [encode(image)[0] for image in images]
+
+    @jax.jit
+    def stacked(images):
+        return _siglip.encode_images(encode, images)
+
+    rng = np.random.default_rng(0)
+    print(f"{'batch':>6} {'per camera ms':>14} {'stacked ms':>11} {'speedup':>8} {'max diff':>9}")
+    for batch_size in args.batch_sizes:
+        images = [
+            jnp.asarray(rng.uniform(-1, 1, (batch_size, *image_shape[1:])), dtype=jnp.float32)
+            for _ in range(args.num_cameras)
+        ]
+        max_diff = max(
+            float(jnp.abs(a.astype(jnp.float32) - b.astype(jnp.float32)).max())
+            for a, b in zip(per_camera(images), stacked(images), strict=True)
+        )
+        per_camera_ms = _time_ms(per_camera, images, num_calls=args.num_calls)
+        stacked_ms = _time_ms(stacked, images, num_calls=args.num_calls)
+        print(
+            f"{batch_size:>6} {per_camera_ms:>14.1f} {stacked_ms:>11.1f} {per_camera_ms / stacked_ms:>7.2f}x "
+            f"{max_diff:>9.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main(tyro.cli(Args))
@@ -0,0 +1,93 @@
+"""Measures the per-step overhead of temporal ensembling in the B1K evaluation wrappers.
+
+Simulates `num_envs` environments that each execute one action per control step and receive a new action chunk every
+`replan_interval` steps, and compares `TemporalEnsembleBuffer` with the deque-based implementation it replaced. Reports
+the time per step of a single environment and the share of a control period spent on ensembling all environments.
+"""
+
+import collections
+import dataclasses
+import time
+
+import numpy as np
+import tyro
+
+from openpi.shared import temporal_ensemble
+
+
+@dataclasses.dataclass
+class Args:
+    # Number of simulated environments.
+    num_envs: int = 64
+    # Control rate of every environment.
+    hz: float = 30.0
+    # Number of control steps per environment.
+    num_steps: int = 2000
+    # Ensembling parameters, defaulting to the "fine" config of `B1KPolicyWrapper`.
+    ensemble_max: int = 6
+    max_len: int = 72
+    replan_interval: int = 12
+    exp_k_value: float = 0.005
+    action_dim: int = 23
+
+
+class _DequeEnsemble:
+    """The previous implementation: a deque of per-chunk deques."""
+
+    def __init__(self, args: Args) -> None:
+        self._args = args
+        self._queue = collections.deque()
+
+    def add(self, actions: np.ndarray) -> None:
+        self._queue.append(collections.deque(actions[: self._args.max_len]))
+        while len(self._queue) > self._args.ensemble_max:
+            self._queue.popleft()
+
+    def step(self) -> np.ndarray:
+        current = np.empty((len(self._queue), self._queue[0][0].shape[0]))
+        for i in range(len(self._queue)):
+            current[i] = self._queue[i].popleft()
+        self._queue = collections.deque([q for q in self._queue if len(q) > 0])
+        weights = np.exp(self._args.exp_k_value * np.arange(current.shape[0]))
+        weights = weights / weights.sum()
+        action = (current * weights[:, None]).sum(axis=0)
+        action[-9] = current[-1, -9]
+        action[-1] = current[-1, -1]
+        return action
+
+
+def _run(args: Args, envs: list, chunks: np.ndarray) -> float:
+    """Returns the mean time in seconds to step all environments once, including the addition of new chunks."""
+    start = time.perf_counter()
+    for step in range(args.num_steps):
+        for env, env_chunks in zip(envs, chunks, strict=True):
+            if step % args.replan_interval == 0:
+                env.add(env_chunks[(step // args.replan_interval) % len(env_chunks)])
+            env.step()
+    return (time.perf_counter() - start) / args.num_steps
+
+
+def main(args: Args) -> None:
+    rng = np.random.default_rng(0)
+    # A few chunks per environment, reused cyclically.
+    chunks = rng.normal(size=(args.num_envs, 8, args.max_len, args.action_dim)).astype(np.float32)
+
+    implementations = {
+        "deque": lambda: _DequeEnsemble(args),
+        "ring buffer": lambda: temporal_ensemble.TemporalEnsembleBuffer(
+            args.ensemble_max, args.max_len, args.action_dim, args.exp_k_value, passthrough_dims=(-9, -1)
+        ),
+    }
+    period_ms = 1000 / args.hz
+    print(f"{args.num_envs} envs at {args.hz:g} Hz ({period_ms:.1f} ms per control step)")
+    print(f"{'implementation':>15} {'us/env/step':>12} {'ms/step':>9} {'% of period':>12}")
+    for name, make in implementations.items():
+        step_s = _run(args, [make() for _ in range(args.num_envs)], chunks)
+        print(
+            f"{name:>15} {step_s / args.num_envs * 1e6:>12.2f} {step_s * 1000:>9.3f} "
+            f"{step_s * 1000 / period_ms:>12.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main(tyro.cli(Args))
@@ -0,0 +1,88 @@
+"""Measures how long `PaligemmaTokenizer` takes to tokenize pi05 prompts for training-sized batches.
+
+Compares the previous implementation, which formats the discretized state as a string and encodes the whole prompt,
+with the cached prompt prefixes and the state token table, and checks that both produce the same tokens.
+"""
+
+import dataclasses
+import time
+
+import numpy as np
+import tyro
+
+from openpi.models import tokenizer as _tokenizer
+
+
+@dataclasses.dataclass
+class Args:
+    # Number of samples per batch and number of timed batches.
+    batch_size: int = 256
+    num_batches: int = 20
+    # State dimension before padding, e.g. 23 for B1K.
+    state_dim: int = 23
+    # Number of distinct task prompts in the dataset.
+    num_tasks: int = 50
+    # Share of state dimensions that are invisible, as with proprio dropout.
+    invisible_pct: float = 0.1
+    max_token_len: int = 200
+
+
+def _string_tokenize(
+    tokenizer: _tokenizer.PaligemmaTokenizer, prompt: str, state: np.ndarray, visible: np.ndarray, max_len: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """The previous implementation of `PaligemmaTokenizer.tokenize` for pi05 prompts."""
+    cleaned_text = prompt.strip().replace("_", " ").replace("\n", " ")
+    discretized_state = np.digitize(state, bins=np.linspace(-1, 1, 256 + 1)[:-1]) - 1
+    state_str = " ".join(
+        str(x) if is_x_visible else "*" for x, is_x_visible in zip(discretized_state, visible, strict=True)
+    )
+    full_prompt = f"Task: {cleaned_text}, State: {state_str};\nAction: "
+    tokens = tokenizer._tokenizer.encode(full_prompt, add_bos=True)  # noqa: SLF001
+    if len(tokens) < max_len:
+        padding = [False] * (max_len - len(tokens))
+        return np.asarray(tokens + padding), np.asarray([True] * len(tokens) + padding)
+    return np.asarray(tokens[:max_len]), np.asarray([True] * max_len)
+
+
+def main(args: Args) -> None:
+    rng = np.random.default_rng(0)
+    tokenizer = _tokenizer.PaligemmaTokenizer(args.max_token_len)
+    prompts = [f"task_{i} pick up the object number {i} and put it into the box" for i in range(args.num_tasks)]
+    batches = [
+        [
+            (
+                prompts[rng.integers(args.num_tasks)],
+                rng.uniform(-1.1, 1.1, args.state_dim),
+                rng.random(args.state_dim) >= args.invisible_pct,
+            )
+            for _ in range(args.batch_size)
+        ]
+        for _ in range(args.num_batches)
+    ]
+
+    for batch in batches[:1]:
+        for prompt, state, visible in batch:
+            expected = _string_tokenize(tokenizer, prompt, state, visible, args.max_token_len)
+            actual = tokenizer.tokenize(prompt, state, visible)
+            for x, y in zip(actual, expected, strict=True):
+                np.testing.assert_array_equal(x, y)
+
+    implementations = {
+        "string": lambda prompt, state, visible: _string_tokenize(
+            tokenizer, prompt, state, visible, args.max_token_len
+        ),
+        "table": tokenizer.tokenize,
+    }
+    print(f"batch size {args.batch_size}, state dim {args.state_dim}, {args.num_tasks} tasks")
+    print(f"{'implementation':>15} {'ms/batch':>9} {'us/sample':>10}")
+    for name, tokenize in implementations.items():
+        start = time.perf_counter()
+        for batch in batches:
+            for prompt, state, visible in batch:
+                tokenize(prompt, state, visible)
+        batch_s = (time.perf_counter() - start) / args.num_batches
+        print(f"{name:>15} {batch_s * 1000:>9.2f} {batch_s / args.batch_size * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main(tyro.cli(Args))
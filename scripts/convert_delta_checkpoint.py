@@ -0,0 +1,118 @@
+"""Converts per-task checkpoints into delta checkpoints against a shared base checkpoint.
+
+For every checkpoint, the params are encoded as a delta against the base params (see `openpi.models.delta_params`) and
+written to `<output_dir>/<checkpoint name>/params_delta`. All other files of the checkpoint (e.g. assets) are copied
+as is, so the converted checkpoint can be passed to `create_trained_policy` like the original one.
+
+Reports the size on disk of the original and converted params, the reconstruction error, and the time it takes to
+load the full params and the delta params (with the base params already loaded, as when serving several tasks).
+"""
+
+import dataclasses
+import json
+import logging
+import pathlib
+import shutil
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import tyro
+
+from openpi.models import delta_params
+from openpi.models import model as _model
+from openpi.shared import download
+
+
+@dataclasses.dataclass
+class Args:
+    # Params directory of the base checkpoint, e.g. "gs://openpi-assets/checkpoints/pi05_base/params". Stored in the
+    # converted checkpoints, so it must be reachable from where they are loaded.
+    base_params: str
+    # Checkpoint directories to convert. Each must contain a `params` directory.
+    checkpoints: list[pathlib.Path]
+    # Directory to write the converted checkpoints to.
+    output_dir: pathlib.Path
+    # Use the sparse encoding if at most this fraction of the entries of a param changed.
+    max_sparse_density: float = 0.25
+    # Maximum rank of the low-rank encoding. The low-rank encoding is lossy, so it is disabled by default.
+    max_rank: int | None = None
+    # Maximum low-rank approximation error, relative to the norm of the param.
+    lowrank_tolerance: float = 1e-3
+    # Measure the load times of the full and the converted params.
+    measure_load_time: bool = True
+
+
+def _disk_size(path: pathlib.Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _load_time(load) -> float:
+    start_time = time.monotonic()
+    jax.block_until_ready(load())
+    return time.monotonic() - start_time
+
+
+def convert(args: Args, base: dict, checkpoint_dir: pathlib.Path) -> dict:
+    output_dir = args.output_dir / checkpoint_dir.name
+    shutil.copytree(checkpoint_dir, output_dir, ignore=shutil.ignore_patterns("params"), dirs_exist_ok=True)
+
+    finetuned = _model.restore_params(checkpoint_dir / "params", restore_type=np.ndarray)
+    options = delta_params.EncodeOptions(
+        max_sparse_density=args.max_sparse_density,
+        max_rank=args.max_rank,
+        lowrank_tolerance=args.lowrank_tolerance,
+    )
+    arrays, encodings, leaves = delta_params.encode(base, finetuned, options)
+    delta_dir = output_dir / delta_params.DELTA_DIR
+    delta_params.save(delta_dir, args.base_params, arrays, encodings)
+
+    report = {
+        "checkpoint": str(checkpoint_dir),
+        "output": str(output_dir),
+        "params_bytes": _disk_size(checkpoint_dir / "params"),
+        "delta_bytes": _disk_size(delta_dir),
+        "max_error": max((leaf.max_error for leaf in leaves), default=0.0),
+        "encodings": {
+            encoding: sum(leaf.encoding == encoding for leaf in leaves)
+            for encoding in (delta_params.ZERO, delta_params.SPARSE, delta_params.LOWRANK, delta_params.FULL)
+        },
+    }
+    if args.measure_load_time:
+        report["full_load_s"] = _load_time(
+            lambda: _model.restore_params(checkpoint_dir / "params", restore_type=jax.Array, dtype=jnp.bfloat16)
+        )
+        report["delta_load_s"] = _load_time(
+            lambda: delta_params.restore(delta_dir, restore_type=jax.Array, dtype=jnp.bfloat16)
+        )
+    return report
+
+
+def main(args: Args) -> None:
+    base = _model.restore_params(download.maybe_download(args.base_params), restore_type=np.ndarray)
+    if args.measure_load_time:
+        # Load the base params once so that the delta load times don't include them, as when serving several tasks.
+        delta_params.restore_base(args.base_params, jnp.bfloat16)
+
+    reports = []
+    for checkpoint_dir in args.checkpoints:
+        report = convert(args, base, checkpoint_dir)
+        reports.append(report)
+        line = (
+            f"{checkpoint_dir.name}: {report['params_bytes'] / 2**30:.2f} GiB -> {report['delta_bytes'] / 2**30:.2f} "
+            f"GiB, max error {report['max_error']:.2e}, encodings {report['encodings']}"
+        )
+        if args.measure_load_time:
+            line += f", load {report['full_load_s']:.2f}s -> {report['delta_load_s']:.2f}s"
+        print(line)
+
+    total_params = sum(r["params_bytes"] for r in reports)
+    total_delta = sum(r["delta_bytes"] for r in reports)
+    print(f"Total: {total_params / 2**30:.2f} GiB -> {total_delta / 2**30:.2f} GiB (+ base params)")
+    (args.output_dir / "delta_report.json").write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, force=True)
+    main(tyro.cli(Args))
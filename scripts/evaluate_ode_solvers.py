@@ -0,0 +1,165 @@
+"""Measures how far actions sampled with different ODE solvers are from the default sampler, as a function of the NFE.
+
+Replays observations recorded by `PolicyRecorder` (e.g. `serve_policy.py --record`) through a trained JAX policy. Every
+observation is sampled with the same noise by the baseline (10 Euler steps on a uniform grid) and by every solver
+configuration. For each configuration, reports the mean number of function evaluations (forward passes of the action
+expert), the mean squared error and the largest absolute error of the actions with respect to the baseline, and the time
+per batch. Errors are computed in the normalized action space of the model.
+
+Example:
+    uv run scripts/evaluate_ode_solvers.py --config pi05_b1k_inference_final --checkpoint-dir checkpoints/... \
+        --records-dir policy_records --methods euler heun dpm_2m --num-steps 2 3 5 10
+"""
+
+import dataclasses
+import json
+import logging
+import pathlib
+import time
+
+import jax
+import numpy as np
+import tyro
+
+from openpi.models import model as _model
+from openpi.models import ode_solvers
+from openpi.policies import policy_config as _policy_config
+from openpi.policies import policy_records as _policy_records
+from openpi.shared import nnx_utils
+from openpi.training import config as _config
+
+
+@dataclasses.dataclass
+class Args:
+    # Training config name and checkpoint directory of the policy.
+    config: str
+    checkpoint_dir: str
+    # Directory with the records of a `PolicyRecorder`.
+    records_dir: str
+    # Maximum number of recorded observations to replay.
+    max_records: int = 256
+    # Number of observations sampled together.
+    batch_size: int = 16
+
+    # Solver configurations to evaluate: every method with every number of steps and every schedule.
+    methods: tuple[ode_solvers.Method, ...] = ("euler", "midpoint", "heun", "rk4", "dpm_2m")
+    num_steps: tuple[int, ...] = (1, 2, 3, 4, 5, 6, 8, 10)
+    schedules: tuple[ode_solvers.Schedule, ...] = ("uniform", "shifted")
+    # Parameters of the "shifted" and "power" schedules.
+    shift: float = 2.0
+    exponent: float = 2.0
+    # Tolerances of early stopping, each evaluated with every method and the largest number of steps.
+    tolerances: tuple[float, ...] = (1e-3, 1e-2)
+
+    # Only compare the first dimensions of the actions, e.g. to exclude padding. If None, all dimensions are compared.
+    action_dim: int | None = None
+    # Write the results to this JSON file.
+    output_path: str | None = None
+    seed: int = 0
+
+
+def _load_inputs(policy, args: Args) -> list[dict]:
+    """Returns the recorded observations after the input transforms of the policy."""
+    reader = _policy_records.RecordReader(args.records_dir)
+    if len(reader) == 0:
+        raise ValueError(f"No records in {args.records_dir}")
+    keys = [key for key in reader.keys if key.startswith("inputs/")]
+    data = reader.read(0, args.max_records, keys=keys)
+    # Keys of the observation itself may contain "/", so only the "inputs" level is removed.
+    flat = {key.removeprefix("inputs/"): value for key, value in data.items()}
+    num_records = len(next(iter(flat.values())))
+    observations = [
+        {key: str(value[i]) if value.dtype.kind in "SU" else value[i] for key, value in flat.items()}
+        for i in range(num_records)
+    ]
+    return [policy._input_transform(obs) for obs in observations]  # noqa: SLF001
+
+
+def _solvers(args: Args) -> list[tuple[ode_solvers.ODESolver, int]]:
+    solvers = [
+        (ode_solvers.ODESolver(method, schedule=schedule, shift=args.shift, exponent=args.exponent), num_steps)
+        for method in args.methods
+        for schedule in args.schedules
+        for num_steps in args.num_steps
+    ]
+    solvers += [
+        (ode_solvers.ODESolver(method, tolerance=tolerance), max(args.num_steps))
+        for method in args.methods
+        for tolerance in args.tolerances
+    ]
+    return solvers
+
+
+def main(args: Args) -> None:
+    train_config = _config.get_config(args.config)
+    policy = _policy_config.create_trained_policy(train_config, args.checkpoint_dir)
+    model = policy._model  # noqa: SLF001
+    if not hasattr(model, "sample_actions_with_nfe"):
+        raise ValueError("Only JAX flow matching models (pi0 and pi05) are supported.")
+    sample_actions = nnx_utils.module_jit(model.sample_actions_with_nfe)
+
+    items = _load_inputs(policy, args)
+    rng = np.random.default_rng(args.seed)
+    batches = []
+    for start in range(0, len(items), args.batch_size):
+        batch = jax.tree.map(lambda *xs: np.stack(xs), *items[start : start + args.batch_size])
+        noise = rng.standard_normal(
+            (len(items[start : start + args.batch_size]), model.action_horizon, model.action_dim)
+        )
+        batches.append((batch, noise.astype(np.float32)))
+    logging.info("Loaded %d observations in %d batches", len(items), len(batches))
+
+    def run(solver: ode_solvers.ODESolver, num_steps: int) -> tuple[np.ndarray, float, float]:
+        """Returns the actions of all observations, the mean NFE and the mean time per batch in ms."""
+        actions, nfes, elapsed = [], [], 0.0
+        for i, (batch, noise) in enumerate(batches):
+            observation = _model.Observation.from_dict(jax.tree.map(jax.numpy.asarray, batch))
+            if i == 0:
+                # Compile outside of the timed calls.
+                jax.block_until_ready(
+                    sample_actions(jax.random.key(0), observation, num_steps=num_steps, noise=noise, solver=solver)
+                )
+            start_time = time.perf_counter()
+            batch_actions, nfe = jax.block_until_ready(
+                sample_actions(jax.random.key(0), observation, num_steps=num_steps, noise=noise, solver=solver)
+            )
+            elapsed += time.perf_counter() - start_time
+            actions.append(np.asarray(batch_actions)[..., : args.action_dim])
+            nfes.append(int(nfe))
+        return np.concatenate(actions), float(np.mean(nfes)), elapsed / len(batches) * 1000
+
+    baseline, _, baseline_ms = run(ode_solvers.ODESolver(), 10)
+    results = []
+    print(
+        f"{'method':>9} {'schedule':>9} {'tolerance':>9} {'steps':>5} {'NFE':>5} {'MSE':>10} {'max err':>9} {'ms':>8}"
+    )
+    print(f"{'baseline':>9} {'uniform':>9} {'-':>9} {10:>5} {10:>5.1f} {0:>10.2e} {0:>9.2e} {baseline_ms:>8.1f}")
+    for solver, num_steps in _solvers(args):
+        actions, nfe, ms = run(solver, num_steps)
+        error = actions - baseline
+        result = {
+            "method": solver.method,
+            "schedule": solver.schedule,
+            "tolerance": solver.tolerance,
+            "num_steps": num_steps,
+            "nfe": nfe,
+            "mse": float(np.mean(error**2)),
+            "max_error": float(np.abs(error).max()),
+            "ms_per_batch": ms,
+        }
+        results.append(result)
+        tolerance = "-" if solver.tolerance is None else f"{solver.tolerance:g}"
+        print(
+            f"{solver.method:>9} {solver.schedule:>9} {tolerance:>9} {num_steps:>5} {nfe:>5.1f} "
+            f"{result['mse']:>10.2e} {result['max_error']:>9.2e} {ms:>8.1f}"
+        )
+
+    if args.output_path is not None:
+        pathlib.Path(args.output_path).write_text(
+            json.dumps({"baseline_ms_per_batch": baseline_ms, "results": results})
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, force=True)
+    main(tyro.cli(Args))
@@ -1,15 +1,21 @@
 import dataclasses
 import enum
+import functools
 import logging
+import pathlib
+import runpy
 import socket
 
+import jax
 import tyro
 
 from omnigibson.learning.utils.network_utils import WebsocketPolicyServer
 from omnigibson.learning.datas import BehaviorLerobotDatasetMetadata
 
+from openpi.policies import b1k_policy as _b1k_policy
 from openpi.policies import policy as _policy
-from openpi.policies import policy_config as _policy_config
+from openpi.policies import policy_cache as _policy_cache
+from openpi.shared import eval_b1k_wrapper as _eval_b1k_wrapper
 from openpi.shared.eval_b1k_wrapper import B1KPolicyWrapper
 from openpi.training import config as _config
 
@@ -29,7 +35,8 @@ class Checkpoint:
 
     # Training config name (e.g., "pi0_aloha_sim").
     config: str
-    # Checkpoint directory (e.g., "checkpoints/pi0_aloha_sim/exp/10000").
+    # Checkpoint directory (e.g., "checkpoints/pi0_aloha_sim/exp/10000"). Served for the tasks that don't have a
+    # task-specific checkpoint.
     dir: str
 
 
@@ -45,8 +52,8 @@ class Args:
     # Environment to serve the policy for. This is only used when serving default policies.
     env: EnvMode = EnvMode.ALOHA_SIM
 
-    # If provided, will be used in case the "prompt" key is not present in the data, or if the model doesn't have a default
-    # prompt.
+    # If provided, will be used in case the "prompt" key is not present in the data and the task has no prompt in the
+    # dataset metadata.
     default_prompt: str | None = None
 
     # Dataset root, used to retrieve the prompt of the task if taskname is not None.
@@ -59,6 +66,30 @@ class Args:
     # Record the policy's behavior for debugging.
     record: bool = False
 
+    # Compile padding, unnormalization and output slicing into the same program as the model, so that only the raw
+    # inputs are copied to the device and only the final actions are copied back.
+    fuse_transforms: bool = False
+
+    # Compile every policy loaded by the policy cache before it serves its first request.
+    warmup: bool = True
+    # Additional `num_steps` values to compile during warmup.
+    warmup_num_steps: tuple[int, ...] = ()
+    # Directory of the JAX persistent compilation cache. Compiled executables stored there are reused when the server
+    # is restarted. Set to None to disable the cache.
+    compilation_cache_dir: str | None = "~/.cache/jax"
+
+    # Device memory (in GB) for the weights of cached per-task policies. If None, 80% of the device memory is used.
+    policy_cache_device_gb: float | None = None
+    # Move policies evicted from device memory to host memory, so that switching back to their task is fast.
+    policy_cache_host_staging: bool = False
+    # Host memory (in GB) for staged and prefetched policies. If None, half of the system memory is used.
+    policy_cache_host_gb: float | None = None
+    # Task ids in the order in which they will be evaluated. The policies of the next `prefetch_lookahead` tasks are
+    # loaded in the background while the current task is evaluated. If None, the order of the sweep's task list
+    # (`task_instances.py`) is used. Pass no ids to disable prefetching.
+    task_order: tuple[int, ...] | None = None
+    prefetch_lookahead: int = 1
+
     # Specifies how to load the policy. If not provided, the default policy for the environment will be used.
     policy: Checkpoint | Default = dataclasses.field(default_factory=Default)
 
@@ -70,32 +101,73 @@ class Args:
     exp_k_value: float = 1.0
 
 
-def create_policy(args: Args, config: _config.TrainConfig) -> _policy.Policy:
-    """Create a policy from the given arguments."""
-    return _policy_config.create_trained_policy(
-        config, args.policy.dir, default_prompt=args.default_prompt
+# Task list of the evaluation sweep.
+TASK_INSTANCES_PATH = pathlib.Path(__file__).resolve().parents[1] / "task_instances.py"
+
+
+def default_task_order() -> tuple[int, ...]:
+    """Returns the ids of the tasks in `task_instances.py`, in the order in which the sweep evaluates them."""
+    task_instances = runpy.run_path(str(TASK_INSTANCES_PATH))
+    return tuple(task_instances["task_name_idx_map"][name] for name in task_instances["task_names"])
+
+
+def create_policy_cache(args: Args, config: _config.TrainConfig) -> _policy_cache.PolicyCache:
+    """Create the cache of per-task policies used by the B1K wrapper."""
+    if args.policy_cache_device_gb is not None:
+        budget = int(args.policy_cache_device_gb * 2**30)
+    else:
+        budget = _policy_cache.default_device_budget()
+
+    warmup = None
+    if args.warmup:
+        variants = [{}] + [{"num_steps": num_steps} for num_steps in args.warmup_num_steps]
+
+        def warmup(policy: _policy.Policy) -> None:
+            # Policies with fused transforms compile a function of the host-transformed inputs, so they are warmed up
+            # with an example of the inputs built by the B1K wrapper.
+            policy.warmup(
+                config.model.fake_obs,
+                sample_kwargs_variants=variants,
+                example=_b1k_policy.make_b1k_inputs_example(),
+            )
+
+    return _policy_cache.PolicyCache(
+        functools.partial(_eval_b1k_wrapper.create_policy, fuse_transforms=args.fuse_transforms),
+        max_device_bytes=budget,
+        # Without a budget, only keep the current policy on the device.
+        max_policies=1 if budget is None else None,
+        host_staging=args.policy_cache_host_staging,
+        max_host_bytes=None if args.policy_cache_host_gb is None else int(args.policy_cache_host_gb * 2**30),
+        host_loader=functools.partial(_eval_b1k_wrapper.create_host_policy, fuse_transforms=args.fuse_transforms),
+        warmup=warmup,
     )
 
 
 def main(args: Args) -> None:
-    config = _config.get_config(args.policy.config)
-    policy = create_policy(args, config)
-    policy_metadata = policy.metadata
-
-    # Record the policy's behavior.
-    if args.record:
-        policy = _policy.PolicyRecorder(policy, "policy_records")
+    if args.compilation_cache_dir is not None:
+        jax.config.update("jax_compilation_cache_dir", str(pathlib.Path(args.compilation_cache_dir).expanduser()))
 
+    config = _config.get_config(args.policy.config)
+    policy_cache = create_policy_cache(args, config)
+    # The wrapper loads (and warms up) the policy of its default task from the cache.
     policy = B1KPolicyWrapper(
-        policy,
+        None,
         config=config,
-        text_prompt="Hello, world!",
+        text_prompt=args.default_prompt if args.default_prompt is not None else "Hello, world!",
+        policy_cache=policy_cache,
+        # Record the policy's behavior.
+        record_dir="policy_records" if args.record else None,
+        default_ckpt_path=args.policy.dir,
         # control_mode=args.control_mode,
         # max_len=args.max_len,
         # action_horizon=args.action_horizon,
         # temporal_ensemble_max=args.temporal_ensemble_max,
         # exp_k_value=args.exp_k_value,
     )
+    policy_metadata = policy_cache.get(policy.ckpt_path).metadata
+    task_order = default_task_order() if args.task_order is None else args.task_order
+    if task_order:
+        policy.set_upcoming_tasks(task_order, lookahead=args.prefetch_lookahead)
 
     hostname = socket.gethostname()
     local_ip = socket.gethostbyname(hostname)
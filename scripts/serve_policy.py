@@ -1,12 +1,15 @@
 import dataclasses
 import enum
 import logging
+import pathlib
 import socket
 
+import jax
 import tyro
 
 from openpi.policies import policy as _policy
 from openpi.policies import policy_config as _policy_config
+from openpi.serving import replica_pool as _replica_pool
 from openpi.serving import websocket_policy_server
 from openpi.training import config as _config
 
@@ -51,6 +54,29 @@ class Args:
     # Record the policy's behavior for debugging.
     record: bool = False
 
+    # Maximum number of observations (across all connections) that are evaluated in a single forward pass. Values
+    # larger than 1 enable cross-connection batching.
+    max_batch_size: int = 1
+    # Maximum time to wait for a batch to fill up before it is dispatched.
+    max_batch_wait_ms: float = 5.0
+    # Maximum number of observations waiting for inference. Connections stop reading new messages when it is full.
+    max_queue_size: int = 64
+    # Number of threads used to decode compressed images sent by the clients.
+    num_decode_workers: int = 4
+
+    # Serve one model replica per group of this many local devices behind the same port, routing every batch to the
+    # least-loaded replica. With more than one device per replica, the weights are sharded across the group. If None,
+    # the policy is served from a single device.
+    devices_per_replica: int | None = None
+
+    # Compile the model for all batch sizes the server can use before accepting connections.
+    warmup: bool = True
+    # Additional `num_steps` values to compile during warmup, e.g. if clients may request a different number of steps.
+    warmup_num_steps: tuple[int, ...] = ()
+    # Directory of the JAX persistent compilation cache. Compiled executables stored there are reused when the server
+    # is restarted. Set to None to disable the cache.
+    compilation_cache_dir: str | None = "~/.cache/jax"
+
     # Specifies how to load the policy. If not provided, the default policy for the environment will be used.
     policy: Checkpoint | Default = dataclasses.field(default_factory=Default)
 
@@ -76,6 +102,25 @@ DEFAULT_CHECKPOINT: dict[EnvMode, Checkpoint] = {
 }
 
 
+def get_train_config(args: Args) -> _config.TrainConfig:
+    """Returns the training config of the policy that will be served."""
+    match args.policy:
+        case Checkpoint():
+            return _config.get_config(args.policy.config)
+        case Default():
+            if checkpoint := DEFAULT_CHECKPOINT.get(args.env):
+                return _config.get_config(checkpoint.config)
+            raise ValueError(f"Unsupported environment mode: {args.env}")
+
+
+def warmup_policy(policy: _policy.Policy, train_config: _config.TrainConfig, args: Args) -> None:
+    """Compiles the policy for every batch size the server may use."""
+    # Batches are padded to a few bucket sizes, so this only compiles one executable per bucket.
+    batch_sizes = range(1, args.max_batch_size + 1)
+    variants = [{}] + [{"num_steps": num_steps} for num_steps in args.warmup_num_steps]
+    policy.warmup(train_config.model.fake_obs, batch_sizes=batch_sizes, sample_kwargs_variants=variants)
+
+
 def create_default_policy(env: EnvMode, *, default_prompt: str | None = None) -> _policy.Policy:
     """Create a default policy for the given environment."""
     if checkpoint := DEFAULT_CHECKPOINT.get(env):
@@ -97,8 +142,20 @@ def create_policy(args: Args) -> _policy.Policy:
 
 
 def main(args: Args) -> None:
+    if args.compilation_cache_dir is not None:
+        jax.config.update("jax_compilation_cache_dir", str(pathlib.Path(args.compilation_cache_dir).expanduser()))
+
     policy = create_policy(args)
     policy_metadata = policy.metadata
+    replicas = [policy]
+    if args.devices_per_replica is not None:
+        pool = _replica_pool.replicate_policy(policy, devices_per_replica=args.devices_per_replica)
+        logging.info("Serving %d replicas on devices %s", len(pool), [stats.devices for stats in pool.stats()])
+        replicas = pool.replicas
+        policy = pool
+    if args.warmup:
+        for replica in replicas:
+            warmup_policy(replica, get_train_config(args), args)
 
     # Record the policy's behavior.
     if args.record:
@@ -113,6 +170,12 @@ def main(args: Args) -> None:
         host="0.0.0.0",
         port=args.port,
         metadata=policy_metadata,
+        max_batch_size=args.max_batch_size,
+        max_batch_wait_ms=args.max_batch_wait_ms,
+        max_queue_size=args.max_queue_size,
+        num_decode_workers=args.num_decode_workers,
+        # One worker per replica, also when the pool is wrapped by the recorder.
+        num_inference_workers=len(replicas),
     )
     server.serve_forever()
 
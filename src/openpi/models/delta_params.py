@@ -0,0 +1,314 @@
+"""Checkpoints stored as a delta against a shared base params tree.
+
+Per-task fine-tunes of the same base model differ from the base in only part of their weights, or by a low-rank
+update. A delta checkpoint stores, for every param:
+
+- nothing, if the param is identical to the base ("zero"),
+- the indices and fine-tuned values of the changed entries, if only a small fraction changed ("sparse"),
+- a truncated SVD of the difference, if it is low-rank within a tolerance ("lowrank", lossy and opt-in), or
+- the fine-tuned param itself ("full").
+
+"zero", "sparse" and "full" are lossless. The layout of a delta directory is:
+
+    <delta_dir>/metadata.json   base params path, encoding of every param
+    <delta_dir>/arrays/         orbax PyTree checkpoint with the arrays of the encoded params
+
+Restoring a delta loads the base params into host memory once (they are cached, see `clear_base_cache`), copies them
+to the device if the params are restored there, and applies the deltas on that device.
+"""
+
+import dataclasses
+import json
+import logging
+import pathlib
+import threading
+
+import flax.traverse_util as traverse_util
+import jax
+import jax.numpy as jnp
+import numpy as np
+import orbax.checkpoint as ocp
+
+from openpi.models import model as _model
+from openpi.shared import array_typing as at
+from openpi.shared import download
+
+logger = logging.getLogger(__name__)
+
+# Name of the delta directory inside a checkpoint directory, next to where the `params` directory would be.
+DELTA_DIR = "params_delta"
+FORMAT_VERSION = 1
+
+ZERO = "zero"
+SPARSE = "sparse"
+LOWRANK = "lowrank"
+FULL = "full"
+
+
+@dataclasses.dataclass(frozen=True)
+class EncodeOptions:
+    """Controls how the difference between a fine-tuned param and its base is encoded."""
+
+    # Use the sparse encoding if at most this fraction of the entries changed. The sparse encoding stores an index and
+    # a value per changed entry, so it only pays off for low densities.
+    max_sparse_density: float = 0.25
+    # Maximum rank of the low-rank encoding. If None, the lossy low-rank encoding is never used.
+    max_rank: int | None = None
+    # Maximum Frobenius norm of the low-rank approximation error, relative to the norm of the fine-tuned param.
+    lowrank_tolerance: float = 1e-3
+
+
+@dataclasses.dataclass(frozen=True)
+class LeafReport:
+    """Describes how a single param was encoded."""
+
+    path: str
+    encoding: str
+    nbytes: int
+    encoded_nbytes: int
+    # Maximum absolute reconstruction error, zero for lossless encodings.
+    max_error: float
+    rank: int | None = None
+
+
+def encode(
+    base: at.Params, finetuned: at.Params, options: EncodeOptions | None = None
+) -> tuple[at.Params, dict[str, dict], list[LeafReport]]:
+    """Encodes `finetuned` as a delta against `base`.
+
+    Both trees must have the same structure and shapes. Arrays are converted to numpy.
+
+    Returns:
+        The encoded arrays (a nested dict mirroring the params, without "zero" params), the encoding of every param
+        keyed by its "/"-joined path, and a report per param.
+    """
+    options = options or EncodeOptions()
+    flat_base = traverse_util.flatten_dict(base, sep="/")
+    flat_finetuned = traverse_util.flatten_dict(finetuned, sep="/")
+    if flat_base.keys() != flat_finetuned.keys():
+        missing = sorted(flat_base.keys() ^ flat_finetuned.keys())
+        raise ValueError(f"Params trees don't match: {missing[:10]}")
+
+    arrays = {}
+    encodings = {}
+    reports = []
+    for path, value in flat_finetuned.items():
+        base_value = np.asarray(flat_base[path])
+        finetuned_value = np.asarray(value)
+        if base_value.shape != finetuned_value.shape:
+            raise ValueError(f"Shape mismatch for {path}: {base_value.shape} != {finetuned_value.shape}")
+
+        encoding, leaf_arrays, max_error, rank = _encode_leaf(base_value, finetuned_value, options)
+        encodings[path] = {
+            "encoding": encoding,
+            "shape": list(finetuned_value.shape),
+            "dtype": str(finetuned_value.dtype),
+        }
+        if leaf_arrays:
+            arrays[path] = leaf_arrays
+        reports.append(
+            LeafReport(
+                path=path,
+                encoding=encoding,
+                nbytes=finetuned_value.nbytes,
+                encoded_nbytes=sum(a.nbytes for a in leaf_arrays.values()),
+                max_error=max_error,
+                rank=rank,
+            )
+        )
+    return traverse_util.unflatten_dict(arrays, sep="/"), encodings, reports
+
+
+def decode(
+    base: at.Params, arrays: at.Params, encodings: dict[str, dict], *, dtype: jnp.dtype | None = None
+) -> at.Params:
+    """Applies the encoded deltas to `base`.
+
+    The deltas are applied with jax.numpy if the base params are jax arrays, i.e. on the device they live on, and with
+    numpy otherwise.
+    """
+    flat_base = traverse_util.flatten_dict(base, sep="/")
+    flat_arrays = traverse_util.flatten_dict(arrays, sep="/", is_leaf=lambda _, x: _is_encoded_leaf(x))
+    if flat_base.keys() != encodings.keys():
+        missing = sorted(flat_base.keys() ^ encodings.keys())
+        raise ValueError(f"Delta doesn't match the base params: {missing[:10]}")
+
+    result = {}
+    for path, base_value in flat_base.items():
+        xp = jnp if isinstance(base_value, jax.Array) else np
+        value = _decode_leaf(xp, base_value, encodings[path]["encoding"], flat_arrays.get(path, {}))
+        if dtype is not None:
+            value = value.astype(dtype)
+        result[path] = value
+    return traverse_util.unflatten_dict(result, sep="/")
+
+
+def save(delta_dir: pathlib.Path | str, base_params_path: str, arrays: at.Params, encodings: dict[str, dict]) -> None:
+    """Writes a delta checkpoint. `base_params_path` is stored as is and used to locate the base when restoring."""
+    delta_dir = pathlib.Path(delta_dir).resolve()
+    delta_dir.mkdir(parents=True, exist_ok=True)
+    metadata = {"version": FORMAT_VERSION, "base_params_path": base_params_path, "params": encodings}
+    (delta_dir / "metadata.json").write_text(json.dumps(metadata, indent=1))
+    if arrays:
+        # A delta of a checkpoint that is identical to the base has no arrays.
+        with ocp.PyTreeCheckpointer() as ckptr:
+            ckptr.save(delta_dir / "arrays", {"params": arrays})
+
+
+def restore(
+    delta_dir: pathlib.Path | str,
+    *,
+    restore_type: type[np.ndarray] | type[jax.Array] = jax.Array,
+    dtype: jnp.dtype | None = None,
+    base_params_path: str | None = None,
+) -> at.Params:
+    """Restores the params of a delta checkpoint, like `model.restore_params` restores a full one.
+
+    Args:
+        delta_dir: The delta directory.
+        restore_type: Restore the params as jax arrays (on the device) or numpy arrays (in host memory).
+        dtype: The dtype to restore all params as.
+        base_params_path: Overrides the base params path stored in the delta metadata.
+    """
+    delta_dir = pathlib.Path(delta_dir).resolve()
+    metadata = json.loads((delta_dir / "metadata.json").read_text())
+    if metadata["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported delta checkpoint version: {metadata['version']}")
+
+    base = restore_base(base_params_path or metadata["base_params_path"], dtype)
+    if restore_type is jax.Array:
+        # Derived from the cached host copy, so that host and device restores share a single cache entry. Replicated
+        # across all devices, like `model.restore_params` does.
+        sharding = jax.sharding.NamedSharding(jax.sharding.Mesh(jax.devices(), ("x",)), jax.sharding.PartitionSpec())
+        base = jax.device_put(base, sharding)
+    arrays = {}
+    if (delta_dir / "arrays").exists():
+        with ocp.PyTreeCheckpointer() as ckptr:
+            arrays = ckptr.restore(delta_dir / "arrays")["params"]
+    return decode(base, arrays, metadata["params"], dtype=dtype)
+
+
+def clear_base_cache() -> None:
+    """Frees the cached base params."""
+    _base_cache.clear()
+
+
+def base_cache_nbytes() -> int:
+    """Returns the size of the cached base params in host memory."""
+    return _base_cache.nbytes
+
+
+def restore_base(base_params_path: str, dtype: jnp.dtype | None = None) -> at.Params:
+    """Restores the base params into host memory.
+
+    The most recently restored base params are cached and shared by all deltas, whether they are restored to the host
+    or to the device.
+    """
+    return _base_cache.get(base_params_path, dtype)
+
+
+class _BaseCache:
+    """Holds the most recently restored base params. Concurrent restores of the same base load it only once."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._key: tuple[str, jnp.dtype | None] | None = None
+        self._params: at.Params | None = None
+        self.nbytes = 0
+
+    def get(self, base_params_path: str, dtype: jnp.dtype | None) -> at.Params:
+        with self._lock:
+            if self._params is None or self._key != (base_params_path, dtype):
+                # Drop the previous base before loading the next one.
+                self._params, self.nbytes = None, 0
+                logger.info(f"Loading base params from {base_params_path}")
+                self._params = _model.restore_params(
+                    download.maybe_download(base_params_path), restore_type=np.ndarray, dtype=dtype
+                )
+                self._key = (base_params_path, dtype)
+                self.nbytes = sum(x.nbytes for x in jax.tree.leaves(self._params))
+            return self._params
+
+    def clear(self) -> None:
+        with self._lock:
+            self._key, self._params, self.nbytes = None, None, 0
+
+
+_base_cache = _BaseCache()
+
+
+def _encode_leaf(
+    base: np.ndarray, finetuned: np.ndarray, options: EncodeOptions
+) -> tuple[str, dict[str, np.ndarray], float, int | None]:
+    changed = base != finetuned
+    num_changed = int(np.count_nonzero(changed))
+    if num_changed == 0:
+        return ZERO, {}, 0.0, None
+
+    if num_changed <= options.max_sparse_density * finetuned.size:
+        indices = np.flatnonzero(changed)
+        index_dtype = np.int32 if finetuned.size < 2**31 else np.int64
+        arrays = {"indices": indices.astype(index_dtype), "values": finetuned.reshape(-1)[indices]}
+        return SPARSE, arrays, 0.0, None
+
+    if options.max_rank is not None and finetuned.ndim >= 2:
+        lowrank = _encode_lowrank(base, finetuned, options)
+        if lowrank is not None:
+            arrays, max_error, rank = lowrank
+            return LOWRANK, arrays, max_error, rank
+
+    return FULL, {"values": finetuned}, 0.0, None
+
+
+def _encode_lowrank(
+    base: np.ndarray, finetuned: np.ndarray, options: EncodeOptions
+) -> tuple[dict[str, np.ndarray], float, int] | None:
+    """Approximates the difference by a truncated SVD, treating leading dims (e.g. stacked layers) as a batch."""
+    assert options.max_rank is not None
+    delta = finetuned.astype(np.float32) - base.astype(np.float32)
+    # 2D params form a single matrix, higher-dimensional params one matrix per entry of the first axis.
+    matrices = delta[None] if delta.ndim == 2 else delta.reshape(delta.shape[0], -1, delta.shape[-1])
+    u, s, vt = np.linalg.svd(matrices, full_matrices=False)
+
+    # errors[r] is the Frobenius norm of the error over all matrices when keeping the `r` largest singular values.
+    squared_tails = np.cumsum((s**2)[:, ::-1], axis=1)[:, ::-1].sum(axis=0)
+    errors = np.sqrt(np.append(squared_tails, 0.0))
+    tolerance = options.lowrank_tolerance * np.linalg.norm(finetuned.astype(np.float32))
+    rank = max(int(np.argmax(errors <= tolerance)), 1)
+    if errors[rank] > tolerance or rank > options.max_rank:
+        return None
+
+    m, n = matrices.shape[1:]
+    if rank * (m + n) * 4 >= finetuned.nbytes:
+        # Storing the factors wouldn't save anything.
+        return None
+
+    arrays = {"u": (u[:, :, :rank] * s[:, None, :rank]).astype(np.float32), "v": vt[:, :rank, :].astype(np.float32)}
+    reconstructed = (base.astype(np.float32) + (arrays["u"] @ arrays["v"]).reshape(base.shape)).astype(finetuned.dtype)
+    max_error = float(np.max(np.abs(reconstructed.astype(np.float32) - finetuned.astype(np.float32))))
+    return arrays, max_error, rank
+
+
+def _decode_leaf(xp, base, encoding: str, arrays: dict):
+    if encoding == ZERO:
+        return base
+    if encoding == FULL:
+        return xp.asarray(arrays["values"], dtype=base.dtype)
+    if encoding == SPARSE:
+        flat = base.reshape(-1)
+        indices = xp.asarray(arrays["indices"])
+        values = xp.asarray(arrays["values"], dtype=base.dtype)
+        if xp is jnp:
+            flat = flat.at[indices].set(values)
+        else:
+            flat = flat.copy()
+            flat[indices] = values
+        return flat.reshape(base.shape)
+    if encoding == LOWRANK:
+        delta = xp.asarray(arrays["u"]) @ xp.asarray(arrays["v"])
+        return (base.astype(xp.float32) + delta.reshape(base.shape)).astype(base.dtype)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def _is_encoded_leaf(x) -> bool:
+    return isinstance(x, dict) and bool(x) and all(not isinstance(v, dict) for v in x.values())
@@ -0,0 +1,112 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import orbax.checkpoint as ocp
+import pytest
+
+from openpi.models import delta_params
+
+
+def _make_params(rng: np.random.Generator) -> dict:
+    return {
+        "embedding": rng.normal(size=(64, 16)).astype(np.float32),
+        "layers": {
+            "kernel": rng.normal(size=(4, 32, 24)).astype(np.float32),
+            "bias": rng.normal(size=(4, 24)).astype(np.float32),
+            "scale": rng.normal(size=(24,)).astype(np.float32),
+        },
+    }
+
+
+def _finetune(base: dict, rng: np.random.Generator) -> dict:
+    finetuned = jax.tree.map(np.copy, base)
+    # A few changed entries.
+    finetuned["embedding"][3, :] += 1.0
+    # A rank-2 update per layer.
+    update = rng.normal(size=(4, 32, 2)) @ rng.normal(size=(4, 2, 24))
+    finetuned["layers"]["kernel"] = (base["layers"]["kernel"] + update).astype(np.float32)
+    # A dense change.
+    finetuned["layers"]["bias"] = rng.normal(size=(4, 24)).astype(np.float32)
+    return finetuned
+
+
+def test_lossless_roundtrip():
+    rng = np.random.default_rng(0)
+    base = _make_params(rng)
+    finetuned = _finetune(base, rng)
+
+    arrays, encodings, reports = delta_params.encode(base, finetuned)
+    assert encodings["embedding"]["encoding"] == delta_params.SPARSE
+    assert encodings["layers/kernel"]["encoding"] == delta_params.FULL
+    assert encodings["layers/bias"]["encoding"] == delta_params.FULL
+    assert encodings["layers/scale"]["encoding"] == delta_params.ZERO
+    assert "scale" not in arrays["layers"]
+    assert all(report.max_error == 0 for report in reports)
+
+    for restored_base in (base, jax.tree.map(jnp.asarray, base)):
+        decoded = delta_params.decode(restored_base, arrays, encodings)
+        jax.tree.map(np.testing.assert_array_equal, decoded, finetuned)
+
+
+def test_lowrank():
+    rng = np.random.default_rng(0)
+    base = _make_params(rng)
+    finetuned = _finetune(base, rng)
+
+    options = delta_params.EncodeOptions(max_rank=4, lowrank_tolerance=1e-5)
+    arrays, encodings, reports = delta_params.encode(base, finetuned, options)
+    assert encodings["layers/kernel"]["encoding"] == delta_params.LOWRANK
+    assert arrays["layers"]["kernel"]["u"].shape == (4, 32, 2)
+    assert arrays["layers"]["kernel"]["v"].shape == (4, 2, 24)
+    # The dense change isn't low-rank.
+    assert encodings["layers/bias"]["encoding"] == delta_params.FULL
+
+    (report,) = [report for report in reports if report.path == "layers/kernel"]
+    assert report.rank == 2
+    assert report.encoded_nbytes < report.nbytes
+    decoded = delta_params.decode(base, arrays, encodings)
+    np.testing.assert_allclose(decoded["layers"]["kernel"], finetuned["layers"]["kernel"], atol=report.max_error)
+    assert report.max_error < 1e-4
+
+
+def test_save_and_restore(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    base = _make_params(rng)
+    finetuned = _finetune(base, rng)
+
+    base_dir = tmp_path / "base" / "params"
+    with ocp.PyTreeCheckpointer() as ckptr:
+        ckptr.save(base_dir, {"params": base})
+
+    arrays, encodings, _ = delta_params.encode(base, finetuned)
+    delta_params.save(tmp_path / "task" / delta_params.DELTA_DIR, str(base_dir), arrays, encodings)
+
+    restore_params = delta_params._model.restore_params  # noqa: SLF001
+    num_loads = []
+    monkeypatch.setattr(
+        delta_params._model,  # noqa: SLF001
+        "restore_params",
+        lambda *args, **kwargs: num_loads.append(1) or restore_params(*args, **kwargs),
+    )
+    delta_params.clear_base_cache()
+    try:
+        restored = delta_params.restore(tmp_path / "task" / delta_params.DELTA_DIR, restore_type=np.ndarray)
+        jax.tree.map(np.testing.assert_array_equal, restored, finetuned)
+        assert delta_params.base_cache_nbytes() == sum(x.nbytes for x in jax.tree.leaves(base))
+        # The base params are only loaded once, also when restoring to the device.
+        restored = delta_params.restore(tmp_path / "task" / delta_params.DELTA_DIR, restore_type=jax.Array)
+        jax.tree.map(np.testing.assert_array_equal, restored, finetuned)
+        assert all(isinstance(x, jax.Array) for x in jax.tree.leaves(restored))
+        assert len(num_loads) == 1
+    finally:
+        delta_params.clear_base_cache()
+
+
+def test_mismatched_trees():
+    rng = np.random.default_rng(0)
+    base = _make_params(rng)
+    finetuned = _finetune(base, rng)
+    del finetuned["layers"]["scale"]
+
+    with pytest.raises(ValueError, match="don't match"):
+        delta_params.encode(base, finetuned)
@@ -0,0 +1,226 @@
+"""ODE solvers for sampling actions from flow matching models.
+
+The models predict the velocity `v = noise - actions` of the straight path `x_t = t * noise + (1 - t) * actions`, and
+actions are sampled by integrating it from pure noise at t=1 to t=0. The solvers trade the number of function
+evaluations (NFE), i.e. forward passes of the action expert, for accuracy:
+
+- "euler": first order, 1 NFE per step.
+- "midpoint" and "heun": second order, 2 NFE per step.
+- "rk4": the classic fourth order Runge-Kutta method, 4 NFE per step.
+- "dpm_2m": the second order multistep DPM-Solver++(2M), which reuses the prediction of the previous step and
+  therefore only needs 1 NFE per step. Its first and last steps are first order.
+
+`integrate` is used inside jitted JAX models and `integrate_eager` by PyTorch models.
+"""
+
+from collections.abc import Callable
+import dataclasses
+import itertools
+import math
+from typing import Any, Literal, TypeVar
+
+import jax
+import jax.numpy as jnp
+
+ArrayT = TypeVar("ArrayT")
+
+Method = Literal["euler", "midpoint", "heun", "rk4", "dpm_2m"]
+Schedule = Literal["uniform", "shifted", "power"]
+
+_EXTRA_NFE_PER_STEP = {"euler": 0, "midpoint": 1, "heun": 1, "rk4": 3, "dpm_2m": 0}
+
+
+@jax.tree_util.register_static
+@dataclasses.dataclass(frozen=True)
+class ODESolver:
+    """Selects how `sample_actions` integrates the velocity field, e.g. `sample_kwargs={"solver": ODESolver("heun")}`.
+
+    Solvers are static pytrees, so they can be passed to jitted functions. Every distinct solver compiles a separate
+    executable.
+    """
+
+    # The integration method, see the module docstring.
+    method: Method = "euler"
+    # The time grid. "uniform" uses steps of equal size. "shifted" maps the uniform grid u to
+    # shift * u / (1 + (shift - 1) * u), which makes the steps close to the noise smaller for shift > 1 and the steps
+    # close to the actions smaller for shift < 1. "power" maps it to u ** exponent, which makes the steps close to the
+    # actions smaller for exponent > 1.
+    schedule: Schedule = "uniform"
+    shift: float = 1.0
+    exponent: float = 1.0
+    # Decreasing times from 1 to 0 of a custom grid. If set, the schedule and the number of steps are ignored.
+    timesteps: tuple[float, ...] | None = None
+    # If set, integration stops as soon as the relative change of the velocity between two steps is below this
+    # tolerance for all samples in the batch. The path is then assumed to be straight, and the rest of it is covered in
+    # a single Euler step.
+    tolerance: float | None = None
+
+    def __post_init__(self):
+        if self.method not in _EXTRA_NFE_PER_STEP:
+            raise ValueError(f"Unknown ODE solver method: {self.method}")
+        if self.schedule not in ("uniform", "shifted", "power"):
+            raise ValueError(f"Unknown time schedule: {self.schedule}")
+        if self.shift <= 0 or self.exponent <= 0:
+            raise ValueError(f"Shift and exponent must be positive, got {self.shift} and {self.exponent}")
+        if self.timesteps is not None:
+            timesteps = self.timesteps
+            if len(timesteps) < 2 or timesteps[0] != 1.0 or timesteps[-1] != 0.0:
+                raise ValueError(f"Timesteps must start at 1 and end at 0, got {timesteps}")
+            if any(t <= s for t, s in itertools.pairwise(timesteps)):
+                raise ValueError(f"Timesteps must be decreasing, got {timesteps}")
+
+    def num_steps(self, num_steps: Any) -> Any:
+        """Returns the number of steps, which is given by the custom grid if there is one."""
+        return num_steps if self.timesteps is None else len(self.timesteps) - 1
+
+    def max_nfe(self, num_steps: int) -> int:
+        """Returns the number of function evaluations without early stopping."""
+        return self.num_steps(num_steps) * (1 + _EXTRA_NFE_PER_STEP[self.method])
+
+    def time_at(self, step: Any, num_steps: Any) -> Any:
+        """Returns the time after `step` of `num_steps` steps, for Python numbers and JAX scalars."""
+        if self.timesteps is not None:
+            if isinstance(step, int):
+                return self.timesteps[step]
+            return jnp.asarray(self.timesteps, dtype=jnp.float32)[step]
+        u = 1.0 - step / num_steps
+        if self.schedule == "shifted":
+            return self.shift * u / (1.0 + (self.shift - 1.0) * u)
+        if self.schedule == "power":
+            return u**self.exponent
+        return u
+
+    def step_size(self, step: Any, time: Any, num_steps: Any) -> Any:
+        """Returns the (negative) size of `step`, which starts at `time`."""
+        if self.timesteps is None and self.schedule == "uniform":
+            # Accumulating the same step size reproduces the original Euler sampler exactly.
+            return -1.0 / num_steps
+        return self.time_at(step + 1, num_steps) - time
+
+
+def integrate(
+    solver: ODESolver,
+    velocity_fn: Callable[[jax.Array, jax.Array], jax.Array],
+    noise: jax.Array,
+    num_steps: int | jax.Array,
+) -> tuple[jax.Array, jax.Array]:
+    """Integrates `velocity_fn(x_t, t)` from `noise` at t=1 to t=0 inside a `jax.lax.while_loop`.
+
+    Returns:
+        The samples at t=0 and the number of function evaluations.
+    """
+    num_steps = solver.num_steps(num_steps)
+    extra_nfe = _EXTRA_NFE_PER_STEP[solver.method]
+
+    def step(carry):
+        i, x_t, time, v_prev, x0_prev, h_prev, nfe, _ = carry
+        dt = solver.step_size(i, time, num_steps)
+        v_t = velocity_fn(x_t, time)
+        converged = jnp.zeros((), dtype=bool)
+        if solver.tolerance is not None:
+            converged = (i > 0) & (_relative_change(v_t, v_prev) < solver.tolerance)
+
+        if solver.method == "dpm_2m":
+            # The last step goes exactly to t=0, regardless of the accumulated floating-point error.
+            next_time = jnp.where(i + 1 == num_steps, 0.0, time + dt)
+            x0 = x_t - time * v_t
+            h = _log_snr(next_time) - _log_snr(time)
+            # First order if the previous or the current step starts at or goes to a boundary of [0, 1].
+            ratio = jnp.where(jnp.isfinite(h) & jnp.isfinite(h_prev), h / (2.0 * h_prev), 0.0)
+            x_next = _dpm_update(x_t, time, next_time, x0 + ratio * (x0 - x0_prev))
+            x0_prev, h_prev = x0, h
+        elif solver.tolerance is None:
+            x_next = _higher_order_update(solver.method, velocity_fn, x_t, time, dt, v_t)
+        else:
+            x_next = jax.lax.cond(
+                converged,
+                lambda: x_t,
+                lambda: _higher_order_update(solver.method, velocity_fn, x_t, time, dt, v_t),
+            )
+        # Cover the rest of a straight path in a single step.
+        x_next = jnp.where(converged, x_t - time * v_t, x_next)
+        nfe = nfe + 1 + jnp.where(converged, 0, extra_nfe)
+        return i + 1, x_next, time + dt, v_t, x0_prev, h_prev, nfe, converged
+
+    def cond(carry):
+        i, *_, converged = carry
+        return (i < num_steps) & ~converged
+
+    zeros = jnp.zeros_like(noise)
+    converged = jnp.zeros((), dtype=bool)
+    carry = (jnp.int32(0), noise, jnp.float32(1.0), zeros, zeros, jnp.float32(jnp.inf), jnp.int32(0), converged)
+    _, x_0, _, _, _, _, nfe, _ = jax.lax.while_loop(cond, step, carry)
+    return x_0, nfe
+
+
+def integrate_eager(
+    solver: ODESolver, velocity_fn: Callable[[ArrayT, float], ArrayT], noise: ArrayT, num_steps: int
+) -> tuple[ArrayT, int]:
+    """Like `integrate`, but with Python control flow, for eagerly executed models (e.g. PyTorch tensors)."""
+    num_steps = solver.num_steps(num_steps)
+    x_t, time, nfe = noise, 1.0, 0
+    v_prev = x0_prev = None
+    h_prev = math.inf
+    for i in range(num_steps):
+        dt = solver.step_size(i, time, num_steps)
+        v_t = velocity_fn(x_t, time)
+        nfe += 1
+        if (
+            solver.tolerance is not None
+            and v_prev is not None
+            and float(_relative_change(v_t, v_prev)) < solver.tolerance
+        ):
+            return x_t - time * v_t, nfe
+
+        if solver.method == "dpm_2m":
+            next_time = 0.0 if i + 1 == num_steps else time + dt
+            x0 = x_t - time * v_t
+            h = _log_snr_float(next_time) - _log_snr_float(time)
+            ratio = h / (2.0 * h_prev) if math.isfinite(h) and math.isfinite(h_prev) else 0.0
+            x_t = _dpm_update(x_t, time, next_time, x0 if ratio == 0.0 else x0 + ratio * (x0 - x0_prev))
+            x0_prev, h_prev = x0, h
+        else:
+            x_t = _higher_order_update(solver.method, velocity_fn, x_t, time, dt, v_t)
+            nfe += _EXTRA_NFE_PER_STEP[solver.method]
+        v_prev = v_t
+        time += dt
+    return x_t, nfe
+
+
+def _higher_order_update(method: str, velocity_fn: Callable, x_t: ArrayT, time, dt, v_t: ArrayT) -> ArrayT:
+    """Returns x at `time + dt` for the single-step methods, given the velocity `v_t` at `time`."""
+    if method == "midpoint":
+        return x_t + dt * velocity_fn(x_t + dt / 2 * v_t, time + dt / 2)
+    if method == "heun":
+        return x_t + dt / 2 * (v_t + velocity_fn(x_t + dt * v_t, time + dt))
+    if method == "rk4":
+        k2 = velocity_fn(x_t + dt / 2 * v_t, time + dt / 2)
+        k3 = velocity_fn(x_t + dt / 2 * k2, time + dt / 2)
+        k4 = velocity_fn(x_t + dt * k3, time + dt)
+        return x_t + dt / 6 * (v_t + 2 * k2 + 2 * k3 + k4)
+    return x_t + dt * v_t
+
+
+def _dpm_update(x_t: ArrayT, time, next_time, data_prediction: ArrayT) -> ArrayT:
+    # DPM-Solver++ with alpha_t = 1 - t and sigma_t = t, for which exp(-h) * alpha_s / alpha_t = s / t.
+    return next_time / time * x_t + (1.0 - next_time / time) * data_prediction
+
+
+def _log_snr(time: jax.Array) -> jax.Array:
+    # -inf at t=1 and inf at t=0.
+    return jnp.log1p(-time) - jnp.log(time)
+
+
+def _log_snr_float(time: float) -> float:
+    if time >= 1.0:
+        return -math.inf
+    if time <= 0.0:
+        return math.inf
+    return math.log1p(-time) - math.log(time)
+
+
+def _relative_change(v_t: ArrayT, v_prev: ArrayT) -> Any:
+    """Returns the largest relative change of the velocity of any sample in the batch."""
+    diff = (v_t - v_prev).reshape(v_t.shape[0], -1)
+    prev = v_prev.reshape(v_t.shape[0], -1)
+    return (((diff * diff).sum(-1) / ((prev * prev).sum(-1) + 1e-12)) ** 0.5).max()
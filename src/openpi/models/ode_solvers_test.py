@@ -0,0 +1,126 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from openpi.models import ode_solvers
+
+_MEAN, _STD = 0.7, 0.2
+
+
+def _gaussian_velocity(x_t, time):
+    # The exact velocity field that transports standard normal noise to N(_MEAN, _STD ** 2) along straight paths.
+    data_prediction = _MEAN + (1 - time) * _STD**2 / (time**2 + (1 - time) ** 2 * _STD**2) * (x_t - (1 - time) * _MEAN)
+    return (x_t - data_prediction) / time
+
+
+def _smooth_velocity(x_t, time):
+    return x_t * time + jnp.sin(3 * time)
+
+
+def _reference_euler(velocity_fn, noise, num_steps):
+    # The sampler `Pi0.sample_actions` used before the solvers were added.
+    dt = -1.0 / num_steps
+
+    def step(carry):
+        x_t, time = carry
+        return x_t + dt * velocity_fn(x_t, time), time + dt
+
+    x_0, _ = jax.lax.while_loop(lambda carry: carry[1] >= -dt / 2, step, (noise, 1.0))
+    return x_0
+
+
+def _noise():
+    return jnp.asarray(np.random.default_rng(0).normal(size=(2, 4, 3)), dtype=jnp.float32)
+
+
+def test_euler_matches_reference():
+    noise = _noise()
+    for num_steps in [1, 3, 10]:
+        x_0, nfe = ode_solvers.integrate(ode_solvers.ODESolver(), _smooth_velocity, noise, num_steps)
+        np.testing.assert_array_equal(x_0, _reference_euler(_smooth_velocity, noise, num_steps))
+        assert nfe == num_steps
+
+
+@pytest.mark.parametrize(("method", "order"), [("euler", 1), ("midpoint", 2), ("heun", 2), ("rk4", 4)])
+def test_convergence_order(method: str, order: int):
+    noise = _noise()
+    solver = ode_solvers.ODESolver(method)
+    coarse, nfe = ode_solvers.integrate(solver, _smooth_velocity, noise, 5)
+    fine, _ = ode_solvers.integrate(solver, _smooth_velocity, noise, 10)
+    exact, _ = ode_solvers.integrate(ode_solvers.ODESolver("rk4"), _smooth_velocity, noise, 200)
+    assert nfe == solver.max_nfe(5)
+
+    ratio = np.abs(coarse - exact).max() / np.abs(fine - exact).max()
+    assert 2 ** (order - 0.5) < ratio < 2 ** (order + 0.5)
+
+
+def test_dpm_solver():
+    noise = _noise()
+    exact = _MEAN + _STD * noise
+    solver = ode_solvers.ODESolver("dpm_2m")
+    errors = [np.abs(ode_solvers.integrate(solver, _gaussian_velocity, noise, n)[0] - exact).max() for n in (16, 32)]
+    euler_error = np.abs(ode_solvers.integrate(ode_solvers.ODESolver(), _gaussian_velocity, noise, 16)[0] - exact).max()
+    assert errors[0] < euler_error / 2
+    # Second order.
+    assert errors[0] / errors[1] > 3
+
+
+@pytest.mark.parametrize("method", ["euler", "midpoint", "heun", "rk4", "dpm_2m"])
+def test_straight_paths_are_exact(method: str):
+    noise = _noise()
+    velocity = jnp.full_like(noise, 0.3)
+    x_0, _ = ode_solvers.integrate(
+        ode_solvers.ODESolver(method, schedule="shifted", shift=3.0), lambda x, t: velocity, noise, 4
+    )
+    np.testing.assert_allclose(x_0, noise - velocity, atol=1e-6)
+
+
+def test_tolerance():
+    noise = _noise()
+    # The velocity doesn't change along straight paths, so integration stops after the second evaluation.
+    solver = ode_solvers.ODESolver("heun", tolerance=1e-3)
+    x_0, nfe = ode_solvers.integrate(solver, lambda x, t: jnp.full_like(x, 0.3), noise, 10)
+    np.testing.assert_allclose(x_0, noise - 0.3, atol=1e-6)
+    assert nfe == 3
+
+    # Curved paths are integrated to the end.
+    x_0, nfe = ode_solvers.integrate(solver, _smooth_velocity, noise, 10)
+    np.testing.assert_array_equal(
+        x_0, ode_solvers.integrate(ode_solvers.ODESolver("heun"), _smooth_velocity, noise, 10)[0]
+    )
+    assert nfe == 20
+
+
+@pytest.mark.parametrize(
+    "solver",
+    [
+        ode_solvers.ODESolver(),
+        ode_solvers.ODESolver("midpoint", schedule="power", exponent=2.0),
+        ode_solvers.ODESolver("rk4", schedule="shifted", shift=0.5),
+        ode_solvers.ODESolver("dpm_2m", timesteps=(1.0, 0.9, 0.5, 0.2, 0.0)),
+        ode_solvers.ODESolver("heun", tolerance=0.05),
+    ],
+)
+def test_eager_matches_jit(solver: ode_solvers.ODESolver):
+    noise = _noise()
+    # Solvers are static, so they can be passed to jitted functions like any other argument.
+    x_0, nfe = jax.jit(ode_solvers.integrate, static_argnums=1)(solver, _smooth_velocity, noise, 8)
+    expected, expected_nfe = ode_solvers.integrate_eager(
+        solver, lambda x, t: np.asarray(_smooth_velocity(x, np.float32(t))), np.asarray(noise), 8
+    )
+    np.testing.assert_allclose(x_0, expected, atol=1e-5)
+    assert nfe == expected_nfe
+
+
+def test_timesteps():
+    solver = ode_solvers.ODESolver(timesteps=(1.0, 0.5, 0.0))
+    assert solver.max_nfe(10) == 2
+    assert [solver.time_at(i, 10) for i in range(3)] == [1.0, 0.5, 0.0]
+
+    with pytest.raises(ValueError, match="start at 1"):
+        ode_solvers.ODESolver(timesteps=(0.9, 0.0))
+    with pytest.raises(ValueError, match="decreasing"):
+        ode_solvers.ODESolver(timesteps=(1.0, 0.2, 0.5, 0.0))
+    with pytest.raises(ValueError, match="Unknown ODE solver"):
+        ode_solvers.ODESolver("rk45")  # type: ignore[arg-type]
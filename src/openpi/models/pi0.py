@@ -1,4 +1,5 @@
 import logging
+from typing import Literal
 
 import einops
 import flax.nnx as nnx
@@ -8,6 +9,7 @@ import jax.numpy as jnp
 from typing_extensions import override
 
 from openpi.models import model as _model
+from openpi.models import ode_solvers
 from openpi.models import pi0_config
 from openpi.models import pi0_loss_utils
 import openpi.models.gemma as _gemma
@@ -64,6 +66,24 @@ def posemb_sincos(
     return jnp.concatenate([jnp.sin(sinusoid_input), jnp.cos(sinusoid_input)], axis=-1)
 
 
+def aggregate_samples(
+    actions: at.Float[at.Array, "b n ah ad"], method: Literal["mean", "medoid"]
+) -> at.Float[at.Array, "b ah ad"]:
+    """Reduces several action samples per observation to one.
+
+    "mean" averages the samples. "medoid" picks the sample with the smallest sum of L2 distances to the other samples,
+    which is always a valid sample of the model and isn't pulled between modes of a multimodal action distribution.
+    """
+    if method == "mean":
+        return jnp.mean(actions, axis=1)
+    if method == "medoid":
+        flat = actions.reshape(*actions.shape[:2], -1)
+        distances = jnp.linalg.norm(flat[:, :, None] - flat[:, None], axis=-1)
+        index = jnp.argmin(jnp.sum(distances, axis=-1), axis=1)
+        return jnp.take_along_axis(actions, index[:, None, None, None], axis=1)[:, 0]
+    raise ValueError(f"Unknown aggregation method: {method}")
+
+
 def _delta_action_weights(actions, *, alpha=0.2, beta=1.0, cap=0.5):
     """
     actions: [B, H, D] absolute commands
@@ -139,10 +159,9 @@ class Pi0(_model.BaseModel):
         input_mask = []
         ar_mask = []
         tokens = []
-        # embed images
-        for name in obs.images:
-            image_tokens, _ = self.PaliGemma.img(obs.images[name], train=False)
-
+        # embed images, all cameras in one call of the vision tower
+        all_image_tokens = _siglip.encode_images(self.PaliGemma.img, list(obs.images.values()), train=False)
+        for name, image_tokens in zip(obs.images, all_image_tokens, strict=True):
             tokens.append(image_tokens)
             input_mask.append(
                 einops.repeat(
@@ -286,15 +305,45 @@ class Pi0(_model.BaseModel):
         observation: _model.Observation,
         *,
         num_steps: int | at.Int[at.Array, ""] = 10,
-        noise: at.Float[at.Array, "b ah ad"] | None = None,
-    ) -> _model.Actions:
+        noise: at.Float[at.Array, "b ah ad"] | at.Float[at.Array, "b n ah ad"] | None = None,
+        solver: ode_solvers.ODESolver | None = None,
+        num_samples: int | None = None,
+        aggregate: Literal["mean", "medoid"] | None = None,
+    ) -> _model.Actions | at.Float[at.Array, "b n ah ad"]:
+        """Samples actions for a batch of observations.
+
+        If `num_samples` is set, draws that many samples per observation from the same prefix KV cache, so the images
+        and the prompt are only encoded once. The samples are returned along a new axis after the batch axis, or reduced
+        to a single action chunk per observation with `aggregate_samples` if `aggregate` is set.
+        """
+        actions, _ = self.sample_actions_with_nfe(
+            rng, observation, num_steps=num_steps, noise=noise, solver=solver, num_samples=num_samples
+        )
+        if aggregate is not None:
+            if num_samples is None:
+                raise ValueError("Aggregation requires num_samples")
+            actions = aggregate_samples(actions, aggregate)
+        return actions
+
+    def sample_actions_with_nfe(
+        self,
+        rng: at.KeyArrayLike,
+        observation: _model.Observation,
+        *,
+        num_steps: int | at.Int[at.Array, ""] = 10,
+        noise: at.Float[at.Array, "b ah ad"] | at.Float[at.Array, "b n ah ad"] | None = None,
+        solver: ode_solvers.ODESolver | None = None,
+        num_samples: int | None = None,
+    ) -> tuple[_model.Actions | at.Float[at.Array, "b n ah ad"], at.Int[at.Array, ""]]:
+        """Like `sample_actions`, but also returns the number of forward passes of the action expert."""
+        solver = solver or ode_solvers.ODESolver()
         observation = _model.preprocess_observation(None, observation, train=False)
         # note that we use the convention more common in diffusion literature, where t=1 is noise and t=0 is the target
         # distribution. yes, this is the opposite of the pi0 paper, and I'm sorry.
-        dt = -1.0 / num_steps
         batch_size = observation.state.shape[0]
+        sample_shape = (batch_size,) if num_samples is None else (batch_size, num_samples)
         if noise is None:
-            noise = jax.random.normal(rng, (batch_size, self.action_horizon, self.action_dim))
+            noise = jax.random.normal(rng, (*sample_shape, self.action_horizon, self.action_dim))
 
         # first fill KV cache with a forward pass of the prefix
         prefix_tokens, prefix_mask, prefix_ar_mask = self.embed_prefix(observation)
@@ -302,10 +351,19 @@ class Pi0(_model.BaseModel):
         positions = jnp.cumsum(prefix_mask, axis=1) - 1
         _, kv_cache = self.PaliGemma.llm([prefix_tokens, None], mask=prefix_attn_mask, positions=positions)
 
-        def step(carry):
-            x_t, time = carry
+        suffix_observation = observation
+        if num_samples is not None:
+            # The samples of an observation are consecutive entries of a larger batch, which share the prefix.
+            batch_size *= num_samples
+            noise = noise.reshape(batch_size, *noise.shape[2:])
+            kv_cache = jax.tree.map(lambda x: jnp.repeat(x, num_samples, axis=1), kv_cache)
+            prefix_mask = jnp.repeat(prefix_mask, num_samples, axis=0)
+            # Only the state and the task are used by the suffix, XLA removes the copies of the other inputs.
+            suffix_observation = jax.tree.map(lambda x: jnp.repeat(x, num_samples, axis=0), observation)
+
+        def velocity(x_t, time):
             suffix_tokens, suffix_mask, suffix_ar_mask, adarms_cond = self.embed_suffix(
-                observation, x_t, jnp.broadcast_to(time, batch_size)
+                suffix_observation, x_t, jnp.broadcast_to(time, batch_size)
             )
             # `suffix_attn_mask` is shape (b, suffix_len, suffix_len) indicating how the suffix tokens can attend to each
             # other
@@ -332,14 +390,7 @@ class Pi0(_model.BaseModel):
                 adarms_cond=[None, adarms_cond],
             )
             assert prefix_out is None
-            v_t = self.action_out_proj(suffix_out[:, -self.action_horizon :])
-
-            return x_t + dt * v_t, time + dt
-
-        def cond(carry):
-            x_t, time = carry
-            # robust to floating-point error
-            return time >= -dt / 2
+            return self.action_out_proj(suffix_out[:, -self.action_horizon :])
 
-        x_0, _ = jax.lax.while_loop(cond, step, (noise, 1.0))
-        return x_0
+        x_0, nfe = ode_solvers.integrate(solver, velocity, noise, num_steps)
+        return x_0.reshape(*sample_shape, *x_0.shape[1:]), nfe
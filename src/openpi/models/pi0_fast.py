@@ -163,10 +163,9 @@ class Pi0FAST(_model.BaseModel):
         input_mask = []
         ar_mask = []
         token_embeddings = []
-        # embed images
-        for name in obs.images:
-            image_token_embeddings, _ = self.PaliGemma.img(obs.images[name], train=False)
-
+        # embed images, all cameras in one call of the vision tower
+        all_image_embeddings = _siglip.encode_images(self.PaliGemma.img, list(obs.images.values()), train=False)
+        for name, image_token_embeddings in zip(obs.images, all_image_embeddings, strict=True):
             token_embeddings.append(image_token_embeddings)
             input_mask.append(
                 einops.repeat(
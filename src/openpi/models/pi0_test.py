@@ -1,7 +1,13 @@
 import flax.nnx as nnx
 import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
 
+import openpi.models.pi0 as _pi0
 import openpi.models.pi0_config as _pi0_config
+import openpi.models.siglip as _siglip
+from openpi.shared import nnx_utils
 
 
 def _get_frozen_state(config: _pi0_config.Pi0Config) -> nnx.State:
@@ -44,3 +50,50 @@ def test_pi0_all_lora():
     assert len(state) == 17
     assert all("lora" not in p for p in state)
     assert all("llm" in p for p in state)
+
+
+@pytest.mark.parametrize("pi05", [False, True])
+def test_sample_actions_num_samples(pi05):
+    config = _pi0_config.Pi0Config(paligemma_variant="dummy", action_expert_variant="dummy", pi05=pi05)
+    model = config.create(jax.random.key(0))
+    obs = config.fake_obs(2)
+    noise = jax.random.normal(jax.random.key(1), (2, 3, config.action_horizon, config.action_dim))
+    sample_actions = nnx_utils.module_jit(model.sample_actions, static_argnames=("num_samples", "aggregate"))
+
+    # Every sample matches sampling the observations separately with its noise.
+    actions = sample_actions(jax.random.key(0), obs, num_steps=3, noise=noise, num_samples=3)
+    assert actions.shape == noise.shape
+    for i in range(3):
+        expected = sample_actions(jax.random.key(0), obs, num_steps=3, noise=noise[:, i])
+        np.testing.assert_allclose(actions[:, i], expected, atol=1e-5)
+
+    mean = sample_actions(jax.random.key(0), obs, num_steps=3, noise=noise, num_samples=3, aggregate="mean")
+    np.testing.assert_allclose(mean, actions.mean(axis=1), atol=1e-5)
+
+
+def test_aggregate_samples():
+    actions = jnp.array([0.0, 1.0, 1.5, 10.0])[None, :, None, None] * jnp.ones((2, 1, 3, 2))
+    np.testing.assert_allclose(_pi0.aggregate_samples(actions, "mean"), jnp.full((2, 3, 2), 3.125))
+    np.testing.assert_allclose(_pi0.aggregate_samples(actions, "medoid"), jnp.ones((2, 3, 2)))
+
+
+def test_embed_prefix_batches_cameras():
+    config = _pi0_config.Pi0Config(paligemma_variant="dummy", action_expert_variant="dummy", dtype="float32")
+    model = config.create(jax.random.key(0))
+    obs = config.fake_obs(2)
+    obs = obs.replace(
+        images={
+            name: jax.random.uniform(jax.random.key(i), image.shape)
+            for i, (name, image) in enumerate(obs.images.items())
+        }
+    )
+
+    tokens, _, _ = nnx_utils.module_jit(model.embed_prefix)(obs)
+    expected = jnp.concatenate([model.PaliGemma.img(image, train=False)[0] for image in obs.images.values()], axis=1)
+    np.testing.assert_allclose(tokens[:, : expected.shape[1]], expected, atol=1e-4)
+
+
+def test_encode_images_with_different_shapes():
+    images = [jnp.ones((2, 4, 4, 3)), jnp.ones((2, 8, 8, 3)), jnp.ones((2, 4, 4, 3))]
+    tokens = _siglip.encode_images(lambda x: (x.reshape(x.shape[0], -1, 3), None), images)
+    assert [t.shape for t in tokens] == [(2, 16, 3), (2, 64, 3), (2, 16, 3)]
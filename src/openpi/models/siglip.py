@@ -371,3 +371,15 @@ def decode_variant(variant):
         # pylint:enable=line-too-long
         **patch,
     }
+
+
+def encode_images(encoder, images: Sequence[jax.Array], **kwargs) -> list[jax.Array]:
+    """Returns the tokens of several batches of images, e.g. one per camera, computed by a single call of `encoder`.
+
+    The batches are concatenated along the batch axis and the tokens are split back, which uses the accelerator better
+    than one call per batch at small batch sizes. Batches of different shapes are encoded separately.
+    """
+    if len({(image.shape, image.dtype) for image in images}) > 1:
+        return [encoder(image, **kwargs)[0] for image in images]
+    tokens, _ = encoder(jnp.concatenate(images, axis=0), **kwargs)
+    return jnp.split(tokens, len(images), axis=0)
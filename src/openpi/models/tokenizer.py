@@ -1,3 +1,5 @@
+from collections import OrderedDict
+import dataclasses
 import logging
 import os
 
@@ -10,48 +12,162 @@ from transformers import AutoProcessor
 import openpi.models.utils.fsq_tokenizer as fsq_tokenizer
 import openpi.shared.download as download
 
+# The pi05 prompt format discretizes every state dimension into one of 256 bins. Values below -1 get the bin -1.
+_STATE_BIN_EDGES = np.linspace(-1, 1, 256 + 1)[:-1]
+# All strings a state dimension can be written as: the bins -1 to 255 and the marker of invisible dimensions.
+_STATE_WORDS = [str(x) for x in range(-1, 256)] + ["*"]
+_INVISIBLE_STATE_WORD = len(_STATE_WORDS) - 1
+_STATE_SUFFIX = ";\nAction: "
+
+
+@dataclasses.dataclass(frozen=True)
+class _StateTokens:
+    """The tokens of the state words of pi05 prompts, indexed like `_STATE_WORDS`."""
+
+    # Tokens of every word followed by another word, zero-padded to the same length, and the mask of the valid tokens.
+    words: np.ndarray
+    words_mask: np.ndarray
+    # Tokens of every word followed by the end of the prompt.
+    last_words: list[np.ndarray]
+
+    def lookup(self, words: np.ndarray) -> np.ndarray:
+        """Returns the tokens of a non-empty state, given as indices into `_STATE_WORDS`."""
+        return np.concatenate([self.words[words[:-1]][self.words_mask[words[:-1]]], self.last_words[words[-1]]])
+
 
 class PaligemmaTokenizer:
-    def __init__(self, max_len: int = 48):
+    def __init__(self, max_len: int = 48, prompt_cache_size: int = 1024):
+        """Creates the tokenizer.
+
+        Args:
+            max_len: The length the token sequences are padded or truncated to.
+            prompt_cache_size: Number of encoded prompts that are kept, so that prompts seen before don't have to be
+                encoded again.
+        """
         self._max_len = max_len
 
         path = download.maybe_download("gs://big_vision/paligemma_tokenizer.model", gs={"token": "anon"})
         with path.open("rb") as f:
             self._tokenizer = sentencepiece.SentencePieceProcessor(model_proto=f.read())
 
-    def tokenize(self, prompt: str, state: np.ndarray | None = None, proprio_visibility_mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # Least recently used prompts first. An OrderedDict rather than `functools.lru_cache`, so that the tokenizer
+        # can still be pickled for the data loader workers.
+        self._prompt_cache_size = prompt_cache_size
+        self._prompt_cache: OrderedDict[tuple[str, bool], np.ndarray | None] = OrderedDict()
+        self._state_tokens = self._build_state_tokens()
+
+    def tokenize(
+        self, prompt: str, state: np.ndarray | None = None, proprio_visibility_mask: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
         cleaned_text = prompt.strip().replace("_", " ").replace("\n", " ")
         if state is not None:
             # This is the Pi05 format, where the state is part of the discrete language input.
-            discretized_state = np.digitize(state, bins=np.linspace(-1, 1, 256 + 1)[:-1]) - 1
+            discretized_state = np.digitize(state, bins=_STATE_BIN_EDGES) - 1
             # Mask out the state dimensions that are not visible with an asterisk
             if proprio_visibility_mask is None:
                 proprio_visibility_mask = np.ones_like(state)
-            state_str = " ".join(
-                str(x) if is_x_visible else "*" 
-                for x, is_x_visible in zip(discretized_state, proprio_visibility_mask.astype(bool))
-            )
-            full_prompt = f"Task: {cleaned_text}, State: {state_str};\nAction: "
-            tokens = self._tokenizer.encode(full_prompt, add_bos=True)
+            tokens = self._encode_with_state(cleaned_text, discretized_state, proprio_visibility_mask.astype(bool))
         else:
             # This is the Pi0 format, where the state is part of the continuous action expert input.
             # tokenize "\n" separately as the "start of answer" token
-            tokens = self._tokenizer.encode(cleaned_text, add_bos=True) + self._tokenizer.encode("\n")
-        tokens_len = len(tokens)
-        if tokens_len < self._max_len:
-            padding = [False] * (self._max_len - tokens_len)
-            mask = [True] * tokens_len + padding
-            tokens = tokens + padding
-        else:
-            # if len(tokens) > self._max_len:
-            #     logging.warning(
-            #         f"Token length ({len(tokens)}) exceeds max length ({self._max_len}), truncating. "
-            #         "Consider increasing the `max_token_len` in your model config if this happens frequently."
-            #     )
-            tokens = tokens[: self._max_len]
-            mask = [True] * self._max_len
+            tokens = self._encode_prompt(cleaned_text, with_state=False)
+
+        # if len(tokens) > self._max_len:
+        #     logging.warning(
+        #         f"Token length ({len(tokens)}) exceeds max length ({self._max_len}), truncating. "
+        #         "Consider increasing the `max_token_len` in your model config if this happens frequently."
+        #     )
+        tokens = tokens[: self._max_len]
+        padded_tokens = np.zeros(self._max_len, dtype=np.int64)
+        padded_tokens[: len(tokens)] = tokens
+        return padded_tokens, np.arange(self._max_len) < len(tokens)
+
+    def _encode_with_state(self, cleaned_text: str, discretized_state: np.ndarray, visible: np.ndarray) -> np.ndarray:
+        """Encodes the pi05 prompt `Task: {cleaned_text}, State: {state};\nAction: `.
+
+        SentencePiece doesn't merge pieces across the spaces between the state words, so the tokens of the prompt are
+        the cached tokens of the text before the state followed by the tokens of the state words, which are looked up
+        in a table. The prompt is only encoded as a string if the table doesn't reproduce the tokenizer's output (see
+        `_build_state_tokens`) or the state has an unexpected shape.
+        """
+        prefix = self._encode_prompt(cleaned_text, with_state=True)
+        if (
+            prefix is None
+            or self._state_tokens is None
+            or discretized_state.ndim != 1
+            or len(discretized_state) == 0
+            or visible.shape != discretized_state.shape
+        ):
+            state_str = " ".join(
+                str(x) if is_x_visible else "*" for x, is_x_visible in zip(discretized_state, visible, strict=False)
+            )
+            full_prompt = f"Task: {cleaned_text}, State: {state_str}{_STATE_SUFFIX}"
+            return np.asarray(self._tokenizer.encode(full_prompt, add_bos=True))
 
-        return np.asarray(tokens), np.asarray(mask)
+        # Bin b is the word b + 1.
+        words = np.where(visible, discretized_state + 1, _INVISIBLE_STATE_WORD)
+        return np.concatenate([prefix, self._state_tokens.lookup(words)])
+
+    def _encode_prompt(self, cleaned_text: str, *, with_state: bool) -> np.ndarray | None:
+        """Returns the cached tokens of the text before the state (pi05 format) or of the whole prompt (pi0 format).
+
+        Returns None for pi05 prompts whose text before the state is encoded differently when a state follows.
+        """
+        key = (cleaned_text, with_state)
+        if key in self._prompt_cache:
+            self._prompt_cache.move_to_end(key)
+            return self._prompt_cache[key]
+
+        if not with_state:
+            tokens = np.asarray(self._tokenizer.encode(cleaned_text, add_bos=True) + self._tokenizer.encode("\n"))
+        else:
+            prefix = f"Task: {cleaned_text}, State:"
+            tokens = np.asarray(self._tokenizer.encode(prefix, add_bos=True))
+            zero_state = np.asarray([_STATE_WORDS.index("0")])
+            if self._state_tokens is not None and self._tokenizer.encode(
+                f"{prefix} 0{_STATE_SUFFIX}", add_bos=True
+            ) != [*tokens, *self._state_tokens.lookup(zero_state)]:
+                tokens = None
+
+        self._prompt_cache[key] = tokens
+        if len(self._prompt_cache) > self._prompt_cache_size:
+            self._prompt_cache.popitem(last=False)
+        return tokens
+
+    def _build_state_tokens(self) -> _StateTokens | None:
+        """Encodes all state words, as they appear in a pi05 prompt.
+
+        Returns None if the resulting table doesn't reproduce the tokens of complete states, which is only expected for
+        tokenizers that merge pieces across spaces.
+        """
+        context = self._tokenizer.encode("State:")
+
+        def encode_after_context(text: str) -> list[int] | None:
+            tokens = self._tokenizer.encode(f"State: {text}")
+            return tokens[len(context) :] if tokens[: len(context)] == context else None
+
+        words = [encode_after_context(word) for word in _STATE_WORDS]
+        last_words = [encode_after_context(word + _STATE_SUFFIX) for word in _STATE_WORDS]
+        if any(tokens is None for tokens in words + last_words):
+            logging.warning("The tokenizer merges the state with the prompt, falling back to encoding it as text")
+            return None
+
+        words_mask = np.arange(max(len(tokens) for tokens in words)) < np.asarray([len(t) for t in words])[:, None]
+        word_tokens = np.zeros(words_mask.shape, dtype=np.int64)
+        word_tokens[words_mask] = np.concatenate(words)
+        state_tokens = _StateTokens(word_tokens, words_mask, [np.asarray(t, dtype=np.int64) for t in last_words])
+
+        # Compare with complete states, with every word at the start, in the middle and at the end.
+        neighbors = [_STATE_WORDS.index(word) for word in ("-1", "0", "9", "10", "99", "100", "255", "*")]
+        for i in range(len(_STATE_WORDS)):
+            j = neighbors[i % len(neighbors)]
+            for state in ([i], [i, j], [j, i, j]):
+                state_str = " ".join(_STATE_WORDS[k] for k in state)
+                expected = self._tokenizer.encode(f"State: {state_str}{_STATE_SUFFIX}")
+                if expected != [*context, *state_tokens.lookup(np.asarray(state))]:
+                    logging.warning("The tokenizer merges adjacent state words, falling back to encoding them as text")
+                    return None
+        return state_tokens
 
 
 class FASTTokenizer:
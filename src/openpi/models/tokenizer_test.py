@@ -25,3 +25,22 @@ def test_fast_tokenizer():
 
     act = tokenizer.extract_actions(tokens, 3, 2)
     assert act.shape == (3, 2)
+
+
+def test_tokenize_state_matches_string_encoding():
+    tokenizer = _tokenizer.PaligemmaTokenizer(max_len=200)
+    rng = np.random.default_rng(0)
+    for prompt in ["pick_up the cup\n", "Hello, world!", "pick up the cup"]:
+        # Includes values outside of [-1, 1] and invisible dimensions.
+        state = rng.uniform(-1.2, 1.2, 23)
+        visible = rng.random(23) > 0.2
+        tokens, masks = tokenizer.tokenize(prompt, state, visible)
+
+        discretized_state = np.digitize(state, bins=np.linspace(-1, 1, 256 + 1)[:-1]) - 1
+        state_str = " ".join(str(x) if v else "*" for x, v in zip(discretized_state, visible, strict=True))
+        cleaned_text = prompt.strip().replace("_", " ")
+        expected = tokenizer._tokenizer.encode(  # noqa: SLF001
+            f"Task: {cleaned_text}, State: {state_str};\nAction: ", add_bos=True
+        )
+        np.testing.assert_array_equal(tokens[: len(expected)], expected)
+        assert masks.sum() == len(expected)
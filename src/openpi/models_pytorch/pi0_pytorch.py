@@ -6,6 +6,7 @@ from torch import Tensor
 from torch import nn
 import torch.nn.functional as F  # noqa: N812
 
+from openpi.models import ode_solvers
 import openpi.models.gemma as _gemma
 from openpi.models_pytorch.gemma_pytorch import PaliGemmaWithExpertModel
 import openpi.models_pytorch.preprocessing_pytorch as _preprocessing
@@ -206,14 +207,16 @@ class PI0Pytorch(nn.Module):
         pad_masks = []
         att_masks = []
 
-        # Process images
-        for img, img_mask in zip(images, img_masks, strict=True):
+        # Process images, all cameras in one call of the vision tower if they have the same shape
+        def image_embed_func(img):
+            return self.paligemma_with_expert.embed_image(img)
 
-            def image_embed_func(img):
-                return self.paligemma_with_expert.embed_image(img)
-
-            img_emb = self._apply_checkpoint(image_embed_func, img)
+        if len({(img.shape, img.dtype) for img in images}) == 1:
+            img_embs = self._apply_checkpoint(image_embed_func, torch.cat(images, dim=0)).chunk(len(images), dim=0)
+        else:
+            img_embs = [self._apply_checkpoint(image_embed_func, img) for img in images]
 
+        for img_emb, img_mask in zip(img_embs, img_masks, strict=True):
             bsize, num_img_embs = img_emb.shape[:2]
 
             embs.append(img_emb)
@@ -417,8 +420,12 @@ class PI0Pytorch(nn.Module):
         return weighted_loss  # [B, H]
 
     @torch.no_grad()
-    def sample_actions(self, device, observation, noise=None, num_steps=10) -> Tensor:
-        """Do a full inference forward and compute the action (batch_size x num_steps x num_motors)"""
+    def sample_actions(self, device, observation, noise=None, num_steps=10, solver=None) -> Tensor:
+        """Do a full inference forward and compute the action (batch_size x num_steps x num_motors)
+
+        `solver` is an `ode_solvers.ODESolver` that selects the integration method and time grid. Defaults to Euler
+        steps on a uniform grid.
+        """
         bsize = observation.state.shape[0]
         if noise is None:
             actions_shape = (bsize, self.config.action_horizon, self.config.action_dim)
@@ -446,14 +453,9 @@ class PI0Pytorch(nn.Module):
             use_cache=True,
         )
 
-        dt = -1.0 / num_steps
-        dt = torch.tensor(dt, dtype=torch.float32, device=device)
-
-        x_t = noise
-        time = torch.tensor(1.0, dtype=torch.float32, device=device)
-        while time >= -dt / 2:
-            expanded_time = time.expand(bsize)
-            v_t = self.denoise_step(
+        def velocity(x_t, time):
+            expanded_time = torch.full((bsize,), time, dtype=torch.float32, device=device)
+            return self.denoise_step(
                 state,
                 prefix_pad_masks,
                 past_key_values,
@@ -463,10 +465,8 @@ class PI0Pytorch(nn.Module):
                 task_id,
             )
 
-            # Euler step - use new tensor assignment instead of in-place operation
-            x_t = x_t + dt * v_t
-            time += dt
-        return x_t
+        x_0, _ = ode_solvers.integrate_eager(solver or ode_solvers.ODESolver(), velocity, noise, num_steps)
+        return x_0
 
     def denoise_step(
         self,
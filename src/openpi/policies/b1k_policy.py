@@ -19,6 +19,22 @@ def make_b1k_example() -> dict:
     }
 
 
+def make_b1k_inputs_example() -> dict:
+    """Creates a random example of the policy inputs built by `b1k_preprocessing.B1KPreprocessor`, e.g. for warmup."""
+    proprio_dim = max(
+        index.stop if isinstance(index, slice) else int(np.max(index)) + 1
+        for index in PROPRIOCEPTION_INDICES["R1Pro"].values()
+    )
+    return {
+        "observation/egocentric_camera": np.random.randint(256, size=(224, 224, 3), dtype=np.uint8),
+        "observation/wrist_image_left": np.random.randint(256, size=(224, 224, 3), dtype=np.uint8),
+        "observation/wrist_image_right": np.random.randint(256, size=(224, 224, 3), dtype=np.uint8),
+        "observation/state": np.random.rand(proprio_dim).astype(np.float32),
+        "prompt": "do something",
+        "task_index": 0,
+    }
+
+
 def extract_state_from_proprio(proprio_data):
     """
     We assume perfect correlation for the two gripper fingers.
@@ -103,8 +119,9 @@ class B1kInputs(transforms.DataTransformFn):
 
 
 @dataclasses.dataclass(frozen=True)
-class B1kOutputs(transforms.DataTransformFn):
+class B1kOutputs(transforms.JittableTransformFn):
     action_dim: int = 23
     def __call__(self, data: dict) -> dict:
-        # Only return the first 23 dims.
-        return {"actions": np.asarray(data["actions"][:, :self.action_dim])}
+        # Only return the first 23 dims. The actions may be batched when applied inside the policy's compiled function.
+        actions = data["actions"][..., :self.action_dim]
+        return {"actions": transforms.array_namespace(actions).asarray(actions)}
@@ -1,13 +1,15 @@
-from collections.abc import Sequence
+from collections.abc import Callable, Iterable, Sequence
+import copy
+import functools
+import itertools
 import logging
-import pathlib
 import time
 from typing import Any, TypeAlias
 
 import flax
+import flax.nnx as nnx
 import flax.traverse_util
 import jax
-import jax.numpy as jnp
 import numpy as np
 from openpi_client import base_policy as _base_policy
 import torch
@@ -15,11 +17,16 @@ from typing_extensions import override
 
 from openpi import transforms as _transforms
 from openpi.models import model as _model
+from openpi.policies import policy_records as _policy_records
 from openpi.shared import array_typing as at
 from openpi.shared import nnx_utils
+from openpi.training import sharding as _sharding
 
 BasePolicy: TypeAlias = _base_policy.BasePolicy
 
+# Sample kwargs that change the shapes of the computation rather than the values, see `Pi0.sample_actions`.
+_STATIC_SAMPLE_KWARGS = ("num_samples", "aggregate")
+
 
 class Policy(BasePolicy):
     def __init__(
@@ -33,6 +40,8 @@ class Policy(BasePolicy):
         metadata: dict[str, Any] | None = None,
         pytorch_device: str = "cpu",
         is_pytorch: bool = False,
+        batch_buckets: Sequence[int] | None = None,
+        fuse_transforms: bool = False,
     ):
         """Initialize the Policy.
 
@@ -41,12 +50,31 @@ class Policy(BasePolicy):
             rng: Random number generator key for JAX models. Ignored for PyTorch models.
             transforms: Input data transformations to apply before inference.
             output_transforms: Output data transformations to apply after inference.
-            sample_kwargs: Additional keyword arguments to pass to model.sample_actions.
+            sample_kwargs: Additional keyword arguments to pass to model.sample_actions, e.g. `{"num_samples": 4,
+                "aggregate": "medoid"}` to reduce several samples that share the prefix to one action chunk.
             metadata: Additional metadata to store with the policy.
             pytorch_device: Device to use for PyTorch models (e.g., "cpu", "cuda:0").
                           Only relevant when is_pytorch=True.
             is_pytorch: Whether the model is a PyTorch model. If False, assumes JAX model.
+            batch_buckets: Batch sizes that `infer_batch` pads its batches to, so that only a few executables have
+                to be compiled. Larger batches are split. If None, batches are padded to the next power of two.
+            fuse_transforms: Compile the trailing input transforms and the leading output transforms that are
+                `JittableTransformFn`s (e.g. padding, unnormalization and output slicing) into the same program as
+                `sample_actions`, together with the conversion of uint8 images to floats. Only the inputs left by the
+                remaining host transforms are copied to the device, and only the outputs of the fused output transforms
+                are copied back. Only supported for JAX models.
         """
+        if batch_buckets is not None and (not batch_buckets or min(batch_buckets) < 1):
+            raise ValueError(f"Batch buckets must be positive, got {batch_buckets}")
+        if fuse_transforms and is_pytorch:
+            raise ValueError("Fusing transforms is only supported for JAX models.")
+        device_transforms: Sequence[_transforms.DataTransformFn] = ()
+        device_output_transforms: Sequence[_transforms.DataTransformFn] = ()
+        if fuse_transforms:
+            num_host = len(transforms) - _num_jittable(reversed(transforms))
+            transforms, device_transforms = transforms[:num_host], transforms[num_host:]
+            num_device = _num_jittable(output_transforms)
+            device_output_transforms, output_transforms = output_transforms[:num_device], output_transforms[num_device:]
         self._model = model
         self._input_transform = _transforms.compose(transforms)
         self._output_transform = _transforms.compose(output_transforms)
@@ -54,6 +82,7 @@ class Policy(BasePolicy):
         self._metadata = metadata or {}
         self._is_pytorch_model = is_pytorch
         self._pytorch_device = pytorch_device
+        self._batch_buckets = tuple(sorted(set(batch_buckets))) if batch_buckets is not None else None
 
         if self._is_pytorch_model:
             self._model = self._model.to(pytorch_device)
@@ -61,75 +90,406 @@ class Policy(BasePolicy):
             self._sample_actions = model.sample_actions
         else:
             # JAX model setup
-            self._sample_actions = nnx_utils.module_jit(model.sample_actions)
+            self._sample_actions = nnx_utils.module_jit(model.sample_actions, static_argnames=_STATIC_SAMPLE_KWARGS)
             self._rng = rng or jax.random.key(0)
+        # Takes the module state, a random key and a batch of host-transformed inputs, see `_infer_fused`.
+        self._fused_sample_actions = (
+            _fuse_sample_actions(
+                self._sample_actions,
+                _transforms.compose(device_transforms),
+                _transforms.compose(device_output_transforms),
+            )
+            if fuse_transforms
+            else None
+        )
+        # JAX models whose params were restored as numpy arrays start out in host memory.
+        self._on_device = self._is_pytorch_model or all(
+            isinstance(x, jax.Array) for x in jax.tree.leaves(self._sample_actions.state)
+        )
+        # Shardings of the params, restored by `to_device` so that the compiled executables can be reused.
+        self._shardings = None
+        # Where the inputs of JAX models are copied to. None means the default device; replicas use their own devices.
+        self._input_sharding: jax.sharding.Sharding | None = None
 
     @override
     def infer(self, obs: dict, *, noise: np.ndarray | None = None) -> dict:  # type: ignore[misc]
+        self._ensure_on_device()
+        timer = _StageTimer()
         # Make a copy since transformations may modify the inputs in place.
         inputs = jax.tree.map(lambda x: x, obs)
         inputs = self._input_transform(inputs)
-        if not self._is_pytorch_model:
-            # Make a batch and convert to jax.Array.
-            inputs = jax.tree.map(lambda x: jnp.asarray(x)[np.newaxis, ...], inputs)
-            self._rng, sample_rng_or_pytorch_device = jax.random.split(self._rng)
-        else:
-            # Convert inputs to PyTorch tensors and move to correct device
-            inputs = jax.tree.map(lambda x: torch.from_numpy(np.array(x)).to(self._pytorch_device)[None, ...], inputs)
-            sample_rng_or_pytorch_device = self._pytorch_device
+        timer.lap("input_transform")
 
         # Prepare kwargs for sample_actions
         sample_kwargs = dict(self._sample_kwargs)
         if noise is not None:
-            noise = torch.from_numpy(noise).to(self._pytorch_device) if self._is_pytorch_model else jnp.asarray(noise)
+            if self._is_pytorch_model:
+                noise = torch.from_numpy(noise).to(self._pytorch_device)
+            else:
+                noise = jax.device_put(noise, self._input_sharding)
 
-            if noise.ndim == 2:  # If noise is (action_horizon, action_dim), add batch dimension
-                noise = noise[None, ...]  # Make it (1, action_horizon, action_dim)
+            # If noise is ([num_samples,] action_horizon, action_dim), add batch dimension
+            if noise.ndim == (2 if sample_kwargs.get("num_samples") is None else 3):
+                noise = noise[None, ...]  # Make it (1, [num_samples,] action_horizon, action_dim)
             sample_kwargs["noise"] = noise
 
-        observation = _model.Observation.from_dict(inputs)
-        start_time = time.monotonic()
-        outputs = {
-            "state": inputs["state"],
-            "actions": self._sample_actions(sample_rng_or_pytorch_device, observation, **sample_kwargs),
-        }
-        model_time = time.monotonic() - start_time
-        if self._is_pytorch_model:
-            outputs = jax.tree.map(lambda x: np.asarray(x[0, ...].detach().cpu()), outputs)
+        if self._fused_sample_actions is not None:
+            inputs = jax.tree.map(lambda x: np.asarray(x)[np.newaxis, ...], inputs)
+            outputs = jax.tree.map(lambda x: x[0, ...], self._infer_fused(inputs, sample_kwargs, timer))
         else:
-            outputs = jax.tree.map(lambda x: np.asarray(x[0, ...]), outputs)
+            if not self._is_pytorch_model:
+                # Make a batch and copy it to the device(s) of the policy.
+                inputs = jax.device_put(
+                    jax.tree.map(lambda x: np.asarray(x)[np.newaxis, ...], inputs), self._input_sharding
+                )
+                self._rng, sample_rng_or_pytorch_device = jax.random.split(self._rng)
+            else:
+                # Convert inputs to PyTorch tensors and move to correct device
+                inputs = jax.tree.map(
+                    lambda x: torch.from_numpy(np.array(x)).to(self._pytorch_device)[None, ...], inputs
+                )
+                sample_rng_or_pytorch_device = self._pytorch_device
+
+            observation = _model.Observation.from_dict(inputs)
+            self._synchronize(inputs)
+            timer.lap("host_to_device")
+            outputs = {
+                "state": inputs["state"],
+                "actions": self._sample_actions(sample_rng_or_pytorch_device, observation, **sample_kwargs),
+            }
+            self._synchronize(outputs)
+            timer.lap("infer")
+            if self._is_pytorch_model:
+                outputs = jax.tree.map(lambda x: np.asarray(x[0, ...].detach().cpu()), outputs)
+            else:
+                outputs = jax.tree.map(lambda x: np.asarray(x[0, ...]), outputs)
+            timer.lap("device_to_host")
 
         outputs = self._output_transform(outputs)
-        outputs["policy_timing"] = {
-            "infer_ms": model_time * 1000,
-        }
+        timer.lap("output_transform")
+        outputs["policy_timing"] = timer.timings()
+        return outputs
+
+    @override
+    def infer_batch(self, obs: Sequence[dict]) -> list[dict]:  # type: ignore[misc]
+        """Runs several independent observations through a single `sample_actions` call.
+
+        Input transforms are applied to every observation separately, the results are stacked along a new leading
+        batch dimension, and the model outputs are split back into per-observation dicts before the output transforms
+        are applied.
+
+        The batch is padded to the next batch bucket (see `batch_size_for`) by repeating its last observation, and the
+        outputs for the padding are discarded. Batches larger than the largest bucket are split.
+        """
+        if not obs:
+            return []
+        if self._batch_buckets is not None and len(obs) > self._batch_buckets[-1]:
+            max_size = self._batch_buckets[-1]
+            return [result for i in range(0, len(obs), max_size) for result in self.infer_batch(obs[i : i + max_size])]
+
+        self._ensure_on_device()
+        timer = _StageTimer()
+        # Make a copy since transformations may modify the inputs in place.
+        items = [self._input_transform(jax.tree.map(lambda x: x, o)) for o in obs]
+        padded_size = self.batch_size_for(len(obs))
+        inputs = jax.tree.map(lambda *xs: _stack_padded(xs, padded_size), *items)
+        timer.lap("input_transform")
+        if self._fused_sample_actions is not None:
+            batch_outputs = self._infer_fused(inputs, self._sample_kwargs, timer)
+        else:
+            if not self._is_pytorch_model:
+                inputs = jax.device_put(inputs, self._input_sharding)
+                self._rng, sample_rng_or_pytorch_device = jax.random.split(self._rng)
+            else:
+                inputs = jax.tree.map(lambda x: torch.from_numpy(x).to(self._pytorch_device), inputs)
+                sample_rng_or_pytorch_device = self._pytorch_device
+
+            observation = _model.Observation.from_dict(inputs)
+            self._synchronize(inputs)
+            timer.lap("host_to_device")
+            batch_outputs = {
+                "state": inputs["state"],
+                "actions": self._sample_actions(sample_rng_or_pytorch_device, observation, **self._sample_kwargs),
+            }
+            self._synchronize(batch_outputs)
+            timer.lap("infer")
+            if self._is_pytorch_model:
+                batch_outputs = jax.tree.map(lambda x: np.asarray(x.detach().cpu()), batch_outputs)
+            else:
+                batch_outputs = jax.tree.map(np.asarray, batch_outputs)
+            timer.lap("device_to_host")
+
+        results = [
+            self._output_transform(jax.tree.map(lambda x, i=i: x[i, ...], batch_outputs)) for i in range(len(obs))
+        ]
+        timer.lap("output_transform")
+        for outputs in results:
+            outputs["policy_timing"] = {**timer.timings(), "batch_size": len(obs), "padded_batch_size": padded_size}
+        return results
+
+    def _infer_fused(self, inputs: dict, sample_kwargs: dict[str, Any], timer: "_StageTimer") -> dict:
+        """Runs the fused transforms and `sample_actions` on a batch of host-transformed numpy inputs."""
+        inputs = jax.device_put(inputs, self._input_sharding)
+        self._synchronize(inputs)
+        timer.lap("host_to_device")
+        self._rng, sample_rng = jax.random.split(self._rng)
+        outputs = self._fused_sample_actions(self._sample_actions.state, sample_rng, inputs, **sample_kwargs)
+        self._synchronize(outputs)
+        timer.lap("infer")
+        outputs = jax.tree.map(np.asarray, outputs)
+        timer.lap("device_to_host")
         return outputs
 
+    def batch_size_for(self, num_obs: int) -> int:
+        """Returns the batch size `infer_batch` runs the model with for `num_obs` observations.
+
+        Batches larger than the largest bucket are split into batches of the largest bucket and a remainder.
+        """
+        if self._batch_buckets is None:
+            return 1 << (num_obs - 1).bit_length()
+        if num_obs > self._batch_buckets[-1]:
+            return self._batch_buckets[-1]
+        return next(size for size in self._batch_buckets if size >= num_obs)
+
+    def warmup(
+        self,
+        fake_obs: Callable[[int], _model.Observation],
+        *,
+        batch_sizes: Sequence[int] = (1,),
+        sample_kwargs_variants: Sequence[dict[str, Any]] = ({},),
+        example: dict | None = None,
+    ) -> None:
+        """Compiles `sample_actions` ahead of time so that the first requests don't have to wait for it.
+
+        If the JAX persistent compilation cache is enabled (`jax_compilation_cache_dir`), the compiled executables are
+        loaded from the cache instead when the same model is served again.
+
+        Args:
+            fake_obs: Returns a model observation for a given batch size, e.g. `model_config.fake_obs`. It must have the
+                same structure, shapes and dtypes as the output of the input transforms, otherwise the first request
+                still triggers a compilation.
+            batch_sizes: The numbers of observations to compile for, e.g. all batch sizes used by the server when
+                batching requests. Batch size 1 compiles `infer`, larger batch sizes compile the padded batch size
+                used by `infer_batch`.
+            sample_kwargs_variants: Overrides of the sample kwargs to compile, e.g. `[{"num_steps": 5}]`.
+            example: An observation as sent by the clients. Policies with fused transforms compile a function of the
+                outputs of the host transforms, so they are warmed up with this example instead of `fake_obs`.
+        """
+        self._ensure_on_device()
+        if self._fused_sample_actions is not None and example is None:
+            logging.warning("Skipping the warmup of a policy with fused transforms, since no example was given")
+            return
+        if example is not None:
+            example = self._input_transform(jax.tree.map(lambda x: x, example))
+        compiled_sizes = sorted({1 if size == 1 else self.batch_size_for(size) for size in batch_sizes})
+        # Like the keys used by inference, so that the executables compiled here are the ones that serve requests.
+        _, rng = jax.random.split(self._rng)
+        for batch_size in compiled_sizes:
+            # The inputs are placed like in `infer` and `infer_batch`, e.g. on the devices of a replica.
+            if self._fused_sample_actions is not None:
+                inputs = jax.tree.map(lambda x, size=batch_size: _stack_padded([x], size), example)
+                inputs = jax.device_put(inputs, self._input_sharding)
+                run = functools.partial(self._fused_sample_actions, self._sample_actions.state, rng, inputs)
+            elif self._is_pytorch_model:
+                observation = jax.tree.map(
+                    lambda x: torch.from_numpy(np.asarray(x)).to(self._pytorch_device), fake_obs(batch_size)
+                )
+                run = functools.partial(self._sample_actions, self._pytorch_device, observation)
+            else:
+                observation = jax.device_put(fake_obs(batch_size), self._input_sharding)
+                run = functools.partial(self._sample_actions, rng, observation)
+            for variant in sample_kwargs_variants:
+                start_time = time.monotonic()
+                actions = run(**{**self._sample_kwargs, **variant})
+                self._synchronize(actions)
+                elapsed = time.monotonic() - start_time
+                logging.info(f"Warmed up batch size {batch_size} with sample kwargs {variant} in {elapsed:.1f}s")
+
+    def _synchronize(self, tree: Any) -> None:
+        """Waits until all device computations producing `tree` are done, so that they can be timed accurately."""
+        if self._is_pytorch_model:
+            if torch.cuda.is_available() and str(self._pytorch_device).startswith("cuda"):
+                torch.cuda.synchronize(self._pytorch_device)
+        else:
+            jax.block_until_ready(tree)
+
     @property
     def metadata(self) -> dict[str, Any]:
         return self._metadata
 
+    @property
+    def on_device(self) -> bool:
+        """Whether the model weights are in device memory (see `to_host`)."""
+        return self._on_device
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the model weights in bytes."""
+        if self._is_pytorch_model:
+            tensors = [*self._model.parameters(), *self._model.buffers()]
+            return sum(t.numel() * t.element_size() for t in tensors)
+        return sum(x.nbytes for x in jax.tree.leaves(self._sample_actions.state))
+
+    def to_host(self) -> None:
+        """Moves the model weights to host memory, freeing their device memory.
+
+        The weights are moved back by `to_device`, which is also called automatically by the next inference. For JAX
+        models, this doesn't require a recompilation.
+        """
+        if not self._on_device:
+            return
+        if self._is_pytorch_model:
+            self._model.to("cpu")
+        else:
+            self._shardings = jax.tree.map(lambda x: x.sharding, self._sample_actions.state)
+            host_state = jax.device_get(self._sample_actions.state)
+            # The model and the jitted method both reference the device arrays, so both must be updated.
+            self._sample_actions.state = host_state
+            nnx.update(self._model, host_state)
+        self._on_device = False
+
+    def to_device(self) -> None:
+        """Moves the model weights to device memory after `to_host`, or if they were restored to host memory."""
+        if self._on_device:
+            return
+        if self._is_pytorch_model:
+            self._model.to(self._pytorch_device)
+        else:
+            device_state = jax.device_put(self._sample_actions.state, self._shardings)
+            self._sample_actions.state = device_state
+            nnx.update(self._model, device_state)
+        self._on_device = True
+
+    def replicate(self, devices: Sequence[jax.Device], *, rng: at.KeyArrayLike | None = None) -> "Policy":
+        """Returns a copy of the policy whose model weights are placed on `devices`.
+
+        The copy shares the transforms and the jitted `sample_actions` with this policy, so only the weights are
+        copied, and weights that already live on `devices` aren't copied at all. With several devices, the weights are
+        sharded across them like during FSDP training. Only supported for JAX models.
+
+        Args:
+            devices: The devices of the copy.
+            rng: Random key of the copy. If None, a key derived from this policy's key and the first device is used, so
+                that copies on different devices don't sample the same noise.
+        """
+        if self._is_pytorch_model:
+            raise ValueError("Replicating PyTorch policies is not supported.")
+        if not devices:
+            raise ValueError("At least one device is required.")
+
+        self._ensure_on_device()
+        state = self._sample_actions.state
+        if len(devices) == 1:
+            input_sharding = jax.sharding.SingleDeviceSharding(devices[0])
+            state = jax.device_put(state, input_sharding)
+        else:
+            mesh = jax.sharding.Mesh(np.asarray(devices).reshape(1, -1), (_sharding.BATCH_AXIS, _sharding.FSDP_AXIS))
+            # The batch axis of the mesh has a single entry, so the inputs are replicated across the devices.
+            input_sharding = jax.sharding.NamedSharding(mesh, jax.sharding.PartitionSpec())
+            state = jax.device_put(state, _sharding.fsdp_sharding(state, mesh))
+
+        replica = copy.copy(self)
+        replica._sample_actions = copy.copy(self._sample_actions)  # noqa: SLF001
+        replica._sample_actions.state = state  # noqa: SLF001
+        # The copy needs its own module, since `to_host` and `to_device` update the module in place.
+        graphdef, _ = nnx.split(self._model)
+        replica._model = nnx.merge(graphdef, state)  # noqa: SLF001
+        replica_rng = rng if rng is not None else jax.random.fold_in(self._rng, devices[0].id)
+        replica._rng = jax.device_put(replica_rng, input_sharding)  # noqa: SLF001
+        replica._shardings = None  # noqa: SLF001
+        replica._input_sharding = input_sharding  # noqa: SLF001
+        return replica
+
+    def _ensure_on_device(self) -> None:
+        if not self._on_device:
+            logging.info("Moving the model weights back to the device")
+            self.to_device()
+
+
+def _num_jittable(transforms: Iterable[_transforms.DataTransformFn]) -> int:
+    """Returns the number of leading transforms that are `JittableTransformFn`s."""
+    return sum(1 for _ in itertools.takewhile(lambda t: isinstance(t, _transforms.JittableTransformFn), transforms))
+
+
+def _fuse_sample_actions(
+    sample_actions: nnx_utils.JittedMethod,
+    input_transform: _transforms.DataTransformFn,
+    output_transform: _transforms.DataTransformFn,
+) -> Callable[..., dict]:
+    """Compiles the input transforms, `sample_actions` and the output transforms into a single jitted function."""
+
+    def fused(state: nnx.State, rng: at.KeyArrayLike, inputs: dict, **sample_kwargs) -> dict:
+        inputs = input_transform(inputs)
+        observation = _model.Observation.from_dict(inputs)
+        outputs = {"state": inputs["state"], "actions": sample_actions.fn(state, rng, observation, **sample_kwargs)}
+        return output_transform(outputs)
+
+    return jax.jit(fused, static_argnames=_STATIC_SAMPLE_KWARGS)
+
+
+def _stack_padded(items: Sequence[Any], size: int) -> np.ndarray:
+    """Stacks `items` along a new leading axis, repeating the last item until the batch has `size` entries."""
+    items = [np.asarray(x) for x in items]
+    return np.stack(items + [items[-1]] * (size - len(items)))
+
+
+class _StageTimer:
+    """Measures the time spent in consecutive stages of a policy call."""
+
+    def __init__(self) -> None:
+        self._timings: dict[str, float] = {}
+        self._last = time.monotonic()
+
+    def lap(self, stage: str) -> None:
+        """Records the time since the previous lap as the duration of `stage`."""
+        now = time.monotonic()
+        self._timings[f"{stage}_ms"] = (now - self._last) * 1000
+        self._last = now
+
+    def timings(self) -> dict[str, float]:
+        return dict(self._timings)
+
 
 class PolicyRecorder(_base_policy.BasePolicy):
-    """Records the policy's behavior to disk."""
+    """Records the policy's behavior to disk.
+
+    Records are written by a background `policy_records.RecordWriter`, so recording doesn't add disk latency to the
+    inference calls. Use `policy_records.RecordReader` to load them.
+    """
+
+    def __init__(self, policy: _base_policy.BasePolicy, record_dir: str, **writer_kwargs):
+        """Creates the recorder.
 
-    def __init__(self, policy: _base_policy.BasePolicy, record_dir: str):
+        Args:
+            policy: The policy to record.
+            record_dir: The directory to write the records to.
+            **writer_kwargs: Passed to `policy_records.RecordWriter`, e.g. `shard_size` or `image_codec`.
+        """
         self._policy = policy
 
         logging.info(f"Dumping policy records to: {record_dir}")
-        self._record_dir = pathlib.Path(record_dir)
-        self._record_dir.mkdir(parents=True, exist_ok=True)
-        self._record_step = 0
+        self._writer = _policy_records.RecordWriter(record_dir, **writer_kwargs)
 
     @override
     def infer(self, obs: dict) -> dict:  # type: ignore[misc]
         results = self._policy.infer(obs)
+        self._record(obs, results)
+        return results
 
-        data = {"inputs": obs, "outputs": results}
-        data = flax.traverse_util.flatten_dict(data, sep="/")
+    @override
+    def infer_batch(self, obs: Sequence[dict]) -> list[dict]:  # type: ignore[misc]
+        results = self._policy.infer_batch(obs)
+        for o, r in zip(obs, results, strict=True):
+            self._record(o, r)
+        return results
 
-        output_path = self._record_dir / f"step_{self._record_step}"
-        self._record_step += 1
+    def flush(self) -> None:
+        """Waits until all records so far are written to disk."""
+        self._writer.flush()
 
-        np.save(output_path, np.asarray(data))
-        return results
+    def close(self) -> None:
+        self._writer.close()
+
+    def _record(self, obs: dict, results: dict) -> None:
+        data = {"inputs": obs, "outputs": results}
+        self._writer.write(flax.traverse_util.flatten_dict(data, sep="/"))
@@ -0,0 +1,357 @@
+from collections import OrderedDict
+from collections.abc import Callable
+import concurrent.futures
+import dataclasses
+import logging
+import os
+import threading
+import time
+import weakref
+
+import jax
+
+from openpi.models import delta_params as _delta_params
+from openpi.policies import policy as _policy
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class PolicyCacheStats:
+    """Counters describing how the cache was used."""
+
+    # Requests served by a policy that was already in device memory.
+    hits: int = 0
+    # Requests served by a policy that was staged in host memory and had to be moved back to the device.
+    host_hits: int = 0
+    # Requests that had to load the policy from its checkpoint.
+    misses: int = 0
+    # Policies loaded ahead of time by `prefetch`.
+    prefetches: int = 0
+    # Policies that were removed from device memory to stay within the budget.
+    evictions: int = 0
+    # Total time spent loading policies and moving them back to the device.
+    load_time_s: float = 0.0
+
+
+class PolicyCache:
+    """A bounded LRU cache of loaded policies, keyed by checkpoint path.
+
+    Policies are kept in device memory as long as the total size of their weights stays within `max_device_bytes`
+    (and their number within `max_policies`). When a policy has to make room for another one, the least recently used
+    policy is evicted. If `host_staging` is enabled, evicted policies are moved to host memory instead of being
+    dropped, so that switching back to them only costs a host-to-device copy instead of a checkpoint restore. Staged
+    policies are dropped once their total size exceeds `max_host_bytes`. The base params cached in host memory for
+    delta checkpoints (see `delta_params`) count against that budget as well.
+
+    `prefetch` loads policies that will be needed soon in the background, first into host memory and then, if they
+    fit into the budget without evicting the most recently used policy, into device memory. A later `get` then only
+    returns the policy (or moves it to the device).
+
+    The cache can be used from several threads.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], _policy.Policy],
+        *,
+        max_device_bytes: int | None = None,
+        max_policies: int | None = None,
+        host_staging: bool = False,
+        max_host_bytes: int | None = None,
+        host_loader: Callable[[str], _policy.Policy] | None = None,
+        warmup: Callable[[_policy.Policy], None] | None = None,
+    ) -> None:
+        """Creates the cache.
+
+        Args:
+            loader: Creates the policy for a checkpoint path.
+            max_device_bytes: Budget for the weights of the policies in device memory. If None, only `max_policies`
+                limits the number of policies.
+            max_policies: Maximum number of policies in device memory. If None, only `max_device_bytes` applies.
+            host_staging: Whether to move evicted policies to host memory instead of dropping them.
+            max_host_bytes: Budget for the weights of the policies staged in host memory, including the cached base
+                params of delta checkpoints. If None, `default_host_budget()` is used, so that prefetching through a
+                long task list can't exhaust the host memory. Unlimited if the system memory can't be determined.
+            host_loader: Creates the policy for a checkpoint path with its weights in host memory. Used by `prefetch`
+                so that loading a policy doesn't allocate device memory that is still in use by the current one. If
+                None, `loader` is used and the policy is moved to the host right after loading if it doesn't fit.
+            warmup: Called once for every loaded policy when it is first in device memory, e.g. to compile it before
+                it serves its first request.
+        """
+        if max_policies is not None and max_policies < 1:
+            raise ValueError(f"max_policies must be at least 1, got {max_policies}")
+        self._loader = loader
+        self._host_loader = host_loader
+        self._max_device_bytes = max_device_bytes
+        self._max_policies = max_policies
+        self._host_staging = host_staging
+        self._max_host_bytes = max_host_bytes if max_host_bytes is not None else default_host_budget()
+        self._warmup = warmup
+        # Policies that were already warmed up.
+        self._warmed_up: weakref.WeakSet[_policy.Policy] = weakref.WeakSet()
+
+        self._lock = threading.RLock()
+        # Ordered from least to most recently used.
+        self._device: OrderedDict[str, _policy.Policy] = OrderedDict()
+        self._host: OrderedDict[str, _policy.Policy] = OrderedDict()
+        # Largest policy seen so far, used to make room before loading a new policy.
+        self._expected_nbytes = 0
+        # Device memory of the policies that are being moved to the device, by key.
+        self._reserved: dict[str, int] = {}
+        self._stats = PolicyCacheStats()
+        # Policies that are being loaded by `get` or `prefetch`, or moved to host memory after being evicted.
+        self._loading: dict[str, concurrent.futures.Future] = {}
+        self._prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="policy_prefetch"
+        )
+
+    @property
+    def stats(self) -> PolicyCacheStats:
+        return dataclasses.replace(self._stats)
+
+    @property
+    def device_bytes(self) -> int:
+        with self._lock:
+            return sum(policy.nbytes for policy in self._device.values())
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._device or key in self._host
+
+    def on_device(self, key: str) -> bool:
+        with self._lock:
+            return key in self._device
+
+    def get(self, key: str) -> _policy.Policy:
+        """Returns the policy for `key`, loading it if necessary. The policy is in device memory.
+
+        The lock is not held while the policy is loaded or moved between host and device memory, so that other
+        policies can be used in the meantime. Concurrent calls for the same key wait for the first one instead of
+        loading the policy twice.
+        """
+        while True:
+            with self._lock:
+                loading = self._loading.get(key)
+                if loading is None:
+                    if key in self._device:
+                        self._stats.hits += 1
+                        self._device.move_to_end(key)
+                        return self._device[key]
+                    staged = self._host.pop(key, None)
+                    nbytes = self._expected_nbytes if staged is None else staged.nbytes
+                    evicted = self._make_room(nbytes, keep=key)
+                    self._reserved[key] = nbytes
+                    future: concurrent.futures.Future = concurrent.futures.Future()
+                    self._loading[key] = future
+                    break
+            # Wait for the prefetch (or another `get`) instead of loading the policy a second time. If it failed, the
+            # policy is loaded in the next iteration.
+            concurrent.futures.wait([loading])
+
+        start_time = time.monotonic()
+        try:
+            # Free the device memory of the evicted policies before allocating the new one.
+            self._stage(evicted)
+            if staged is not None:
+                policy = staged
+                policy.to_device()
+            else:
+                policy = self._loader(key)
+            self._warm_up(policy)
+        except BaseException as e:
+            with self._lock:
+                if staged is not None:
+                    self._host[key] = staged
+                self._reserved.pop(key, None)
+                self._loading.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if staged is not None:
+                self._stats.host_hits += 1
+                logger.info(f"Moved policy {key} back to the device in {time.monotonic() - start_time:.2f}s")
+            else:
+                self._stats.misses += 1
+                self._expected_nbytes = max(self._expected_nbytes, policy.nbytes)
+                logger.info(f"Loaded policy {key} in {time.monotonic() - start_time:.2f}s")
+            self._stats.load_time_s += time.monotonic() - start_time
+
+            self._reserved.pop(key, None)
+            self._device[key] = policy
+            # The size of a new policy is only known after loading it.
+            evicted = self._make_room(None, keep=key)
+            self._loading.pop(key, None)
+        future.set_result(None)
+        self._stage(evicted)
+        return policy
+
+    def prefetch(self, key: str) -> concurrent.futures.Future:
+        """Starts loading the policy for `key` in the background.
+
+        Prefetches are processed one at a time, in the order in which they were requested.
+
+        Returns:
+            A future that is done once the policy is in host or device memory.
+        """
+        with self._lock:
+            if key in self._loading:
+                return self._loading[key]
+            if key in self._device or key in self._host:
+                future: concurrent.futures.Future = concurrent.futures.Future()
+                future.set_result(None)
+                return future
+            future = self._prefetch_executor.submit(self._prefetch, key)
+            self._loading[key] = future
+            return future
+
+    def clear(self) -> None:
+        with self._lock:
+            self._device.clear()
+            self._host.clear()
+
+    def _prefetch(self, key: str) -> None:
+        """Loads a policy in the background. Like `get`, only holds the lock to decide where the policy goes."""
+        try:
+            with self._lock:
+                if key in self._device or key in self._host:
+                    self._loading.pop(key, None)
+                    return
+            start_time = time.monotonic()
+            policy = (self._host_loader or self._loader)(key)
+
+            with self._lock:
+                self._stats.prefetches += 1
+                self._expected_nbytes = max(self._expected_nbytes, policy.nbytes)
+                # Never evict the policy that is currently in use, which is the most recently used one.
+                current = next(reversed(self._device), None)
+                to_device = self._fits(policy.nbytes, keep=current)
+                evicted = []
+                if to_device:
+                    evicted = self._make_room(policy.nbytes, keep=current)
+                    self._reserved[key] = policy.nbytes
+
+            self._stage(evicted)
+            if to_device:
+                policy.to_device()
+                self._warm_up(policy)
+            else:
+                policy.to_host()
+
+            with self._lock:
+                if to_device:
+                    self._reserved.pop(key, None)
+                    current = next(reversed(self._device), None)
+                    self._device[key] = policy
+                    # Prefetched policies are used next, but the current one stays the most recently used.
+                    if current is not None:
+                        self._device.move_to_end(current)
+                else:
+                    self._host[key] = policy
+                    self._trim_host()
+                self._loading.pop(key, None)
+            logger.info(
+                f"Prefetched policy {key} to {'device' if to_device else 'host'} memory in "
+                f"{time.monotonic() - start_time:.2f}s"
+            )
+        except Exception:
+            logger.exception(f"Failed to prefetch policy {key}")
+            with self._lock:
+                self._reserved.pop(key, None)
+                self._loading.pop(key, None)
+            raise
+
+    def _warm_up(self, policy: _policy.Policy) -> None:
+        if self._warmup is None or policy in self._warmed_up:
+            return
+        self._warmup(policy)
+        self._warmed_up.add(policy)
+
+    def _fits(self, nbytes: int, *, keep: str | None) -> bool:
+        """Whether a policy of `nbytes` fits into device memory if all policies other than `keep` are evicted."""
+        kept = [self._device[keep]] if keep is not None else []
+        if self._max_policies is not None and len(kept) + len(self._reserved) + 1 > self._max_policies:
+            return False
+        kept_nbytes = sum(p.nbytes for p in kept) + sum(self._reserved.values())
+        return self._max_device_bytes is None or kept_nbytes + nbytes <= self._max_device_bytes
+
+    def _make_room(self, nbytes: int | None, *, keep: str | None) -> list[tuple]:
+        """Evicts least recently used policies other than `keep` until a new policy of `nbytes` fits into the budget.
+
+        If `nbytes` is None, only makes sure that the policies that are already in device memory fit. Policies that are
+        being moved to the device count against the budget as well.
+
+        Returns:
+            The evicted policies that still have to be moved to host memory with `_stage`.
+        """
+        evicted = []
+        while True:
+            candidates = [key for key in self._device if key != keep]
+            if not candidates:
+                return evicted
+            num_policies = len(self._device) + len(self._reserved) + (nbytes is not None)
+            total_nbytes = (
+                sum(policy.nbytes for policy in self._device.values()) + sum(self._reserved.values()) + (nbytes or 0)
+            )
+            over_count = self._max_policies is not None and num_policies > self._max_policies
+            over_budget = self._max_device_bytes is not None and total_nbytes > self._max_device_bytes
+            if not (over_count or over_budget):
+                return evicted
+            staging = self._evict(candidates[0])
+            if staging is not None:
+                evicted.append(staging)
+
+    def _evict(self, key: str) -> tuple | None:
+        policy = self._device.pop(key)
+        self._stats.evictions += 1
+        if not self._host_staging:
+            logger.info(f"Evicted policy {key}")
+            return None
+        # `get` waits for the policy to arrive in host memory instead of reloading it.
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._loading[key] = future
+        return key, policy, future
+
+    def _stage(self, evicted: list[tuple]) -> None:
+        """Moves policies evicted by `_make_room` to host memory. Must be called without holding the lock."""
+        for key, policy, future in evicted:
+            try:
+                policy.to_host()
+            except Exception:
+                logger.exception(f"Failed to move policy {key} to host memory, dropping it")
+                with self._lock:
+                    self._loading.pop(key, None)
+            else:
+                with self._lock:
+                    self._host[key] = policy
+                    self._loading.pop(key, None)
+                    logger.info(f"Moved policy {key} to host memory")
+                    self._trim_host()
+            future.set_result(None)
+
+    def _trim_host(self) -> None:
+        if self._max_host_bytes is None:
+            return
+        while (
+            self._host
+            and sum(p.nbytes for p in self._host.values()) + _delta_params.base_cache_nbytes() > self._max_host_bytes
+        ):
+            dropped, _ = self._host.popitem(last=False)
+            logger.info(f"Dropped policy {dropped} from host memory")
+
+
+def default_device_budget(fraction: float = 0.8) -> int | None:
+    """Returns `fraction` of the memory of the first JAX device, or None if the device doesn't report its memory."""
+    stats = jax.local_devices()[0].memory_stats()
+    if not stats or "bytes_limit" not in stats:
+        return None
+    return int(stats["bytes_limit"] * fraction)
+
+
+def default_host_budget(fraction: float = 0.5) -> int | None:
+    """Returns `fraction` of the physical memory of the host, or None if it can't be determined."""
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * fraction)
+    except (ValueError, OSError, AttributeError):
+        return None
@@ -0,0 +1,286 @@
+import threading
+
+import pytest
+
+from openpi.policies import policy_cache as _policy_cache
+
+
+class _FakePolicy:
+    def __init__(self, key: str, nbytes: int) -> None:
+        self.key = key
+        self.nbytes = nbytes
+        self.on_device = True
+
+    def to_host(self) -> None:
+        self.on_device = False
+
+    def to_device(self) -> None:
+        self.on_device = True
+
+
+class _Loader:
+    def __init__(self, nbytes: int = 100) -> None:
+        self.nbytes = nbytes
+        self.loaded: list[str] = []
+
+    def __call__(self, key: str) -> _FakePolicy:
+        self.loaded.append(key)
+        return _FakePolicy(key, self.nbytes)
+
+
+def test_lru_eviction_by_budget():
+    loader = _Loader()
+    cache = _policy_cache.PolicyCache(loader, max_device_bytes=250)
+
+    a = cache.get("a")
+    cache.get("b")
+    assert cache.get("a") is a
+    # "b" is the least recently used policy.
+    cache.get("c")
+    assert cache.on_device("a")
+    assert "b" not in cache
+    assert cache.device_bytes == 200
+
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 3, 1)
+    assert loader.loaded == ["a", "b", "c"]
+
+
+def test_max_policies():
+    cache = _policy_cache.PolicyCache(_Loader(), max_policies=1)
+    cache.get("a")
+    cache.get("b")
+    assert not cache.on_device("a")
+    assert cache.on_device("b")
+
+
+def test_host_staging():
+    loader = _Loader()
+    cache = _policy_cache.PolicyCache(loader, max_policies=1, host_staging=True, max_host_bytes=100)
+
+    a = cache.get("a")
+    cache.get("b")
+    assert not a.on_device
+    assert "a" in cache
+
+    # Switching back moves the policy to the device again instead of reloading it.
+    assert cache.get("a") is a
+    assert a.on_device
+    assert loader.loaded == ["a", "b"]
+    assert cache.stats.host_hits == 1
+
+    # Only one policy fits into the host budget, so the least recently used one is dropped.
+    cache.get("c")
+    assert "a" in cache
+    assert not cache.on_device("a")
+    assert "b" not in cache
+
+
+def test_host_budget_includes_base_params(monkeypatch):
+    monkeypatch.setattr(_policy_cache._delta_params, "base_cache_nbytes", lambda: 100)  # noqa: SLF001
+    cache = _policy_cache.PolicyCache(_Loader(), max_policies=1, host_staging=True, max_host_bytes=150)
+
+    cache.get("a")
+    # The staged policy and the cached base params don't fit into the host budget together.
+    cache.get("b")
+    assert "a" not in cache
+
+
+def test_warmup():
+    warmed_up = []
+    cache = _policy_cache.PolicyCache(
+        _Loader(), max_policies=1, host_staging=True, warmup=lambda policy: warmed_up.append(policy.key)
+    )
+    cache.get("a")
+    cache.get("b")
+    # Moving a policy back to the device doesn't warm it up again.
+    cache.get("a")
+    cache.prefetch("c").result(timeout=10)
+    assert warmed_up == ["a", "b"]
+    cache.get("c")
+    assert warmed_up == ["a", "b", "c"]
+
+
+def test_invalid_max_policies():
+    with pytest.raises(ValueError, match="max_policies"):
+        _policy_cache.PolicyCache(_Loader(), max_policies=0)
+
+
+def test_prefetch_to_device():
+    loader = _Loader()
+    cache = _policy_cache.PolicyCache(loader, max_device_bytes=200)
+    a = cache.get("a")
+
+    cache.prefetch("b").result(timeout=10)
+    assert cache.on_device("b")
+    # The current policy must not be evicted by a prefetch.
+    assert cache.on_device("a")
+
+    b = cache.get("b")
+    assert b.on_device
+    assert loader.loaded == ["a", "b"]
+    assert cache.get("a") is a
+    assert cache.stats.prefetches == 1
+
+
+def test_prefetch_to_host():
+    loader = _Loader()
+    host_loaded = []
+
+    def host_loader(key: str) -> _FakePolicy:
+        host_loaded.append(key)
+        policy = _FakePolicy(key, 100)
+        policy.on_device = False
+        return policy
+
+    cache = _policy_cache.PolicyCache(loader, max_policies=1, host_loader=host_loader)
+    cache.get("a")
+
+    # There is no room next to the current policy, so the prefetched one stays in host memory.
+    cache.prefetch("b").result(timeout=10)
+    assert not cache.on_device("b")
+    assert cache.on_device("a")
+
+    b = cache.get("b")
+    assert b.on_device
+    assert loader.loaded == ["a"]
+    assert host_loaded == ["b"]
+    assert not cache.on_device("a")
+
+
+def test_get_waits_for_prefetch():
+    release = threading.Event()
+    loader = _Loader()
+
+    def slow_loader(key: str) -> _FakePolicy:
+        release.wait(timeout=10)
+        return loader(key)
+
+    cache = _policy_cache.PolicyCache(slow_loader)
+    future = cache.prefetch("a")
+    threading.Timer(0.1, release.set).start()
+    policy = cache.get("a")
+    assert future.done()
+    assert policy.key == "a"
+    # The policy was only loaded once.
+    assert loader.loaded == ["a"]
+
+
+def test_get_does_not_block_other_keys():
+    started = threading.Event()
+    release = threading.Event()
+    loader = _Loader()
+
+    def slow_loader(key: str) -> _FakePolicy:
+        if key == "a":
+            started.set()
+            release.wait(timeout=10)
+        return loader(key)
+
+    cache = _policy_cache.PolicyCache(slow_loader)
+    cache.get("b")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("a"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(timeout=10)
+    # Policies that are already loaded are returned while "a" is loading.
+    getter = threading.Thread(target=cache.get, args=("b",))
+    getter.start()
+    getter.join(timeout=5)
+    assert not getter.is_alive()
+    release.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert [policy.key for policy in results] == ["a", "a"]
+    assert results[0] is results[1]
+    # Concurrent calls for the same key only load the policy once.
+    assert loader.loaded == ["b", "a"]
+
+
+def test_get_failure():
+    def failing_loader(key: str) -> _FakePolicy:
+        raise RuntimeError(f"Cannot load {key}")
+
+    cache = _policy_cache.PolicyCache(failing_loader)
+    with pytest.raises(RuntimeError, match="Cannot load a"):
+        cache.get("a")
+    # A failed load doesn't block later attempts.
+    with pytest.raises(RuntimeError, match="Cannot load a"):
+        cache.get("a")
+
+
+def test_prefetch_does_not_block_get():
+    started = threading.Event()
+    release = threading.Event()
+
+    def warmup(policy: _FakePolicy) -> None:
+        if policy.key == "b":
+            started.set()
+            release.wait(timeout=10)
+
+    cache = _policy_cache.PolicyCache(_Loader(), max_device_bytes=200, warmup=warmup)
+    a = cache.get("a")
+    future = cache.prefetch("b")
+    assert started.wait(timeout=10)
+    # The current policy is served while the prefetched one is being warmed up.
+    getter = threading.Thread(target=cache.get, args=("a",))
+    getter.start()
+    getter.join(timeout=5)
+    assert not getter.is_alive()
+    # The slot of the prefetched policy is reserved, so another policy would have to evict "a".
+    assert not cache._fits(100, keep="a")  # noqa: SLF001
+
+    release.set()
+    future.result(timeout=10)
+    assert cache.on_device("b")
+    assert cache.get("a") is a
+
+
+def test_evicted_policies_are_staged_outside_the_lock():
+    started = threading.Event()
+    release = threading.Event()
+
+    class _SlowPolicy(_FakePolicy):
+        def to_host(self) -> None:
+            started.set()
+            release.wait(timeout=10)
+            super().to_host()
+
+    loader = _Loader()
+    cache = _policy_cache.PolicyCache(
+        lambda key: _SlowPolicy(key, 100) if key == "a" else loader(key), max_policies=1, host_staging=True
+    )
+    cache.get("a")
+    # Loading "b" evicts "a", whose transfer to host memory blocks.
+    getter = threading.Thread(target=cache.get, args=("b",))
+    getter.start()
+    assert started.wait(timeout=10)
+    # The lock is free while "a" is moved to host memory.
+    assert not cache.on_device("a")
+    assert "a" not in cache
+
+    # A `get` for the evicted policy waits for the transfer instead of reloading it.
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get("a")))
+    waiter.start()
+    release.set()
+    getter.join(timeout=10)
+    waiter.join(timeout=10)
+    assert results[0].key == "a"
+    assert loader.loaded == ["b"]
+    assert cache.stats.host_hits == 1
+
+
+def test_default_host_budget(monkeypatch):
+    assert _policy_cache.default_host_budget() > 0
+    monkeypatch.setattr(_policy_cache, "default_host_budget", lambda: 150)
+    host_loader = _Loader()
+    cache = _policy_cache.PolicyCache(_Loader(), max_policies=1, host_loader=host_loader)
+    cache.get("a")
+
+    # Prefetched policies that stay in host memory are bounded by default.
+    for key in ["b", "c", "d"]:
+        cache.prefetch(key).result(timeout=10)
+    assert host_loader.loaded == ["b", "c", "d"]
+    assert [key for key in "abcd" if key in cache] == ["a", "d"]
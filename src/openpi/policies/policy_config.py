@@ -3,8 +3,11 @@ import os
 import pathlib
 from typing import Any
 
+import jax
 import jax.numpy as jnp
+import numpy as np
 
+import openpi.models.delta_params as _delta_params
 import openpi.models.model as _model
 import openpi.policies.policy as _policy
 import openpi.shared.download as download
@@ -68,6 +71,8 @@ def create_trained_policy(
     default_prompt: str | None = None,
     norm_stats: dict[str, transforms.NormStats] | None = None,
     pytorch_device: str | None = None,
+    restore_to_host: bool = False,
+    fuse_transforms: bool = False,
 ) -> _policy.Policy:
     """Create a policy from a trained checkpoint.
 
@@ -83,12 +88,17 @@ def create_trained_policy(
             from the checkpoint directory.
         pytorch_device: Device to use for PyTorch models (e.g., "cpu", "cuda", "cuda:0").
                       If None and is_pytorch=True, will use "cuda" if available, otherwise "cpu".
+        restore_to_host: Restore the params into host memory only. They are moved to the device by
+            `Policy.to_device` or by the first inference. PyTorch models are moved back to the host after loading.
+        fuse_transforms: Compile the numeric transforms next to the model (e.g. padding, unnormalization and output
+            slicing) into the same program as `sample_actions`, see `Policy`. Only supported for JAX models.
 
     Note:
         The function automatically detects the checkpoint format:
         - Distributed checkpoints (*.distcp files)
         - PyTorch safetensors checkpoints (model.safetensors)
         - JAX checkpoints (params directory)
+        - JAX checkpoints stored as a delta against a base checkpoint (params_delta directory, see `delta_params`)
     """
     repack_transforms = repack_transforms or transforms.Group()
     checkpoint_dir = download.maybe_download(str(checkpoint_dir))
@@ -117,9 +127,24 @@ def create_trained_policy(
         # Load from safetensors
         model = train_config.model.load_pytorch(train_config, weight_path)
         model.paligemma_with_expert.to_bfloat16_for_selected_params("bfloat16")
+    elif not (checkpoint_dir / "params").exists() and (checkpoint_dir / _delta_params.DELTA_DIR).exists():
+        # Load from a JAX delta checkpoint. The base params are only loaded once for all checkpoints sharing them.
+        model = train_config.model.load(
+            _delta_params.restore(
+                checkpoint_dir / _delta_params.DELTA_DIR,
+                restore_type=np.ndarray if restore_to_host else jax.Array,
+                dtype=jnp.bfloat16,
+            )
+        )
     else:
         # Load from JAX checkpoint
-        model = train_config.model.load(_model.restore_params(checkpoint_dir / "params", dtype=jnp.bfloat16))
+        model = train_config.model.load(
+            _model.restore_params(
+                checkpoint_dir / "params",
+                restore_type=np.ndarray if restore_to_host else jax.Array,
+                dtype=jnp.bfloat16,
+            )
+        )
     data_config = train_config.data.create(train_config.assets_dirs, train_config.model)
     if norm_stats is None:
         # We are loading the norm stats from the checkpoint instead of the config assets dir to make sure
@@ -129,7 +154,7 @@ def create_trained_policy(
         # norm_stats = _checkpoints.load_norm_stats(checkpoint_dir / "assets", data_config.asset_id)
         norm_stats = _checkpoints.load_norm_stats(pathlib.Path("outputs/assets/pi05_b1k"), data_config.asset_id)
 
-    return _policy.Policy(
+    policy = _policy.Policy(
         model,
         transforms=[
             *repack_transforms.inputs,
@@ -148,4 +173,8 @@ def create_trained_policy(
         metadata=train_config.policy_metadata,
         is_pytorch=is_pytorch,
         pytorch_device=pytorch_device if is_pytorch else None,
+        fuse_transforms=fuse_transforms,
     )
+    if restore_to_host:
+        policy.to_host()
+    return policy
@@ -0,0 +1,302 @@
+"""Columnar on-disk storage for policy records.
+
+Records are flat dicts mapping keys to arrays (or scalars and strings), e.g. the flattened inputs and outputs of one
+policy step. `RecordWriter` writes them on a background thread into shards of consecutive records. Every shard is a
+compressed `.npz` file holding one stacked array per key, and uint8 images are compressed individually with an image
+codec. A shard only contains records with the same keys, shapes and dtypes, so the structure of the records may change
+over time. `index.json` lists the shards, the steps they contain and their columns.
+
+`RecordReader` loads any range of steps without unpickling anything.
+"""
+
+import atexit
+import json
+import logging
+import os
+import pathlib
+import queue
+import threading
+from typing import Any
+
+import numpy as np
+from openpi_client import image_tools
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+FORMAT_VERSION = 1
+
+_CLOSE = object()
+_FLUSH = object()
+
+
+class RecordWriter:
+    """Writes records to a directory on a background thread.
+
+    `write` only puts the record on a queue, so it doesn't add disk latency to the caller. It blocks only if the
+    writer falls behind by more than `max_queue_size` records.
+    """
+
+    def __init__(
+        self,
+        record_dir: pathlib.Path | str,
+        *,
+        shard_size: int = 256,
+        image_codec: str = image_tools.IMAGE_CODEC_PNG,
+        image_quality: int = 90,
+        flush_interval_s: float = 30.0,
+        max_queue_size: int = 1024,
+    ) -> None:
+        """Creates the writer. Records already in `record_dir` are kept, new records are appended.
+
+        Args:
+            record_dir: The directory to write to.
+            shard_size: Maximum number of records per shard.
+            image_codec: Codec for uint8 images (see `image_tools.IMAGE_CODECS`). "raw" stores them like other arrays.
+            image_quality: JPEG quality (1-95). Only used if `image_codec` is "jpeg".
+            flush_interval_s: Write a partial shard if no record arrived for this long, so that little is lost if the
+                process dies.
+            max_queue_size: Maximum number of records waiting to be written.
+        """
+        if image_codec not in image_tools.IMAGE_CODECS:
+            raise ValueError(f"Unsupported image codec: {image_codec}")
+        self._record_dir = pathlib.Path(record_dir)
+        self._record_dir.mkdir(parents=True, exist_ok=True)
+        self._shard_size = shard_size
+        self._image_codec = image_codec
+        self._image_quality = image_quality
+        self._flush_interval_s = flush_interval_s
+
+        self._index = _load_index(self._record_dir)
+        self._num_steps = sum(shard["num_steps"] for shard in self._index["shards"])
+        self._skipped_keys: set[str] = set()
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._error: BaseException | None = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="record_writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def record_dir(self) -> pathlib.Path:
+        return self._record_dir
+
+    def write(self, record: dict[str, Any]) -> None:
+        """Enqueues a record.
+
+        The arrays are copied, since they may be buffers that the caller reuses (e.g. the images of `B1KPreprocessor`)
+        before the record is written.
+        """
+        if self._error is not None:
+            raise RuntimeError("The record writer failed.") from self._error
+        if self._closed:
+            raise RuntimeError("The record writer is closed.")
+        record = {
+            key: np.array(value, copy=True) if isinstance(value, np.ndarray) else value for key, value in record.items()
+        }
+        with self._flushed:
+            self._pending += 1
+        self._queue.put(record)
+
+    def flush(self) -> None:
+        """Writes all enqueued records to disk, including a partial shard, and waits until they are written."""
+        with self._flushed:
+            self._pending += 1
+        self._queue.put(_FLUSH)
+        with self._flushed:
+            self._flushed.wait_for(lambda: self._pending == 0 or self._error is not None)
+        if self._error is not None:
+            raise RuntimeError("The record writer failed.") from self._error
+
+    def close(self) -> None:
+        """Writes all enqueued records and stops the writer."""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _run(self) -> None:
+        shard: list[dict[str, np.ndarray]] = []
+        signature = None
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self._flush_interval_s)
+                except queue.Empty:
+                    # Idle, write what we have. Not requested by `flush`, so there is nobody to notify.
+                    self._write_shard(shard)
+                    shard, signature = [], None
+                    continue
+
+                if item is _CLOSE:
+                    self._write_shard(shard)
+                    return
+                if item is _FLUSH:
+                    self._write_shard(shard)
+                    shard, signature = [], None
+                else:
+                    record = self._to_arrays(item)
+                    record_signature = _signature(record)
+                    if shard and record_signature != signature:
+                        self._write_shard(shard)
+                        shard = []
+                    shard.append(record)
+                    signature = record_signature
+                    if len(shard) >= self._shard_size:
+                        self._write_shard(shard)
+                        shard, signature = [], None
+                self._done()
+        except BaseException as e:
+            logger.exception("Failed to write policy records")
+            self._error = e
+            with self._flushed:
+                self._flushed.notify_all()
+
+    def _done(self) -> None:
+        with self._flushed:
+            self._pending -= 1
+            self._flushed.notify_all()
+
+    def _to_arrays(self, record: dict[str, Any]) -> dict[str, np.ndarray]:
+        arrays = {}
+        for key, value in record.items():
+            array = np.asarray(value)
+            if array.dtype == object:
+                # Can't be stored without pickling.
+                if key not in self._skipped_keys:
+                    logger.warning(f"Not recording {key!r}: unsupported type {type(value).__name__}")
+                    self._skipped_keys.add(key)
+                continue
+            arrays[key] = array
+        return arrays
+
+    def _write_shard(self, shard: list[dict[str, np.ndarray]]) -> None:
+        if not shard:
+            return
+        columns = {}
+        arrays = {}
+        for i, key in enumerate(shard[0]):
+            name = f"c{i}"
+            values = [record[key] for record in shard]
+            first = values[0]
+            column = {"name": name, "shape": list(first.shape), "dtype": first.dtype.str}
+            if self._image_codec != image_tools.IMAGE_CODEC_RAW and image_tools.is_encodable_image(
+                first, self._image_codec
+            ):
+                encoded = [
+                    image_tools.encode_image(value, self._image_codec, quality=self._image_quality) for value in values
+                ]
+                arrays[name] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+                arrays[f"{name}_offsets"] = np.cumsum([0] + [len(data) for data in encoded], dtype=np.int64)
+                column["codec"] = self._image_codec
+            else:
+                arrays[name] = np.stack(values)
+                column["dtype"] = arrays[name].dtype.str
+            columns[key] = column
+
+        file_name = f"shard_{len(self._index['shards']):06d}.npz"
+        np.savez_compressed(self._record_dir / file_name, **arrays)
+        self._index["shards"].append(
+            {"file": file_name, "start": self._num_steps, "num_steps": len(shard), "columns": columns}
+        )
+        self._num_steps += len(shard)
+        # Replace the index atomically, so that readers never see a partially written one.
+        tmp_path = self._record_dir / f"{INDEX_FILE}.tmp"
+        tmp_path.write_text(json.dumps(self._index))
+        os.replace(tmp_path, self._record_dir / INDEX_FILE)
+
+
+class RecordReader:
+    """Reads records written by `RecordWriter`."""
+
+    def __init__(self, record_dir: pathlib.Path | str) -> None:
+        self._record_dir = pathlib.Path(record_dir)
+        self._index = _load_index(self._record_dir)
+        self._shards = self._index["shards"]
+        self._starts = np.asarray([shard["start"] for shard in self._shards], dtype=np.int64)
+
+    def __len__(self) -> int:
+        if not self._shards:
+            return 0
+        return self._shards[-1]["start"] + self._shards[-1]["num_steps"]
+
+    @property
+    def keys(self) -> list[str]:
+        """All keys that appear in any record."""
+        return list(dict.fromkeys(key for shard in self._shards for key in shard["columns"]))
+
+    def __getitem__(self, step: int) -> dict[str, np.ndarray]:
+        """Returns a single record."""
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError(f"Step {step} out of range for {len(self)} records")
+        return {key: value[0] for key, value in self.read(step, step + 1).items()}
+
+    def read(self, start: int = 0, stop: int | None = None, keys: list[str] | None = None) -> dict[str, np.ndarray]:
+        """Returns the records of steps `start` to `stop` (exclusive) as one stacked array per key.
+
+        Only the requested keys are decompressed. All records in the range must have the same structure.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if not 0 <= start <= stop:
+            raise ValueError(f"Invalid step range: {start}:{stop}")
+        if start == stop:
+            return {}
+
+        parts: list[dict[str, np.ndarray]] = []
+        first_shard = int(np.searchsorted(self._starts, start, side="right")) - 1
+        for shard in self._shards[first_shard:]:
+            if shard["start"] >= stop:
+                break
+            begin = max(start - shard["start"], 0)
+            end = min(stop - shard["start"], shard["num_steps"])
+            parts.append(self._read_shard(shard, begin, end, keys))
+
+        structures = {tuple((key, value.shape[1:]) for key, value in sorted(part.items())) for part in parts}
+        if len(structures) > 1:
+            raise ValueError(f"Records {start}:{stop} don't all have the same structure, read a smaller range.")
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    def _read_shard(self, shard: dict, begin: int, end: int, keys: list[str] | None) -> dict[str, np.ndarray]:
+        result = {}
+        with np.load(self._record_dir / shard["file"], allow_pickle=False) as data:
+            for key, column in shard["columns"].items():
+                if keys is not None and key not in keys:
+                    continue
+                name = column["name"]
+                if "codec" in column:
+                    offsets = data[f"{name}_offsets"]
+                    encoded = data[name]
+                    shape = tuple(column["shape"])
+                    images = [
+                        image_tools.decode_image(encoded[offsets[i] : offsets[i + 1]].tobytes(), shape)
+                        for i in range(begin, end)
+                    ]
+                    result[key] = np.stack(images)
+                else:
+                    result[key] = data[name][begin:end]
+        return result
+
+
+def _signature(record: dict[str, np.ndarray]) -> tuple:
+    # Strings of different lengths can still be stacked.
+    return tuple(
+        (key, value.shape, value.dtype.kind if value.dtype.kind in "SU" else value.dtype.str)
+        for key, value in record.items()
+    )
+
+
+def _load_index(record_dir: pathlib.Path) -> dict:
+    index_path = record_dir / INDEX_FILE
+    if not index_path.exists():
+        return {"version": FORMAT_VERSION, "shards": []}
+    index = json.loads(index_path.read_text())
+    if index["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported record format version: {index['version']}")
+    return index
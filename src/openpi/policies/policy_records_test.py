@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from openpi.policies import policy_records as _policy_records
+
+
+def _record(step: int, rng: np.random.Generator) -> dict:
+    return {
+        "inputs/image": rng.integers(256, size=(32, 32, 3), dtype=np.uint8),
+        "inputs/state": np.full((7,), step, dtype=np.float32),
+        "inputs/prompt": "pick up the cup" if step % 2 else "open the door",
+        "outputs/actions": np.full((10, 7), step, dtype=np.float32),
+    }
+
+
+@pytest.mark.parametrize("image_codec", ["raw", "png"])
+def test_roundtrip(tmp_path, image_codec: str):
+    rng = np.random.default_rng(0)
+    records = [_record(step, rng) for step in range(10)]
+
+    writer = _policy_records.RecordWriter(tmp_path, shard_size=4, image_codec=image_codec)
+    for record in records:
+        writer.write(record)
+    writer.close()
+
+    reader = _policy_records.RecordReader(tmp_path)
+    assert len(reader) == 10
+    assert set(reader.keys) == set(records[0])
+    assert len(list(tmp_path.glob("shard_*.npz"))) == 3
+
+    # A range spanning several shards.
+    data = reader.read(3, 9)
+    np.testing.assert_array_equal(data["inputs/image"], np.stack([r["inputs/image"] for r in records[3:9]]))
+    np.testing.assert_array_equal(data["inputs/state"][:, 0], np.arange(3, 9))
+    assert data["inputs/prompt"].tolist() == [r["inputs/prompt"] for r in records[3:9]]
+
+    assert list(reader.read(0, 2, keys=["outputs/actions"])) == ["outputs/actions"]
+    np.testing.assert_array_equal(reader[-1]["outputs/actions"], records[-1]["outputs/actions"])
+
+
+def test_write_copies_arrays(tmp_path):
+    writer = _policy_records.RecordWriter(tmp_path)
+    buffer = np.zeros((4,))
+    for step in range(3):
+        buffer[:] = step
+        writer.write({"a": buffer})
+    # The buffer is reused before the records are written.
+    buffer[:] = -1
+    writer.close()
+
+    np.testing.assert_array_equal(_policy_records.RecordReader(tmp_path).read(0, 3)["a"][:, 0], [0, 1, 2])
+
+
+def test_structure_changes_and_append(tmp_path):
+    writer = _policy_records.RecordWriter(tmp_path)
+    writer.write({"a": np.zeros((2,))})
+    writer.write({"a": np.zeros((3,))})
+    writer.write({"a": np.zeros((3,)), "skipped": None})
+    writer.flush()
+    assert len(_policy_records.RecordReader(tmp_path)) == 3
+    writer.close()
+
+    # New records are appended to existing ones.
+    writer = _policy_records.RecordWriter(tmp_path)
+    writer.write({"a": np.ones((3,))})
+    writer.close()
+
+    reader = _policy_records.RecordReader(tmp_path)
+    assert len(reader) == 4
+    assert reader.read(1, 4)["a"].shape == (3, 3)
+    assert reader[3]["a"][0] == 1
+    assert reader.keys == ["a"]
+    with pytest.raises(ValueError, match="same structure"):
+        reader.read(0, 4)
@@ -1,11 +1,66 @@
+import dataclasses
+
+import flax.nnx as nnx
+import jax
+import jax.numpy as jnp
+import numpy as np
 from openpi_client import action_chunk_broker
 import pytest
 
+from openpi import transforms as _transforms
+from openpi.models import model as _model
 from openpi.policies import aloha_policy
+from openpi.policies import policy as _policy
 from openpi.policies import policy_config as _policy_config
 from openpi.training import config as _config
 
 
+class _FakeModel(nnx.Module):
+    def __init__(self) -> None:
+        self.scale = nnx.Param(jnp.full((), 0.5))
+
+    def sample_actions(self, rng, observation, *, num_steps: int = 10, noise=None):
+        del rng, noise
+        image_mean = jnp.mean(observation.images["base_0_rgb"], axis=(1, 2, 3))
+        actions = observation.state[:, None, :] * self.scale.value + image_mean[:, None, None] + num_steps
+        return jnp.broadcast_to(actions, (actions.shape[0], 4, actions.shape[-1]))
+
+
+@dataclasses.dataclass(frozen=True)
+class _UnpadActions(_transforms.DataTransformFn):
+    def __call__(self, data: dict) -> dict:
+        return {"actions": data["actions"][..., :5]}
+
+
+def _make_fake_policy(*, fuse_transforms: bool) -> _policy.Policy:
+    rng = np.random.default_rng(0)
+    norm_stats = {
+        key: _transforms.NormStats(mean=rng.normal(size=5), std=rng.uniform(0.5, 2.0, size=5))
+        for key in ("state", "actions")
+    }
+    return _policy.Policy(
+        _FakeModel(),
+        transforms=[
+            _transforms.ExtractTaskID(),
+            _transforms.Normalize(norm_stats),
+            _transforms.PadStatesAndActions(8),
+        ],
+        output_transforms=[_transforms.Unnormalize(norm_stats), _UnpadActions()],
+        sample_kwargs={"num_steps": 3},
+        fuse_transforms=fuse_transforms,
+    )
+
+
+def _make_fake_example(seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "image": {"base_0_rgb": rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)},
+        "image_mask": {"base_0_rgb": np.True_},
+        "state": rng.normal(size=5),
+        "task_index": 1,
+    }
+
+
 @pytest.mark.manual
 def test_infer():
     config = _config.get_config("pi0_aloha_sim")
@@ -32,3 +87,83 @@ def test_broker():
     for _ in range(config.model.action_horizon):
         outputs = broker.infer(example)
         assert outputs["actions"].shape == (14,)
+
+
+@pytest.mark.manual
+def test_warmup():
+    config = _config.get_config("pi0_aloha_sim")
+    policy = _policy_config.create_trained_policy(config, "gs://openpi-assets/checkpoints/pi0_aloha_sim")
+    policy.warmup(config.model.fake_obs, batch_sizes=[1, 2])
+
+    # The executable for batch size 1 must have been compiled during warmup.
+    example = aloha_policy.make_aloha_example()
+    result = policy.infer(example)
+    assert result["policy_timing"]["infer_ms"] < 10_000
+
+
+@pytest.mark.manual
+def test_infer_batch():
+    config = _config.get_config("pi0_aloha_sim")
+    policy = _policy_config.create_trained_policy(config, "gs://openpi-assets/checkpoints/pi0_aloha_sim")
+
+    # Three observations are padded to a batch of four.
+    results = policy.infer_batch([aloha_policy.make_aloha_example() for _ in range(3)])
+    assert len(results) == 3
+    for result in results:
+        assert result["actions"].shape == (config.model.action_horizon, 14)
+        assert result["policy_timing"]["batch_size"] == 3
+        assert result["policy_timing"]["padded_batch_size"] == 4
+
+
+def test_fuse_transforms():
+    policy = _make_fake_policy(fuse_transforms=False)
+    fused_policy = _make_fake_policy(fuse_transforms=True)
+    fused_policy.warmup(lambda batch_size: None, batch_sizes=[1, 3], example=_make_fake_example(0))
+
+    example = _make_fake_example(1)
+    expected = policy.infer(example)
+    result = fused_policy.infer(example)
+    assert result["actions"].shape == (4, 5)
+    np.testing.assert_allclose(result["actions"], expected["actions"], rtol=1e-5)
+
+    examples = [_make_fake_example(seed) for seed in range(3)]
+    for result, expected in zip(fused_policy.infer_batch(examples), policy.infer_batch(examples), strict=True):
+        np.testing.assert_allclose(result["actions"], expected["actions"], rtol=1e-5)
+        assert result["policy_timing"]["padded_batch_size"] == 4
+
+
+@pytest.mark.parametrize("fuse_transforms", [False, True])
+def test_replicate(fuse_transforms):
+    policy = _make_fake_policy(fuse_transforms=fuse_transforms)
+    device = jax.devices()[-1]
+    replica = policy.replicate([device])
+    assert {x.device for x in jax.tree.leaves(nnx.state(replica._model))} == {device}  # noqa: SLF001
+
+    example = _make_fake_example(0)
+    np.testing.assert_allclose(replica.infer(example)["actions"], policy.infer(example)["actions"], rtol=1e-5)
+    results = replica.infer_batch([_make_fake_example(seed) for seed in range(3)])
+    assert [result["actions"].shape for result in results] == [(4, 5)] * 3
+
+
+@pytest.mark.parametrize("fuse_transforms", [False, True])
+def test_replica_warmup(fuse_transforms):
+    policy = _make_fake_policy(fuse_transforms=fuse_transforms)
+    replica = policy.replicate(jax.devices()[-1:])
+    example = _make_fake_example(0)
+    transformed = replica._input_transform(jax.tree.map(lambda x: x, example))  # noqa: SLF001
+
+    def fake_obs(batch_size: int) -> _model.Observation:
+        return _model.Observation.from_dict(jax.tree.map(lambda x: np.stack([np.asarray(x)] * batch_size), transformed))
+
+    replica.warmup(fake_obs, example=example)
+    jitted = replica._fused_sample_actions if fuse_transforms else replica._sample_actions.fn  # noqa: SLF001
+    num_compiled = jitted._cache_size()  # noqa: SLF001
+    # The requests are served by the executables compiled during warmup.
+    replica.infer(example)
+    replica.infer(_make_fake_example(1))
+    assert jitted._cache_size() == num_compiled  # noqa: SLF001
+
+
+def test_fuse_transforms_pytorch():
+    with pytest.raises(ValueError, match="only supported for JAX"):
+        _policy.Policy(_FakeModel(), is_pytorch=True, fuse_transforms=True)
@@ -0,0 +1,136 @@
+"""Latency histograms for the policy server.
+
+Histograms use fixed bucket boundaries so that recording a value is cheap and the memory footprint doesn't grow with
+the number of requests. `LatencyMetrics.render` exports all histograms in the Prometheus text format, which is served
+on the `/metrics` endpoint of `WebsocketPolicyServer`.
+"""
+
+from collections.abc import Sequence
+import threading
+
+import numpy as np
+
+# Upper bounds (in milliseconds) of the histogram buckets. Values above the last bound go into an overflow bucket.
+DEFAULT_BUCKETS_MS = (
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    25.0,
+    50.0,
+    100.0,
+    250.0,
+    500.0,
+    1000.0,
+    2500.0,
+    5000.0,
+    10000.0,
+)
+
+
+class Histogram:
+    """A thread-safe histogram of latencies in milliseconds."""
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS) -> None:
+        self._bounds = np.asarray(buckets_ms, dtype=np.float64)
+        if np.any(np.diff(self._bounds) <= 0):
+            raise ValueError("Bucket bounds must be strictly increasing")
+        self._lock = threading.Lock()
+        # The last bucket counts values above the largest bound.
+        self._counts = np.zeros(len(self._bounds) + 1, dtype=np.int64)
+        self._sum = 0.0
+
+    def observe(self, value_ms: float) -> None:
+        index = int(np.searchsorted(self._bounds, value_ms, side="left"))
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value_ms
+
+    @property
+    def count(self) -> int:
+        return int(self._counts.sum())
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def quantile(self, q: float) -> float:
+        """Estimates the `q`-quantile by interpolating linearly within the bucket that contains it.
+
+        Returns NaN if no values were recorded. Quantiles in the overflow bucket are reported as the largest bound.
+        """
+        with self._lock:
+            counts = self._counts.copy()
+        total = counts.sum()
+        if total == 0:
+            return float("nan")
+        rank = q * total
+        cumulative = np.cumsum(counts)
+        index = int(np.searchsorted(cumulative, rank, side="left"))
+        if index >= len(self._bounds):
+            return float(self._bounds[-1])
+        lower = self._bounds[index - 1] if index > 0 else 0.0
+        below = cumulative[index - 1] if index > 0 else 0
+        fraction = (rank - below) / counts[index] if counts[index] else 1.0
+        return float(lower + (self._bounds[index] - lower) * fraction)
+
+    def buckets(self) -> list[tuple[float, int]]:
+        """Returns the cumulative count for every upper bound, ending with `inf`."""
+        with self._lock:
+            cumulative = np.cumsum(self._counts)
+        return list(zip([*self._bounds.tolist(), float("inf")], cumulative.tolist(), strict=True))
+
+
+class LatencyMetrics:
+    """A collection of latency histograms, one per processing stage."""
+
+    def __init__(self, prefix: str = "openpi_server", buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS) -> None:
+        self._prefix = prefix
+        self._buckets_ms = buckets_ms
+        self._lock = threading.Lock()
+        self._histograms: dict[str, Histogram] = {}
+
+    def observe(self, stage: str, value_ms: float) -> None:
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram(self._buckets_ms))
+        histogram.observe(value_ms)
+
+    def histogram(self, stage: str) -> Histogram | None:
+        return self._histograms.get(stage)
+
+    @property
+    def stages(self) -> list[str]:
+        return sorted(self._histograms)
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> dict[str, dict[str, float]]:
+        """Returns the count, mean and estimated quantiles of every stage."""
+        result = {}
+        for stage in self.stages:
+            histogram = self._histograms[stage]
+            stats = {"count": histogram.count, "mean": histogram.sum / max(histogram.count, 1)}
+            for q in quantiles:
+                stats[f"p{q * 100:g}"] = histogram.quantile(q)
+            result[stage] = stats
+        return result
+
+    def render(self) -> str:
+        """Renders all histograms in the Prometheus text exposition format."""
+        name = f"{self._prefix}_stage_latency_ms"
+        lines = [
+            f"# HELP {name} Latency of every processing stage of the policy server in milliseconds.",
+            f"# TYPE {name} histogram",
+        ]
+        for stage in self.stages:
+            histogram = self._histograms[stage]
+            for bound, count in histogram.buckets():
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,49 @@
+import math
+
+import numpy as np
+import pytest
+
+from openpi.serving import metrics as _metrics
+
+
+def test_histogram_quantiles():
+    histogram = _metrics.Histogram(buckets_ms=(1.0, 2.0, 4.0, 8.0))
+    assert math.isnan(histogram.quantile(0.5))
+
+    values = np.random.default_rng(0).uniform(0, 8, size=10_000)
+    for value in values:
+        histogram.observe(value)
+
+    assert histogram.count == len(values)
+    assert histogram.sum == pytest.approx(values.sum())
+    for q in (0.1, 0.5, 0.99):
+        assert histogram.quantile(q) == pytest.approx(np.quantile(values, q), abs=0.1)
+
+    # Values above the largest bound are counted, but quantiles are capped at the largest bound.
+    histogram.observe(100.0)
+    assert histogram.buckets()[-1] == (float("inf"), len(values) + 1)
+    assert histogram.quantile(1.0) == 8.0
+
+
+def test_invalid_buckets():
+    with pytest.raises(ValueError, match="increasing"):
+        _metrics.Histogram(buckets_ms=(1.0, 1.0))
+
+
+def test_render():
+    metrics = _metrics.LatencyMetrics(buckets_ms=(1.0, 10.0))
+    metrics.observe("infer", 5.0)
+    metrics.observe("infer", 20.0)
+    metrics.observe("pack", 0.5)
+
+    text = metrics.render()
+    assert 'openpi_server_stage_latency_ms_bucket{stage="infer",le="1"} 0' in text
+    assert 'openpi_server_stage_latency_ms_bucket{stage="infer",le="10"} 1' in text
+    assert 'openpi_server_stage_latency_ms_bucket{stage="infer",le="+Inf"} 2' in text
+    assert 'openpi_server_stage_latency_ms_count{stage="pack"} 1' in text
+    assert 'openpi_server_stage_latency_ms_sum{stage="infer"} 25.000000' in text
+
+    summary = metrics.summary(quantiles=(0.5,))
+    assert summary["infer"]["count"] == 2
+    assert summary["infer"]["mean"] == 12.5
+    assert "p50" in summary["pack"]
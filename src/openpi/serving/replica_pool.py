@@ -0,0 +1,165 @@
+"""Serving a policy from several model replicas behind a single server.
+
+`ReplicaPool` holds one policy per local device (or per group of devices) and routes every call to the replica with
+the fewest calls in flight. Together with a `WebsocketPolicyServer` running one inference worker per replica, this
+serves all devices of a machine from a single port.
+"""
+
+from collections.abc import Sequence
+import dataclasses
+import threading
+import time
+
+import jax
+from openpi_client import base_policy as _base_policy
+from typing_extensions import override
+
+from openpi.policies import policy as _policy
+
+
+@dataclasses.dataclass(frozen=True)
+class ReplicaStats:
+    """Load of a single replica."""
+
+    # Devices holding the replica's weights.
+    devices: str
+    # Calls waiting for or running on the replica.
+    queue_depth: int
+    # Calls completed by the replica.
+    requests: int
+    # Fraction of the time since the pool was created during which the replica was running a call.
+    utilization: float
+
+
+class _Replica:
+    def __init__(self, policy: _base_policy.BasePolicy, devices: str) -> None:
+        self.policy = policy
+        self.devices = devices
+        # Policies are not thread-safe, so calls to the same replica are serialized.
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.busy_s = 0.0
+
+
+class ReplicaPool(_base_policy.BasePolicy):
+    """Routes calls to the least-loaded of several policy replicas.
+
+    The pool can be called from several threads at once. Each call is sent to the replica with the fewest calls in
+    flight (ties are broken by the lowest accumulated busy time), and calls to the same replica are serialized.
+    """
+
+    def __init__(self, replicas: Sequence[_base_policy.BasePolicy], *, devices: Sequence[str] | None = None) -> None:
+        """Creates the pool.
+
+        Args:
+            replicas: The policies to route calls to. They should be equivalent, e.g. created by `replicate_policy`.
+            devices: A description of the devices of every replica, used in the stats.
+        """
+        if not replicas:
+            raise ValueError("At least one replica is required.")
+        if devices is None:
+            devices = [str(i) for i in range(len(replicas))]
+        if len(devices) != len(replicas):
+            raise ValueError(f"Got {len(devices)} device descriptions for {len(replicas)} replicas.")
+        self._replicas = [_Replica(policy, d) for policy, d in zip(replicas, devices, strict=True)]
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._replicas)
+
+    @property
+    def replicas(self) -> list[_base_policy.BasePolicy]:
+        return [replica.policy for replica in self._replicas]
+
+    @property
+    def metadata(self) -> dict:
+        return getattr(self._replicas[0].policy, "metadata", {})
+
+    @override
+    def infer(self, obs: dict) -> dict:  # type: ignore[misc]
+        index, result = self._call(lambda policy: policy.infer(obs))
+        result.setdefault("policy_timing", {})["replica"] = index
+        return result
+
+    @override
+    def infer_batch(self, obs: Sequence[dict]) -> list[dict]:  # type: ignore[misc]
+        index, results = self._call(lambda policy: policy.infer_batch(obs))
+        for result in results:
+            result.setdefault("policy_timing", {})["replica"] = index
+        return results
+
+    @override
+    def reset(self) -> None:
+        for replica in self._replicas:
+            with replica.lock:
+                replica.policy.reset()
+
+    def stats(self) -> list[ReplicaStats]:
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        with self._lock:
+            return [
+                ReplicaStats(
+                    devices=replica.devices,
+                    queue_depth=replica.in_flight,
+                    requests=replica.requests,
+                    utilization=min(replica.busy_s / elapsed, 1.0),
+                )
+                for replica in self._replicas
+            ]
+
+    def render_metrics(self, prefix: str = "openpi_server") -> str:
+        """Renders the stats of every replica in the Prometheus text exposition format."""
+        stats = self.stats()
+        gauges = [
+            ("replica_queue_depth", "gauge", "Calls waiting for or running on the replica.", "queue_depth"),
+            ("replica_requests_total", "counter", "Calls completed by the replica.", "requests"),
+            ("replica_utilization", "gauge", "Fraction of the time the replica was running a call.", "utilization"),
+        ]
+        lines = []
+        for name, kind, description, field in gauges:
+            lines += [f"# HELP {prefix}_{name} {description}", f"# TYPE {prefix}_{name} {kind}"]
+            for index, replica in enumerate(stats):
+                labels = f'replica="{index}",devices="{replica.devices}"'
+                lines.append(f"{prefix}_{name}{{{labels}}} {getattr(replica, field):g}")
+        return "\n".join(lines) + "\n"
+
+    def _call(self, fn):
+        with self._lock:
+            index = min(
+                range(len(self._replicas)),
+                key=lambda i: (self._replicas[i].in_flight, self._replicas[i].busy_s),
+            )
+            replica = self._replicas[index]
+            replica.in_flight += 1
+        try:
+            with replica.lock:
+                start_time = time.monotonic()
+                try:
+                    return index, fn(replica.policy)
+                finally:
+                    busy_s = time.monotonic() - start_time
+                    with self._lock:
+                        replica.busy_s += busy_s
+                        replica.requests += 1
+        finally:
+            with self._lock:
+                replica.in_flight -= 1
+
+
+def replicate_policy(
+    policy: _policy.Policy, *, devices_per_replica: int = 1, devices: Sequence[jax.Device] | None = None
+) -> ReplicaPool:
+    """Creates a pool with a replica of `policy` for every group of `devices_per_replica` local devices.
+
+    With more than one device per replica, the weights of every replica are sharded across its devices like during
+    FSDP training. Weights that are already placed on a replica's devices are not copied.
+    """
+    devices = list(devices if devices is not None else jax.local_devices())
+    if devices_per_replica < 1 or len(devices) % devices_per_replica != 0:
+        raise ValueError(f"Cannot split {len(devices)} devices into groups of {devices_per_replica}.")
+
+    groups = [devices[start : start + devices_per_replica] for start in range(0, len(devices), devices_per_replica)]
+    replicas = [policy.replicate(group) for group in groups]
+    return ReplicaPool(replicas, devices=[",".join(str(device.id) for device in group) for group in groups])
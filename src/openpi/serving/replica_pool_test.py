@@ -0,0 +1,64 @@
+import concurrent.futures
+import threading
+import time
+
+import numpy as np
+from openpi_client import base_policy as _base_policy
+import pytest
+
+from openpi.serving import replica_pool as _replica_pool
+
+
+class _BlockingPolicy(_base_policy.BasePolicy):
+    def __init__(self) -> None:
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls = 0
+
+    def infer(self, obs: dict) -> dict:
+        self.calls += 1
+        self.started.set()
+        self.release.wait()
+        return {"actions": np.asarray(obs["state"])}
+
+
+def test_routes_to_least_loaded_replica():
+    replicas = [_BlockingPolicy(), _BlockingPolicy()]
+    pool = _replica_pool.ReplicaPool(replicas)
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        first = executor.submit(pool.infer, {"state": np.zeros(1)})
+        assert replicas[0].started.wait(5)
+        # The first replica is busy, so the second call goes to the second replica.
+        second = executor.submit(pool.infer, {"state": np.ones(1)})
+        assert replicas[1].started.wait(5)
+        assert [stats.queue_depth for stats in pool.stats()] == [1, 1]
+
+        for replica in replicas:
+            replica.release.set()
+        assert first.result()["policy_timing"]["replica"] == 0
+        assert second.result()["policy_timing"]["replica"] == 1
+
+    stats = pool.stats()
+    assert [s.queue_depth for s in stats] == [0, 0]
+    assert [s.requests for s in stats] == [1, 1]
+    assert all(0 < s.utilization <= 1 for s in stats)
+
+
+def test_idle_replicas_share_the_load():
+    replicas = [_BlockingPolicy(), _BlockingPolicy()]
+    for replica in replicas:
+        replica.release.set()
+    pool = _replica_pool.ReplicaPool(replicas)
+
+    for _ in range(10):
+        pool.infer({"state": np.zeros(1)})
+        time.sleep(0.001)
+    # Ties are broken by the accumulated busy time, so sequential calls alternate between the replicas.
+    assert all(replica.calls > 0 for replica in replicas)
+    assert "openpi_server_replica_utilization" in pool.render_metrics()
+
+
+def test_requires_replicas():
+    with pytest.raises(ValueError, match="At least one replica"):
+        _replica_pool.ReplicaPool([])
@@ -1,21 +1,82 @@
 import asyncio
+import concurrent.futures
+import dataclasses
 import http
+import ipaddress
 import logging
+import secrets
 import time
 import traceback
 
 from openpi_client import base_policy as _base_policy
+from openpi_client import image_tools
 from openpi_client import msgpack_numpy
+from openpi_client import shared_memory as _shared_memory
+from openpi_client import websocket_client_policy as _websocket_client_policy
+import tree
 import websockets.asyncio.server as _server
 import websockets.frames
 
+from openpi.serving import metrics as _metrics
+from openpi.serving import replica_pool as _replica_pool
+
 logger = logging.getLogger(__name__)
 
 
+@dataclasses.dataclass
+class _PendingRequest:
+    """An observation waiting for inference, together with the future that receives its result."""
+
+    obs: dict
+    future: asyncio.Future
+    # Time at which the request was put on the work queue.
+    enqueue_time: float = dataclasses.field(default_factory=time.monotonic)
+    # Time by which the policy must have been started, or None if the request never expires.
+    deadline: float | None = None
+    # Whether the request was handed to an inference worker, after which it can't be dropped anymore.
+    dispatched: bool = False
+
+    def drop(self, status: str) -> None:
+        """Answers the request with `status` instead of running the policy."""
+        queue_ms = (time.monotonic() - self.enqueue_time) * 1000
+        self.future.set_result(({_websocket_client_policy.STATUS_KEY: status}, {"queue_ms": queue_ms}))
+
+
 class WebsocketPolicyServer:
     """Serves a policy using the websocket protocol. See websocket_client_policy.py for a client implementation.
 
     Currently only implements the `load` and `infer` methods.
+
+    Inference never runs on the asyncio event loop. Observations from all open connections are put on a bounded work
+    queue that is drained by a dedicated inference thread, so that the event loop can keep receiving, unpacking and
+    packing messages for other connections (and answering health checks) while the policy is running. When the queue
+    is full, connections stop reading new messages until there is room again.
+
+    When `max_batch_size` is greater than one, queued observations are evaluated together using `policy.infer_batch`.
+    A batch is dispatched as soon as it is full or when `max_batch_wait_ms` has elapsed since its first observation
+    arrived, whichever comes first.
+
+    Clients may compress images with any of the codecs in `image_tools.IMAGE_CODECS`. Compressed images are decoded on
+    a pool of `num_decode_workers` threads.
+
+    Clients on the same host may pass observations and actions through shared memory instead (see
+    `openpi_client.shared_memory`), in which case the connection only carries control messages. Shared memory is only
+    offered to loopback peers, which receive a random segment name prefix in the handshake. The server only attaches to
+    segments with that prefix and a valid ring header.
+
+    Batches are run by `num_inference_workers` threads. A plain policy should be served by a single worker, which
+    keeps device work serialized. A `ReplicaPool` is served by one worker per replica by default, so that every replica
+    runs its own batches and the pool routes them to the least-loaded replica.
+
+    Requests may carry a deadline (see `WebsocketClientPolicy`). Requests whose deadline has passed when they would be
+    dispatched are answered with the "expired" status instead of being evaluated. Requests marked for coalescing are
+    answered with the "superseded" status as soon as a newer coalescing request of the same connection arrives while
+    they are still queued, so that only the newest observation of a closed-loop client is evaluated. Dropped requests
+    are counted in the `expired` and `superseded` histograms, which record how long they were queued.
+
+    Latency histograms of every processing stage (unpacking, queueing, inference and packing, as well as the stages
+    reported by the policy in `policy_timing`) are served in the Prometheus text format on `/metrics`, together with
+    the load of every replica when serving a `ReplicaPool`.
     """
 
     def __init__(
@@ -24,63 +85,378 @@ class WebsocketPolicyServer:
         host: str = "0.0.0.0",
         port: int | None = None,
         metadata: dict | None = None,
+        *,
+        max_batch_size: int = 1,
+        max_batch_wait_ms: float = 5.0,
+        max_queue_size: int = 64,
+        num_decode_workers: int = 4,
+        num_inference_workers: int | None = None,
     ) -> None:
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}")
+        if max_queue_size < 1:
+            raise ValueError(f"max_queue_size must be at least 1, got {max_queue_size}")
+        if num_inference_workers is None:
+            num_inference_workers = len(policy) if isinstance(policy, _replica_pool.ReplicaPool) else 1
+        if num_inference_workers < 1:
+            raise ValueError(f"num_inference_workers must be at least 1, got {num_inference_workers}")
+
         self._policy = policy
         self._host = host
         self._port = port
         self._metadata = metadata or {}
+        self._max_batch_size = max_batch_size
+        self._max_batch_wait = max_batch_wait_ms / 1000
+        self._max_queue_size = max_queue_size
+        self._num_decode_workers = num_decode_workers
+        self._num_inference_workers = num_inference_workers
+        self._decode_executor: concurrent.futures.Executor | None = None
+        self._queue: asyncio.Queue[_PendingRequest] | None = None
+        self._metrics = _metrics.LatencyMetrics()
         logging.getLogger("websockets.server").setLevel(logging.INFO)
 
+    @property
+    def metrics(self) -> _metrics.LatencyMetrics:
+        return self._metrics
+
     def serve_forever(self) -> None:
         asyncio.run(self.run())
 
     async def run(self):
-        async with _server.serve(
-            self._handler,
-            self._host,
-            self._port,
-            compression=None,
-            max_size=None,
-            process_request=_health_check,
-        ) as server:
-            await server.serve_forever()
+        self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._num_inference_workers, thread_name_prefix="policy_inference"
+        )
+        inference_loop = asyncio.create_task(self._inference_loop(executor))
+        self._decode_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._num_decode_workers, thread_name_prefix="image_decode"
+        )
+
+        try:
+            async with _server.serve(
+                self._handler,
+                self._host,
+                self._port,
+                compression=None,
+                max_size=None,
+                process_request=self._process_request,
+            ) as server:
+                await server.serve_forever()
+        finally:
+            inference_loop.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._decode_executor.shutdown(wait=False, cancel_futures=True)
 
     async def _handler(self, websocket: _server.ServerConnection):
         logger.info(f"Connection from {websocket.remote_address} opened")
         packer = msgpack_numpy.Packer()
+        # Prefix the names of shared memory segments of this connection must start with, if the peer is local.
+        shm_name_prefix = f"openpi_{secrets.token_hex(8)}_" if _is_loopback(websocket.remote_address) else None
 
-        await websocket.send(packer.pack(self._metadata))
+        # Advertise the supported wire formats. The client picks one and we always answer in the format of the request.
+        await websocket.send(packer.pack({**self._metadata, "transport": self._transport_metadata(shm_name_prefix)}))
 
         prev_total_time = None
-        while True:
-            try:
-                start_time = time.monotonic()
-                obs = msgpack_numpy.unpackb(await websocket.recv())
+        # Shared memory segment of the client, if it uses the shared-memory transport.
+        shm: _shared_memory.SharedMemoryRing | None = None
+        # Newest request of the connection that may be superseded by the next one.
+        coalescing: _PendingRequest | None = None
 
-                infer_time = time.monotonic()
-                action = self._policy.infer(obs)
-                infer_time = time.monotonic() - infer_time
+        async def respond(
+            future: asyncio.Future,
+            request_id: int | None,
+            start_time: float,
+            unpack_start: float,
+            unpack_ms: float,
+            *,
+            oob: bool,
+            slot: int | None,
+        ) -> None:
+            nonlocal prev_total_time
+            try:
+                action, server_timing = await future
+                server_timing["unpack_ms"] = unpack_ms
+                status = action.get(_websocket_client_policy.STATUS_KEY)
 
-                action["server_timing"] = {
-                    "infer_ms": infer_time * 1000,
-                }
+                action["server_timing"] = server_timing
                 if prev_total_time is not None:
                     # We can only record the last total time since we also want to include the send time.
                     action["server_timing"]["prev_total_ms"] = prev_total_time * 1000
+                if request_id is not None:
+                    action[_websocket_client_policy.REQUEST_ID_KEY] = request_id
 
-                await websocket.send(packer.pack(action))
-                prev_total_time = time.monotonic() - start_time
+                pack_start = time.monotonic()
+                message = None
+                if slot is not None:
+                    assert shm is not None
+                    size = shm.write(slot, _shared_memory.RESPONSE, action)
+                    if size is not None:
+                        message = packer.pack({_shared_memory.SHM_KEY: {"slot": slot, "size": size}})
+                    else:
+                        # Too large for shared memory. The client still needs to know that the slot is free again.
+                        action[_shared_memory.SHM_KEY] = {"slot": slot}
+                if message is None:
+                    message = msgpack_numpy.pack_frames(action) if oob else packer.pack(action)
+                self._metrics.observe("pack", (time.monotonic() - pack_start) * 1000)
 
+                await websocket.send(message)
+                if status is not None:
+                    self._metrics.observe(status, server_timing["queue_ms"])
+                    return
+                end_time = time.monotonic()
+                prev_total_time = end_time - start_time
+                self._record_metrics(server_timing, action.get("policy_timing", {}), (end_time - unpack_start) * 1000)
             except websockets.ConnectionClosed:
-                logger.info(f"Connection from {websocket.remote_address} closed")
-                break
+                pass
             except Exception:
-                await websocket.send(traceback.format_exc())
-                await websocket.close(
-                    code=websockets.frames.CloseCode.INTERNAL_ERROR,
-                    reason="Internal server error. Traceback included in previous frame.",
+                logger.exception(f"Inference failed for {websocket.remote_address}")
+                await _send_error(websocket, traceback.format_exc())
+
+        # Every request is answered by its own task, so several requests of the same connection can be in flight and
+        # their responses may be sent out of order. Clients match them using the request id.
+        pending: set[asyncio.Task] = set()
+        try:
+            while True:
+                start_time = time.monotonic()
+                frames = [frame async for frame in websocket.recv_streaming()]
+                unpack_start = time.monotonic()
+                oob = msgpack_numpy.is_oob(frames[0])
+                obs = msgpack_numpy.unpack_frames(frames, lazy_images=True)
+
+                if _shared_memory.SHM_ATTACH_KEY in obs:
+                    if shm is not None:
+                        shm.close()
+                        shm = None
+                    if shm_name_prefix is not None:
+                        shm = _attach_shared_memory(obs[_shared_memory.SHM_ATTACH_KEY], shm_name_prefix)
+                    reply = {_shared_memory.SHM_ATTACH_KEY: shm is not None}
+                    if shm_name_prefix is None:
+                        reply["error"] = "Shared memory is only available to clients on the same host."
+                    elif shm is None:
+                        reply["error"] = "Failed to attach to the shared memory segment, see the server log."
+                    await websocket.send(packer.pack(reply))
+                    continue
+
+                slot = None
+                if _shared_memory.SHM_KEY in obs:
+                    if shm is None:
+                        raise ValueError("Received a shared-memory request before attaching to shared memory.")
+                    control = obs[_shared_memory.SHM_KEY]
+                    slot = control["slot"]
+                    obs = shm.read(slot, _shared_memory.REQUEST, control["size"], lazy_images=True)
+
+                obs = await self._decode_images(obs)
+                request_id = obs.pop(_websocket_client_policy.REQUEST_ID_KEY, None)
+                deadline_ms = obs.pop(_websocket_client_policy.DEADLINE_KEY, None)
+                coalesce = obs.pop(_websocket_client_policy.COALESCE_KEY, False)
+                unpack_ms = (time.monotonic() - unpack_start) * 1000
+
+                request = _PendingRequest(
+                    obs,
+                    asyncio.get_running_loop().create_future(),
+                    deadline=None if deadline_ms is None else unpack_start + deadline_ms / 1000,
+                )
+                if coalesce:
+                    if coalescing is not None and not coalescing.dispatched and not coalescing.future.done():
+                        coalescing.drop(_websocket_client_policy.STATUS_SUPERSEDED)
+                    coalescing = request
+                future = await self._enqueue(request)
+                task = asyncio.create_task(
+                    respond(future, request_id, start_time, unpack_start, unpack_ms, oob=oob, slot=slot)
                 )
-                raise
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+        except websockets.ConnectionClosed:
+            logger.info(f"Connection from {websocket.remote_address} closed")
+        except Exception:
+            await _send_error(websocket, traceback.format_exc())
+            raise
+        finally:
+            # Nobody is listening for the results anymore. Cancelling the tasks also cancels their queued requests.
+            for task in pending:
+                task.cancel()
+            if shm is not None:
+                shm.close()
+
+    def _record_metrics(self, server_timing: dict, policy_timing: dict, total_ms: float) -> None:
+        for stage in ("unpack", "queue", "infer"):
+            self._metrics.observe(stage, server_timing[f"{stage}_ms"])
+        for key, value in policy_timing.items():
+            if key.endswith("_ms"):
+                self._metrics.observe(f"policy_{key.removesuffix('_ms')}", value)
+        self._metrics.observe("total", total_ms)
+
+    def _process_request(
+        self, connection: _server.ServerConnection, request: _server.Request
+    ) -> _server.Response | None:
+        if request.path == "/metrics":
+            body = self._metrics.render()
+            if isinstance(self._policy, _replica_pool.ReplicaPool):
+                body += self._policy.render_metrics()
+            return connection.respond(http.HTTPStatus.OK, body)
+        return _health_check(connection, request)
+
+    def _transport_metadata(self, shm_name_prefix: str | None) -> dict:
+        return {
+            "wire_formats": list(msgpack_numpy.WIRE_FORMATS),
+            "image_codecs": list(image_tools.IMAGE_CODECS),
+            # Requests tagged with a request id may be pipelined and are answered as soon as they are ready.
+            "request_ids": True,
+            # Only offered to clients on the same host, whose segment names must start with the issued prefix.
+            "shared_memory": False if shm_name_prefix is None else {"name_prefix": shm_name_prefix},
+            # Requests may carry a deadline and ask to be coalesced with newer requests of the same connection.
+            "deadlines": True,
+        }
+
+    async def _decode_images(self, obs: dict) -> dict:
+        """Decodes compressed images in parallel on the decode pool."""
+        leaves = tree.flatten(obs)
+        indices = [i for i, leaf in enumerate(leaves) if isinstance(leaf, msgpack_numpy.EncodedImage)]
+        if not indices:
+            return obs
+        loop = asyncio.get_running_loop()
+        images = await asyncio.gather(*(loop.run_in_executor(self._decode_executor, leaves[i].decode) for i in indices))
+        for i, image in zip(indices, images, strict=True):
+            leaves[i] = image
+        return tree.unflatten_as(obs, leaves)
+
+    async def _enqueue(self, request: _PendingRequest) -> asyncio.Future:
+        """Enqueues a request for inference, waiting for room in the queue if necessary.
+
+        Returns:
+            A future that resolves to the policy result and the server timing information.
+        """
+        assert self._queue is not None
+        if request.deadline is not None and time.monotonic() > request.deadline:
+            # Expired before it could even be queued, e.g. because decoding took too long.
+            request.drop(_websocket_client_policy.STATUS_EXPIRED)
+            return request.future
+        await self._queue.put(request)
+        return request.future
+
+    async def _inference_loop(self, executor: concurrent.futures.Executor) -> None:
+        """Groups queued observations into batches and runs them through the policy on the inference workers."""
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        # A batch is only collected once a worker is free to run it, so that requests arriving in the meantime can
+        # still join it.
+        free_workers = asyncio.Semaphore(self._num_inference_workers)
+        running: set[asyncio.Task] = set()
+        try:
+            while True:
+                await free_workers.acquire()
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self._max_batch_wait
+                while len(batch) < self._max_batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                # Requests whose connection was closed while they were waiting, that were superseded, or whose deadline
+                # has passed don't need to be evaluated.
+                now = time.monotonic()
+                for request in batch:
+                    if not request.future.done() and request.deadline is not None and now > request.deadline:
+                        request.drop(_websocket_client_policy.STATUS_EXPIRED)
+                batch = [request for request in batch if not request.future.done()]
+                for request in batch:
+                    request.dispatched = True
+                if not batch:
+                    free_workers.release()
+                    continue
+
+                task = asyncio.create_task(self._run_batch(executor, batch))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: free_workers.release())
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _run_batch(self, executor: concurrent.futures.Executor, batch: list[_PendingRequest]) -> None:
+        loop = asyncio.get_running_loop()
+        dispatch_time = time.monotonic()
+        try:
+            results = await loop.run_in_executor(executor, self._infer, [request.obs for request in batch])
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        infer_time = time.monotonic() - dispatch_time
+
+        for request, result in zip(batch, results, strict=True):
+            if request.future.done():
+                continue
+            if isinstance(result, Exception):
+                request.future.set_exception(result)
+            else:
+                server_timing = {
+                    "queue_ms": (dispatch_time - request.enqueue_time) * 1000,
+                    "infer_ms": infer_time * 1000,
+                }
+                if self._max_batch_size > 1:
+                    server_timing["batch_size"] = len(batch)
+                request.future.set_result((result, server_timing))
+
+    def _infer(self, obs: list[dict]) -> list[dict | Exception]:
+        """Runs on the inference thread.
+
+        If a batch fails, its observations are evaluated one by one, so that an error, e.g. caused by a malformed
+        observation, only fails the request that caused it. The results of the failed requests are their exceptions.
+        """
+        if len(obs) == 1:
+            return [self._policy.infer(obs[0])]
+        try:
+            return self._policy.infer_batch(obs)
+        except Exception:
+            logger.exception(f"Batch of {len(obs)} requests failed, retrying them one by one")
+        return [self._infer_or_error(o) for o in obs]
+
+    def _infer_or_error(self, obs: dict) -> dict | Exception:
+        try:
+            return self._policy.infer(obs)
+        except Exception as e:
+            return e
+
+
+async def _send_error(websocket: _server.ServerConnection, error: str) -> None:
+    try:
+        await websocket.send(error)
+        await websocket.close(
+            code=websockets.frames.CloseCode.INTERNAL_ERROR,
+            reason="Internal server error. Traceback included in previous frame.",
+        )
+    except websockets.ConnectionClosed:
+        pass
+
+
+def _attach_shared_memory(description: dict, name_prefix: str) -> _shared_memory.SharedMemoryRing | None:
+    try:
+        return _shared_memory.SharedMemoryRing.attach(
+            description["name"], description["num_slots"], description["slot_size"], name_prefix=name_prefix
+        )
+    except Exception:
+        logger.exception(f"Failed to attach to shared memory segment {description.get('name')}")
+        return None
+
+
+def _is_loopback(address) -> bool:
+    """Returns whether the remote address of a connection is a loopback address."""
+    if not isinstance(address, tuple) or not address:
+        return False
+    try:
+        ip = ipaddress.ip_address(address[0])
+    except ValueError:
+        return False
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_loopback
 
 
 def _health_check(connection: _server.ServerConnection, request: _server.Request) -> _server.Response | None:
@@ -0,0 +1,389 @@
+import asyncio
+import concurrent.futures
+import http.client
+from multiprocessing import shared_memory
+import socket
+import threading
+import time
+
+import numpy as np
+from openpi_client import base_policy as _base_policy
+from openpi_client import image_tools
+from openpi_client import msgpack_numpy
+from openpi_client import shared_memory as _shared_memory
+from openpi_client import websocket_client_policy as _websocket_client_policy
+import pytest
+import websockets
+
+from openpi.serving import replica_pool as _replica_pool
+from openpi.serving import websocket_policy_server as _server
+
+
+class _EchoPolicy(_base_policy.BasePolicy):
+    """Returns the observed state as the action and records the size of every batch it evaluates."""
+
+    def __init__(self) -> None:
+        self.batch_sizes: list[int] = []
+
+    def infer(self, obs: dict) -> dict:
+        return self.infer_batch([obs])[0]
+
+    def infer_batch(self, obs: list[dict]) -> list[dict]:
+        self.batch_sizes.append(len(obs))
+        return [{"actions": np.asarray(o["state"]) * 2} for o in obs]
+
+
+class _SlowPolicy(_base_policy.BasePolicy):
+    def __init__(self, delay: float) -> None:
+        self._delay = delay
+
+    def infer(self, obs: dict) -> dict:
+        time.sleep(self._delay)
+        return {"actions": np.zeros((1,))}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _is_listening(port: int) -> bool:
+    try:
+        with socket.create_connection(("localhost", port), timeout=0.1):
+            return True
+    except OSError:
+        return False
+
+
+def _start_server(server: _server.WebsocketPolicyServer, port: int) -> None:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not _is_listening(port):
+        if time.monotonic() >= deadline:
+            raise TimeoutError("Server did not start.")
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize("max_batch_size", [1, 4])
+@pytest.mark.parametrize("wire_format", [msgpack_numpy.WIRE_FORMAT_MSGPACK, msgpack_numpy.WIRE_FORMAT_OOB])
+def test_infer(max_batch_size: int, wire_format: str):
+    policy = _EchoPolicy()
+    port = _free_port()
+    _start_server(
+        _server.WebsocketPolicyServer(policy, host="localhost", port=port, max_batch_size=max_batch_size), port
+    )
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port, wire_format=wire_format)
+    assert client.wire_format == wire_format
+    for i in range(3):
+        result = client.infer({"state": np.full((3,), i, dtype=np.float32)})
+        np.testing.assert_array_equal(result["actions"], np.full((3,), 2 * i, dtype=np.float32))
+        assert "infer_ms" in result["server_timing"]
+        assert "queue_ms" in result["server_timing"]
+
+
+def test_batches_across_connections():
+    num_clients = 4
+    policy = _EchoPolicy()
+    port = _free_port()
+    _start_server(
+        _server.WebsocketPolicyServer(
+            policy, host="localhost", port=port, max_batch_size=num_clients, max_batch_wait_ms=500
+        ),
+        port,
+    )
+
+    clients = [_websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port) for _ in range(num_clients)]
+    with concurrent.futures.ThreadPoolExecutor(num_clients) as executor:
+        futures = [
+            executor.submit(client.infer, {"state": np.full((2,), i, dtype=np.float32)})
+            for i, client in enumerate(clients)
+        ]
+        results = [f.result() for f in futures]
+
+    # Every client must receive the result for its own observation.
+    for i, result in enumerate(results):
+        np.testing.assert_array_equal(result["actions"], np.full((2,), 2 * i, dtype=np.float32))
+    assert sum(policy.batch_sizes) == num_clients
+    assert max(policy.batch_sizes) > 1
+
+
+class _ValidatingPolicy(_EchoPolicy):
+    """Like `_EchoPolicy`, but fails every batch that contains a state of the wrong shape."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.attempted_batch_sizes: list[int] = []
+
+    def infer_batch(self, obs: list[dict]) -> list[dict]:
+        self.attempted_batch_sizes.append(len(obs))
+        if any(np.shape(o["state"]) != (2,) for o in obs):
+            raise ValueError("Bad state shape")
+        return super().infer_batch(obs)
+
+
+def test_batch_failure_only_fails_bad_request():
+    policy = _ValidatingPolicy()
+    port = _free_port()
+    _start_server(
+        _server.WebsocketPolicyServer(policy, host="localhost", port=port, max_batch_size=2, max_batch_wait_ms=1000),
+        port,
+    )
+
+    good, bad = (_websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port) for _ in range(2))
+    good_future = good.infer_async({"state": np.ones((2,), dtype=np.float32)})
+    bad_future = bad.infer_async({"state": np.ones((3,), dtype=np.float32)})
+
+    with pytest.raises(RuntimeError, match="Bad state shape"):
+        bad_future.result(timeout=10)
+    np.testing.assert_array_equal(good_future.result(timeout=10)["actions"], np.full((2,), 2, dtype=np.float32))
+    # Both requests were evaluated in one batch, and the good client is still connected.
+    assert policy.attempted_batch_sizes[:3] == [2, 1, 1]
+    np.testing.assert_array_equal(good.infer({"state": np.zeros((2,))})["actions"], np.zeros((2,)))
+
+
+def test_health_check_during_inference():
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(_SlowPolicy(delay=2.0), host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port)
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        future = executor.submit(client.infer, {"state": np.zeros((1,))})
+        time.sleep(0.2)
+
+        # The event loop must stay responsive while the policy is busy.
+        start = time.monotonic()
+        conn = http.client.HTTPConnection("localhost", port, timeout=5)
+        conn.request("GET", "/healthz")
+        assert conn.getresponse().status == 200
+        assert time.monotonic() - start < 1.0
+        assert not future.done()
+
+        result = future.result()
+    assert result["server_timing"]["infer_ms"] >= 2000
+
+
+@pytest.mark.parametrize("wire_format", [msgpack_numpy.WIRE_FORMAT_MSGPACK, msgpack_numpy.WIRE_FORMAT_OOB])
+def test_infer_async(wire_format: str):
+    policy = _EchoPolicy()
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(policy, host="localhost", port=port, max_batch_size=4), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port, wire_format=wire_format)
+    # All requests are in flight at the same time and the server is free to batch them.
+    futures = [client.infer_async({"state": np.full((2,), i, dtype=np.float32)}) for i in range(8)]
+    for i, future in enumerate(futures):
+        result = future.result(timeout=10)
+        np.testing.assert_array_equal(result["actions"], np.full((2,), 2 * i, dtype=np.float32))
+        assert _websocket_client_policy.REQUEST_ID_KEY not in result
+    assert sum(policy.batch_sizes) == 8
+
+    # Blocking calls keep working once pipelining is in use.
+    np.testing.assert_array_equal(client.infer({"state": np.ones((2,))})["actions"], np.full((2,), 2.0))
+
+    async def run_concurrently():
+        return await asyncio.gather(*(client.ainfer({"state": np.full((2,), i)}) for i in range(3)))
+
+    for i, result in enumerate(asyncio.run(run_concurrently())):
+        np.testing.assert_array_equal(result["actions"], np.full((2,), 2 * i))
+
+    client.close()
+    with pytest.raises(RuntimeError):
+        client.infer_async({"state": np.zeros((2,))})
+
+
+@pytest.mark.parametrize("slot_size", [1 << 20, 64])
+def test_shared_memory_transport(slot_size: int):
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(_ImageEchoPolicy(), host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(
+        host="localhost", port=port, transport=_websocket_client_policy.TRANSPORT_SHM, shm_slot_size=slot_size
+    )
+    assert client.transport == _websocket_client_policy.TRANSPORT_SHM
+
+    # Messages that don't fit into a slot are sent over the websocket connection instead.
+    images = [np.random.randint(256, size=(16, 16, 3), dtype=np.uint8) for _ in range(5)]
+    np.testing.assert_array_equal(client.infer({"image": images[0]})["image"], images[0])
+    futures = [client.infer_async({"image": image}) for image in images]
+    for image, future in zip(images, futures, strict=True):
+        np.testing.assert_array_equal(future.result(timeout=10)["image"], image)
+    client.close()
+
+
+def test_shared_memory_connection_closed_with_busy_slots():
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(_SlowPolicy(delay=2.0), host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(
+        host="localhost", port=port, transport=_websocket_client_policy.TRANSPORT_SHM, shm_num_slots=1
+    )
+    first = client.infer_async({"state": np.zeros((1,))})
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        # Waits for the only slot, which is never freed because the connection is closed before the response arrives.
+        second = executor.submit(client.infer_async, {"state": np.zeros((1,))})
+        time.sleep(0.2)
+        assert not second.done()
+        client.close()
+        with pytest.raises(RuntimeError, match="connection"):
+            second.result(timeout=5)
+    with pytest.raises(websockets.ConnectionClosed):
+        first.result(timeout=5)
+
+
+def test_shared_memory_rejects_foreign_segments():
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(_EchoPolicy(), host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port)
+    name_prefix = client.get_server_metadata()["transport"]["shared_memory"]["name_prefix"]
+    # Segments not named with the prefix issued to the connection, or without a ring header, are not attached to.
+    foreign = shared_memory.SharedMemory(create=True, size=1 << 16)
+    ring = _shared_memory.SharedMemoryRing.create(1, 1024)
+    try:
+        for name in [foreign.name, ring.name, name_prefix + "missing"]:
+            client._ws.send(  # noqa: SLF001
+                msgpack_numpy.packb({_shared_memory.SHM_ATTACH_KEY: {"name": name, "num_slots": 1, "slot_size": 1024}})
+            )
+            assert not msgpack_numpy.unpackb(client._ws.recv())[_shared_memory.SHM_ATTACH_KEY]  # noqa: SLF001
+    finally:
+        ring.close()
+        foreign.close()
+        foreign.unlink()
+
+    assert _server._is_loopback(("127.0.0.1", 1234))  # noqa: SLF001
+    assert _server._is_loopback(("::ffff:127.0.0.1", 1234, 0, 0))  # noqa: SLF001
+    assert not _server._is_loopback(("10.0.0.1", 1234))  # noqa: SLF001
+    assert not _server._is_loopback(None)  # noqa: SLF001
+
+
+class _RecordingSlowPolicy(_base_policy.BasePolicy):
+    def __init__(self, delay: float) -> None:
+        self._delay = delay
+        self.states: list[float] = []
+
+    def infer(self, obs: dict) -> dict:
+        self.states.append(float(obs["state"][0]))
+        time.sleep(self._delay)
+        return {"actions": np.asarray(obs["state"])}
+
+
+def test_deadlines():
+    policy = _RecordingSlowPolicy(delay=0.5)
+    port = _free_port()
+    server = _server.WebsocketPolicyServer(policy, host="localhost", port=port)
+    _start_server(server, port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port, deadline_ms=200)
+    first = client.infer_async({"state": np.zeros((1,))})
+    time.sleep(0.1)
+    # Waits behind the first request for longer than its deadline.
+    expired = client.infer_async({"state": np.ones((1,))})
+    # Can wait long enough.
+    relaxed = client.infer_async({"state": np.full((1,), 2.0)}, deadline_ms=5000)
+
+    np.testing.assert_array_equal(first.result(timeout=10)["actions"], np.zeros((1,)))
+    with pytest.raises(_websocket_client_policy.RequestDroppedError) as error:
+        expired.result(timeout=10)
+    assert error.value.status == _websocket_client_policy.STATUS_EXPIRED
+    assert error.value.server_timing["queue_ms"] >= 200
+    np.testing.assert_array_equal(relaxed.result(timeout=10)["actions"], np.full((1,), 2.0))
+    assert policy.states == [0.0, 2.0]
+    assert server.metrics.histogram("expired").count == 1
+
+
+def test_coalesce():
+    policy = _RecordingSlowPolicy(delay=0.3)
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(policy, host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port, coalesce=True)
+    futures = [client.infer_async({"state": np.zeros((1,), dtype=np.float32)})]
+    while not policy.states:
+        time.sleep(0.01)
+    # The other requests queue up behind the first one and only the newest one is evaluated.
+    futures += [client.infer_async({"state": np.full((1,), i, dtype=np.float32)}) for i in range(1, 4)]
+    assert futures[0].result(timeout=10)["actions"][0] == 0
+    for future in futures[1:3]:
+        with pytest.raises(_websocket_client_policy.RequestDroppedError, match="superseded"):
+            future.result(timeout=10)
+    assert futures[3].result(timeout=10)["actions"][0] == 3
+    assert policy.states == [0.0, 3.0]
+
+
+class _FailingPolicy(_base_policy.BasePolicy):
+    def infer(self, obs: dict) -> dict:
+        raise ValueError("Policy failed.")
+
+
+def test_infer_async_error():
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(_FailingPolicy(), host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port)
+    with pytest.raises(RuntimeError, match="Policy failed"):
+        client.infer_async({"state": np.zeros((1,))}).result(timeout=10)
+
+
+def test_metrics():
+    port = _free_port()
+    server = _server.WebsocketPolicyServer(_EchoPolicy(), host="localhost", port=port)
+    _start_server(server, port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port)
+    for _ in range(3):
+        client.infer({"state": np.zeros((2,))})
+    client.close()
+
+    conn = http.client.HTTPConnection("localhost", port, timeout=5)
+    conn.request("GET", "/metrics")
+    response = conn.getresponse()
+    assert response.status == 200
+    text = response.read().decode()
+    for stage in ("unpack", "queue", "infer", "pack", "total"):
+        assert f'openpi_server_stage_latency_ms_count{{stage="{stage}"}} 3' in text
+    assert server.metrics.summary()["total"]["count"] == 3
+
+
+def test_replica_pool():
+    num_replicas = 3
+    pool = _replica_pool.ReplicaPool([_SlowPolicy(delay=0.5) for _ in range(num_replicas)])
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(pool, host="localhost", port=port), port)
+
+    clients = [_websocket_client_policy.WebsocketClientPolicy(host="localhost", port=port) for _ in range(num_replicas)]
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(num_replicas) as executor:
+        results = list(executor.map(lambda client: client.infer({"state": np.zeros((1,))}), clients))
+    # The requests run concurrently, one per replica.
+    assert time.monotonic() - start < 1.0
+    assert sorted(result["policy_timing"]["replica"] for result in results) == list(range(num_replicas))
+
+    conn = http.client.HTTPConnection("localhost", port, timeout=5)
+    conn.request("GET", "/metrics")
+    text = conn.getresponse().read().decode()
+    for i in range(num_replicas):
+        assert f'openpi_server_replica_requests_total{{replica="{i}",devices="{i}"}} 1' in text
+
+
+class _ImageEchoPolicy(_base_policy.BasePolicy):
+    def infer(self, obs: dict) -> dict:
+        return {"image": obs["image"]}
+
+
+@pytest.mark.parametrize("wire_format", [msgpack_numpy.WIRE_FORMAT_MSGPACK, msgpack_numpy.WIRE_FORMAT_OOB])
+@pytest.mark.parametrize("image_codec", image_tools.IMAGE_CODECS)
+def test_image_codecs(wire_format: str, image_codec: str):
+    port = _free_port()
+    _start_server(_server.WebsocketPolicyServer(_ImageEchoPolicy(), host="localhost", port=port), port)
+
+    client = _websocket_client_policy.WebsocketClientPolicy(
+        host="localhost", port=port, wire_format=wire_format, image_codec=image_codec
+    )
+    image = np.tile(np.arange(0, 256, 4, dtype=np.uint8)[None, :, None], (32, 1, 3))
+    result = client.infer({"image": image})
+    assert result["image"].shape == image.shape
+    # JPEG is lossy, the other codecs must reproduce the image exactly.
+    max_error = 12 if image_codec == image_tools.IMAGE_CODEC_JPEG else 0
+    assert np.abs(result["image"].astype(np.int32) - image).max() <= max_error
@@ -0,0 +1,81 @@
+"""Converts raw BEHAVIOR observations into the inputs of a B1K policy without copying more than necessary.
+
+The evaluation environment returns RGBA frames at the cameras' native resolutions. The policy expects RGB frames of
+224x224. Cameras with the same resolution are resized together in one batched call, and the results are written to
+buffers that are reused across steps. Frames that already have the target resolution are passed through as views.
+"""
+
+import numpy as np
+from openpi_client import image_tools
+
+RESIZE_SIZE = 224
+PROPRIO_KEY = "robot_r1::proprio"
+# Policy input keys and the environment's observation keys of the cameras.
+CAMERA_KEYS = {
+    "observation/egocentric_camera": "robot_r1::robot_r1:zed_link:Camera:0::rgb",
+    "observation/wrist_image_left": "robot_r1::robot_r1:left_realsense_link:Camera:0::rgb",
+    "observation/wrist_image_right": "robot_r1::robot_r1:right_realsense_link:Camera:0::rgb",
+}
+
+
+class _CameraGroup:
+    """Cameras with the same source resolution, resized together."""
+
+    def __init__(self, input_keys: list[str], source_shape: tuple[int, ...], height: int, width: int) -> None:
+        self.input_keys = input_keys
+        num_cameras = len(input_keys)
+        # Single cameras are resized from a view of the observation.
+        self.staging = np.empty((num_cameras, *source_shape[:2], 3), dtype=np.uint8) if num_cameras > 1 else None
+        self.resized = np.empty((num_cameras, height, width, 3), dtype=np.uint8)
+
+
+class B1KPreprocessor:
+    """Builds policy inputs from BEHAVIOR observations.
+
+    The returned images are views into buffers owned by the preprocessor (or into the observation itself), which are
+    overwritten by the next call. They must therefore be consumed, e.g. by a synchronous `Policy.infer`, before the next
+    observation is processed.
+    """
+
+    def __init__(self, height: int = RESIZE_SIZE, width: int = RESIZE_SIZE) -> None:
+        self._height = height
+        self._width = width
+        # Keyed by the source shapes of all cameras, since they don't change during an episode.
+        self._groups: dict[tuple, list[_CameraGroup]] = {}
+
+    def __call__(self, obs: dict, prompt: str) -> dict:
+        """Returns the policy inputs for a raw observation."""
+        frames = {input_key: obs[obs_key] for input_key, obs_key in CAMERA_KEYS.items()}
+        inputs = {}
+        for group in self._get_groups(frames):
+            first = frames[group.input_keys[0]]
+            if first.shape[:2] == (self._height, self._width):
+                # Already the target size, drop the alpha channel without copying.
+                for input_key in group.input_keys:
+                    inputs[input_key] = frames[input_key][..., :3]
+                continue
+            if group.staging is None:
+                images = first[None, ..., :3]
+            else:
+                images = np.stack([frames[input_key][..., :3] for input_key in group.input_keys], out=group.staging)
+            image_tools.resize_with_pad(images, self._height, self._width, out=group.resized)
+            for i, input_key in enumerate(group.input_keys):
+                inputs[input_key] = group.resized[i]
+
+        inputs["observation/state"] = obs[PROPRIO_KEY]
+        inputs["prompt"] = prompt
+        # Named task_index because that's what `_transforms.ExtractTaskID()` expects.
+        inputs["task_index"] = int(obs["task_id"])
+        return inputs
+
+    def _get_groups(self, frames: dict[str, np.ndarray]) -> list[_CameraGroup]:
+        shapes = tuple(frame.shape for frame in frames.values())
+        if shapes not in self._groups:
+            keys_by_shape: dict[tuple, list[str]] = {}
+            for input_key, frame in frames.items():
+                keys_by_shape.setdefault(frame.shape, []).append(input_key)
+            self._groups[shapes] = [
+                _CameraGroup(input_keys, shape, self._height, self._width)
+                for shape, input_keys in keys_by_shape.items()
+            ]
+        return self._groups[shapes]
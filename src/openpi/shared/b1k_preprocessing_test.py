@@ -0,0 +1,45 @@
+import numpy as np
+from openpi_client import image_tools
+
+from openpi.shared import b1k_preprocessing
+
+
+def _make_obs(rng: np.random.Generator, head_size: int, wrist_size: int) -> dict:
+    sizes = [head_size, wrist_size, wrist_size]
+    obs = {
+        obs_key: rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+        for obs_key, size in zip(b1k_preprocessing.CAMERA_KEYS.values(), sizes, strict=True)
+    }
+    obs[b1k_preprocessing.PROPRIO_KEY] = rng.random(256)
+    obs["task_id"] = np.int64(3)
+    return obs
+
+
+def test_matches_per_camera_resize():
+    rng = np.random.default_rng(0)
+    preprocessor = b1k_preprocessing.B1KPreprocessor()
+    for head_size, wrist_size in [(240, 160), (240, 160), (224, 160), (160, 160)]:
+        obs = _make_obs(rng, head_size, wrist_size)
+        inputs = preprocessor(obs, "do something")
+
+        assert inputs["prompt"] == "do something"
+        assert inputs["task_index"] == 3
+        assert inputs["observation/state"] is obs[b1k_preprocessing.PROPRIO_KEY]
+        for input_key, obs_key in b1k_preprocessing.CAMERA_KEYS.items():
+            expected = image_tools.resize_with_pad(obs[obs_key][None, ..., :3], 224, 224)[0]
+            np.testing.assert_array_equal(inputs[input_key], expected)
+
+
+def test_reuses_buffers():
+    rng = np.random.default_rng(0)
+    preprocessor = b1k_preprocessing.B1KPreprocessor()
+    first = preprocessor(_make_obs(rng, 240, 160), "")
+    second = preprocessor(_make_obs(rng, 240, 160), "")
+    for input_key in b1k_preprocessing.CAMERA_KEYS:
+        assert np.shares_memory(first[input_key], second[input_key])
+
+    # Frames that already have the target size are passed through.
+    obs = _make_obs(rng, 224, 160)
+    inputs = preprocessor(obs, "")
+    head_key = b1k_preprocessing.CAMERA_KEYS["observation/egocentric_camera"]
+    assert np.shares_memory(inputs["observation/egocentric_camera"], obs[head_key])
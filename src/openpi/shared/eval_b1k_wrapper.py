@@ -6,29 +6,61 @@ from openpi.training import config as _config
 from openpi.policies import policy_config as _policy_config
 from openpi_client.base_policy import BasePolicy
 from openpi.policies import policy as _policy
-from openpi_client.image_tools import resize_with_pad
+from openpi.policies import policy_cache as _policy_cache
+from openpi.shared import b1k_preprocessing
+from openpi.shared import temporal_ensemble
 from collections import deque
-import copy
+from collections.abc import Callable, Sequence
 import traceback
 
-RESIZE_SIZE = 224
+ACTION_DIM = 23
+# The gripper dimensions are taken from the most recent rollout instead of being averaged.
+GRIPPER_DIMS = (-9, -1)
 
-def create_policy(ckpt_dir: str) -> _policy.Policy:
+def create_policy(ckpt_dir: str, *, restore_to_host: bool = False, fuse_transforms: bool = False) -> _policy.Policy:
     """Create a policy from the given arguments."""
     config = _config.get_config("pi05_b1k_inference_final")
     return _policy_config.create_trained_policy(
-        config, ckpt_dir, default_prompt=None
+        config, ckpt_dir, default_prompt=None, restore_to_host=restore_to_host, fuse_transforms=fuse_transforms
     )
 
+
+def create_host_policy(ckpt_dir: str, *, fuse_transforms: bool = False) -> _policy.Policy:
+    """Create a policy whose weights stay in host memory until it is used, for prefetching."""
+    return create_policy(ckpt_dir, restore_to_host=True, fuse_transforms=fuse_transforms)
+
 class B1KPolicyWrapper():
     def __init__(
         self,
-        policy: BasePolicy,
+        policy: BasePolicy | None,
         config: _config.TrainConfig,
         text_prompt : str = "Turn on the radio receiver that's on the table in the living room.",
+        policy_cache: _policy_cache.PolicyCache | None = None,
+        record_dir: str | None = None,
+        default_ckpt_path: str | None = None,
     ) -> None:
+        # Replaced by the policy of the default task below.
         self.policy = policy
+        # If set, the behavior of every task's policy is recorded to this directory.
+        self.record_dir = record_dir
+        # Checkpoint of the tasks without a task-specific checkpoint. If None, a checkpoint under OPENPI_CKPT_ROOT is used.
+        self.default_ckpt_path = default_ckpt_path
+        # Policies of recently evaluated tasks, keyed by checkpoint path. By default, as many policies as fit into 80%
+        # of the device memory are kept (only one if the device doesn't report its memory).
+        if policy_cache is None:
+            budget = _policy_cache.default_device_budget()
+            policy_cache = _policy_cache.PolicyCache(
+                create_policy,
+                max_device_bytes=budget,
+                max_policies=1 if budget is None else None,
+                host_loader=create_host_policy,
+            )
+        self.policy_cache = policy_cache
+        # Predicts the tasks that will be evaluated after the current one, see `set_upcoming_tasks`.
+        self.upcoming_tasks_fn: Callable[[int], Sequence[int]] | None = None
+        self.prefetch_lookahead = 1
         self.text_prompt = text_prompt
+        self.preprocessor = b1k_preprocessing.B1KPreprocessor()
         self.current_task_id = None
         self.step_counter = 0
 
@@ -115,15 +147,66 @@ class B1KPolicyWrapper():
         self.exp_k_value = self.configs[config_type]["exp_k_value"]
         self.control_mode = self.configs[config_type]["control_mode"]
         self.action_queue = deque([], maxlen=self.action_horizon)
+        self.ensemble_buffer = self.make_ensemble_buffer()
         self.last_action = {"actions": np.zeros((self.action_horizon, 23), dtype=np.float64)}
         self.step_counter = 0
         self.ckpt_path = self.get_ckpt_path(task_id)
-        self.policy = create_policy(self.ckpt_path)
+        # Drop our reference first so that the cache can free the device memory of the previous policy if needed.
+        if isinstance(self.policy, _policy.PolicyRecorder):
+            self.policy.close()
+        self.policy = None
+        self.policy = self.policy_cache.get(self.ckpt_path)
+        if self.record_dir is not None:
+            # The records of all tasks are appended to the same directory.
+            self.policy = _policy.PolicyRecorder(self.policy, self.record_dir)
+        print(f"Policy cache: {self.policy_cache.stats}")
+        self.prefetch_upcoming_tasks()
+
+    def set_upcoming_tasks(self, upcoming: Sequence[int] | Callable[[int], Sequence[int]], lookahead: int = 1):
+        """Sets the order in which tasks will be evaluated, so that their policies can be loaded in the background.
+
+        Args:
+            upcoming: Either the task ids of the sweep in evaluation order, or a function that predicts the next task
+                ids from the current task id.
+            lookahead: Number of upcoming tasks whose policies are loaded ahead of time.
+        """
+        if callable(upcoming):
+            self.upcoming_tasks_fn = upcoming
+        else:
+            task_order = [int(task_id) for task_id in upcoming]
+
+            def next_tasks(task_id: int) -> Sequence[int]:
+                if task_id not in task_order:
+                    return task_order
+                return task_order[task_order.index(task_id) + 1 :]
+
+            self.upcoming_tasks_fn = next_tasks
+        self.prefetch_lookahead = lookahead
+        self.prefetch_upcoming_tasks()
+
+    def prefetch_upcoming_tasks(self):
+        """Starts loading the policies of the next tasks while the current task is being evaluated."""
+        if self.upcoming_tasks_fn is None or self.current_task_id is None:
+            return
+        ckpt_paths = []
+        for task_id in self.upcoming_tasks_fn(int(self.current_task_id)):
+            ckpt_path = self.get_ckpt_path(task_id)
+            # Tasks may share a checkpoint.
+            if ckpt_path != self.ckpt_path and ckpt_path not in ckpt_paths:
+                ckpt_paths.append(ckpt_path)
+            if len(ckpt_paths) == self.prefetch_lookahead:
+                break
+        for ckpt_path in ckpt_paths:
+            print(f"Prefetching policy {ckpt_path}")
+            self.policy_cache.prefetch(ckpt_path)
 
     def get_config_type(self, task_id: int) -> str:
         return self.task_idx_config_type_map.get(int(task_id), "fine")
 
     def get_ckpt_path(self, task_id: int) -> str:
+        if self.default_ckpt_path is not None and int(task_id) not in self.task_idx_ckpt_path_map:
+            print(f"task_id={task_id}, ckpt_path={self.default_ckpt_path}")
+            return self.default_ckpt_path
         ckpt_sub_dir = self.task_idx_ckpt_path_map.get(int(task_id), "openpi_05_20251113_045215/81000")
         print(f"task_id={task_id}, ckpt_sub_dir={ckpt_sub_dir}")
         ckpt_root = os.environ.get("OPENPI_CKPT_ROOT", "./outputs/checkpoints")
@@ -131,9 +214,15 @@ class B1KPolicyWrapper():
 
     def reset(self):
         self.action_queue = deque([],maxlen=self.action_horizon)
+        self.ensemble_buffer = self.make_ensemble_buffer()
         self.last_action = {"actions": np.zeros((self.action_horizon, 23), dtype=np.float64)}
         self.step_counter = 0
 
+    def make_ensemble_buffer(self) -> temporal_ensemble.TemporalEnsembleBuffer:
+        return temporal_ensemble.TemporalEnsembleBuffer(
+            self.temporal_ensemble_max, self.max_len, ACTION_DIM, self.exp_k_value, passthrough_dims=GRIPPER_DIMS
+        )
+
     def get_prompt_from_obs(self, obs: dict) -> str:
         if "prompt" in obs:
             return obs["prompt"]
@@ -147,54 +236,16 @@ class B1KPolicyWrapper():
     def process_obs(self, obs: dict) -> dict:
         """
         Process the observation dictionary to match the expected input format for the model.
+
+        The images are views into buffers that are reused by the next call, see `B1KPreprocessor`.
         """
-        prop_state = obs["robot_r1::proprio"][None]
-        img_obs = np.stack(
-            [
-                resize_with_pad(
-                    obs["robot_r1::robot_r1:zed_link:Camera:0::rgb"][None, ..., :3],
-                    RESIZE_SIZE,
-                    RESIZE_SIZE
-                ),
-                resize_with_pad(
-                    obs["robot_r1::robot_r1:left_realsense_link:Camera:0::rgb"][None, ..., :3], 
-                    RESIZE_SIZE,
-                    RESIZE_SIZE
-                ),
-                resize_with_pad(
-                    obs["robot_r1::robot_r1:right_realsense_link:Camera:0::rgb"][None, ..., :3],
-                    RESIZE_SIZE,
-                    RESIZE_SIZE
-                ),
-            ],
-            axis=1,
-        )
-        processed_obs = {
-            "observation": img_obs,  # Shape: (1, 3, H, W, C)
-            "proprio": prop_state,
-            "prompt": self.get_prompt_from_obs(obs),
-            "task_index": int(obs["task_id"]),  # read it in as task_index because that's what _transforms.ExtractTaskID() expects
-        }
-        return processed_obs
-    
+        return self.preprocessor(obs, self.get_prompt_from_obs(obs))
+
     def act_receeding_temporal(self, input_obs):
         # Step 1: check if we should re-run policy
         if self.step_counter % self.replan_interval == 0:
-            # Run policy every K steps
-            nbatch = copy.deepcopy(input_obs)
-            if nbatch["observation"].shape[-1] != 3:
-                nbatch["observation"] = np.transpose(nbatch["observation"], (0, 1, 3, 4, 2))
-
-            joint_positions = nbatch["proprio"][0]
-            batch = {
-                "observation/egocentric_camera": nbatch["observation"][0, 0],
-                "observation/wrist_image_left": nbatch["observation"][0, 1],
-                "observation/wrist_image_right": nbatch["observation"][0, 2],
-                "observation/state": joint_positions,
-                "prompt": input_obs["prompt"],
-                "task_index": input_obs["task_index"],
-            }
-
+            # Run policy every K steps. The observation is only preprocessed for the steps that run it.
+            batch = self.process_obs(input_obs)
             try:
                 action = self.policy.infer(batch)
                 self.last_action = action
@@ -202,38 +253,12 @@ class B1KPolicyWrapper():
                 action = self.last_action
                 print(f"Error in action prediction, using last action: {traceback.format_exc()}")
 
-            target_joint_positions = action["actions"].copy()
-
-            # Add this sequence to action queue
-            new_seq = deque([a for a in target_joint_positions[:self.max_len]])
-            self.action_queue.append(new_seq)
-
-            # Optional: limit memory
-            while len(self.action_queue) > self.temporal_ensemble_max:
-                self.action_queue.popleft()
-
-        # Step 2: Smooth across current step from all stored sequences
-        if len(self.action_queue) == 0:
-            raise ValueError("Action queue empty in receeding_temporal mode.")
+            # The buffer copies the actions it keeps.
+            self.ensemble_buffer.add(action["actions"])
 
-        actions_current_timestep = np.empty((len(self.action_queue), self.action_queue[0][0].shape[0]))
-
-        for i in range(len(self.action_queue)):
-            actions_current_timestep[i] = self.action_queue[i].popleft()
-
-        # Drop exhausted sequences
-        self.action_queue = deque([q for q in self.action_queue if len(q) > 0])
-
-        # Apply temporal ensemble
-        exp_weights = np.exp(self.exp_k_value * np.arange(actions_current_timestep.shape[0]))
-        exp_weights = exp_weights / exp_weights.sum()
-
-        final_action = (actions_current_timestep * exp_weights[:, None]).sum(axis=0)
-
-        # Preserve grippers from most recent rollout
-        final_action[-9] = actions_current_timestep[-1, -9]
-        final_action[-1] = actions_current_timestep[-1, -1]
-        final_action = final_action[None]
+        # Step 2: Smooth across current step from all stored sequences, preserving the grippers from the most recent
+        # rollout
+        final_action = self.ensemble_buffer.step()[None]
 
         self.step_counter += 1
 
@@ -272,7 +297,6 @@ class B1KPolicyWrapper():
         # Check if new task and then set it if so
         self.maybe_set_new_task(input_obs["task_id"])
 
-        input_obs = self.process_obs(input_obs)
         if self.control_mode == 'receeding_temporal':
             return torch.from_numpy(self.act_receeding_temporal(input_obs))
         
@@ -282,22 +306,7 @@ class B1KPolicyWrapper():
                 final_action = self.action_queue.popleft()[None]
                 return torch.from_numpy(final_action)
         
-        nbatch = copy.deepcopy(input_obs)
-        if nbatch["observation"].shape[-1] != 3: 
-            # make B, num_cameras, H, W, C  from B, num_cameras, C, H, W
-            # permute if pytorch
-            nbatch["observation"] = np.transpose(nbatch["observation"], (0, 1, 3, 4, 2))
-
-        # nbatch["proprio"] is B, 16, where B=1
-        joint_positions = nbatch["proprio"][0]
-        batch = {
-            "observation/egocentric_camera": nbatch["observation"][0, 0],
-            "observation/wrist_image_left": nbatch["observation"][0, 1],
-            "observation/wrist_image_right": nbatch["observation"][0, 2],
-            "observation/state": joint_positions,
-            "prompt": nbatch["prompt"],
-            "task_index": nbatch["task_index"],
-        }
+        batch = self.process_obs(input_obs)
         # print(f"batch['prompt']: {batch['prompt']}")
 
         try:
@@ -3,7 +3,7 @@ import dataclasses
 import functools
 import inspect
 import re
-from typing import Any, ParamSpec, TypeVar
+from typing import Any, Generic, ParamSpec, TypeVar
 
 import flax.nnx as nnx
 import jax
@@ -12,7 +12,31 @@ P = ParamSpec("P")
 R = TypeVar("R")
 
 
-def module_jit(meth: Callable[P, R], *jit_args, **jit_kwargs) -> Callable[P, R]:
+class JittedMethod(Generic[P, R]):
+    """The callable returned by `module_jit`.
+
+    `state` holds the frozen module state that is passed to the compiled function. It can be replaced by a state with
+    the same structure, shapes, dtypes and shardings (e.g. after moving the weights to host memory and back) without
+    triggering a recompilation.
+    """
+
+    def __init__(self, jitted_fn: Callable[..., R], state: nnx.State) -> None:
+        self._jitted_fn = jitted_fn
+        self.state = state
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> R:
+        return self._jitted_fn(self.state, *args, **kwargs)
+
+    @property
+    def fn(self) -> Callable[..., R]:
+        """The compiled function, which takes the module state as its first argument.
+
+        Calling it inside another jitted function compiles the method into the same program as the caller.
+        """
+        return self._jitted_fn
+
+
+def module_jit(meth: Callable[P, R], *jit_args, **jit_kwargs) -> JittedMethod[P, R]:
     """A higher-order function to JIT-compile `nnx.Module` methods, freezing the module's state in the process.
 
     Why not `nnx.jit`? For some reason, naively applying `nnx.jit` to `nnx.Module` methods, bound or unbound, uses much
@@ -36,10 +60,8 @@ def module_jit(meth: Callable[P, R], *jit_args, **jit_kwargs) -> Callable[P, R]:
 
     jitted_fn = jax.jit(fun, *jit_args, **jit_kwargs)
 
-    @functools.wraps(meth)
-    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-        return jitted_fn(state, *args, **kwargs)
-
+    wrapper = JittedMethod(jitted_fn, state)
+    functools.update_wrapper(wrapper, meth)
     return wrapper
 
 
@@ -4,12 +4,14 @@ import os
 import json
 from openpi.training import config as _config
 from openpi_client.base_policy import BasePolicy
-from openpi_client.image_tools import resize_with_pad
+from openpi.shared import b1k_preprocessing
+from openpi.shared import temporal_ensemble
 from collections import deque
-import copy
 import traceback
 
-RESIZE_SIZE = 224
+ACTION_DIM = 23
+# The gripper dimensions are taken from the most recent rollout instead of being averaged.
+GRIPPER_DIMS = (-9, -1)
 
 class OGB1KPolicyWrapper():
     def __init__(
@@ -25,6 +27,7 @@ class OGB1KPolicyWrapper():
     ) -> None:
         self.policy = policy
         self.text_prompt = text_prompt
+        self.preprocessor = b1k_preprocessing.B1KPreprocessor()
         self.control_mode = control_mode
         self.action_queue = deque([], maxlen=action_horizon)
         self.last_action = {"actions": np.zeros((action_horizon, 23), dtype=np.float64)}
@@ -34,6 +37,7 @@ class OGB1KPolicyWrapper():
         self.temporal_ensemble_max = temporal_ensemble_max
         self.replan_interval = action_horizon # K: replan every 10 steps
         self.step_counter = 0
+        self.ensemble_buffer = self.make_ensemble_buffer()
 
         dataset_root = config.data.base_config.behavior_dataset_root
         self.task_prompt_map = {}
@@ -46,9 +50,15 @@ class OGB1KPolicyWrapper():
 
     def reset(self):
         self.action_queue = deque([],maxlen=self.action_horizon)
+        self.ensemble_buffer = self.make_ensemble_buffer()
         self.last_action = {"actions": np.zeros((self.action_horizon, 23), dtype=np.float64)}
         self.step_counter = 0
 
+    def make_ensemble_buffer(self) -> temporal_ensemble.TemporalEnsembleBuffer:
+        return temporal_ensemble.TemporalEnsembleBuffer(
+            self.temporal_ensemble_max, self.max_len, ACTION_DIM, self.exp_k_value, passthrough_dims=GRIPPER_DIMS
+        )
+
     def get_prompt_from_obs(self, obs: dict) -> str:
         if "prompt" in obs:
             return obs["prompt"]
@@ -62,54 +72,16 @@ class OGB1KPolicyWrapper():
     def process_obs(self, obs: dict) -> dict:
         """
         Process the observation dictionary to match the expected input format for the model.
+
+        The images are views into buffers that are reused by the next call, see `B1KPreprocessor`.
         """
-        prop_state = obs["robot_r1::proprio"][None]
-        img_obs = np.stack(
-            [
-                resize_with_pad(
-                    obs["robot_r1::robot_r1:zed_link:Camera:0::rgb"][None, ..., :3],
-                    RESIZE_SIZE,
-                    RESIZE_SIZE
-                ),
-                resize_with_pad(
-                    obs["robot_r1::robot_r1:left_realsense_link:Camera:0::rgb"][None, ..., :3], 
-                    RESIZE_SIZE,
-                    RESIZE_SIZE
-                ),
-                resize_with_pad(
-                    obs["robot_r1::robot_r1:right_realsense_link:Camera:0::rgb"][None, ..., :3],
-                    RESIZE_SIZE,
-                    RESIZE_SIZE
-                ),
-            ],
-            axis=1,
-        )
-        processed_obs = {
-            "observation": img_obs,  # Shape: (1, 3, H, W, C)
-            "proprio": prop_state,
-            "prompt": self.get_prompt_from_obs(obs),
-            "task_index": int(obs["task_id"]),  # read it in as task_index because that's what _transforms.ExtractTaskID() expects
-        }
-        return processed_obs
-    
+        return self.preprocessor(obs, self.get_prompt_from_obs(obs))
+
     def act_receeding_temporal(self, input_obs):
         # Step 1: check if we should re-run policy
         if self.step_counter % self.replan_interval == 0:
-            # Run policy every K steps
-            nbatch = copy.deepcopy(input_obs)
-            if nbatch["observation"].shape[-1] != 3:
-                nbatch["observation"] = np.transpose(nbatch["observation"], (0, 1, 3, 4, 2))
-
-            joint_positions = nbatch["proprio"][0]
-            batch = {
-                "observation/egocentric_camera": nbatch["observation"][0, 0],
-                "observation/wrist_image_left": nbatch["observation"][0, 1],
-                "observation/wrist_image_right": nbatch["observation"][0, 2],
-                "observation/state": joint_positions,
-                "prompt": input_obs["prompt"],
-                "task_index": input_obs["task_index"],
-            }
-
+            # Run policy every K steps. The observation is only preprocessed for the steps that run it.
+            batch = self.process_obs(input_obs)
             try:
                 action = self.policy.infer(batch)
                 self.last_action = action
@@ -117,39 +89,12 @@ class OGB1KPolicyWrapper():
                 action = self.last_action
                 print(f"Error in action prediction, using last action: {traceback.format_exc()}")
 
-            target_joint_positions = action["actions"].copy()
-
-            # Add this sequence to action queue
-            new_seq = deque([a for a in target_joint_positions[:self.max_len]])
-            self.action_queue.append(new_seq)
-
-            # Optional: limit memory
-            while len(self.action_queue) > self.temporal_ensemble_max:
-                self.action_queue.popleft()
-
-        # Step 2: Smooth across current step from all stored sequences
-        if len(self.action_queue) == 0:
-            raise ValueError("Action queue empty in receeding_temporal mode.")
-
-        actions_current_timestep = np.empty((len(self.action_queue), self.action_queue[0][0].shape[0]))
-
-        for i in range(len(self.action_queue)):
-            actions_current_timestep[i] = self.action_queue[i].popleft()
-
-        # Drop exhausted sequences
-        self.action_queue = deque([q for q in self.action_queue if len(q) > 0])
-
-        # Apply temporal ensemble
-        print(f"self.exp_k_value: {self.exp_k_value}")
-        exp_weights = np.exp(self.exp_k_value * np.arange(actions_current_timestep.shape[0]))
-        exp_weights = exp_weights / exp_weights.sum()
-
-        final_action = (actions_current_timestep * exp_weights[:, None]).sum(axis=0)
+            # The buffer copies the actions it keeps.
+            self.ensemble_buffer.add(action["actions"])
 
-        # Preserve grippers from most recent rollout
-        final_action[-9] = actions_current_timestep[-1, -9]
-        final_action[-1] = actions_current_timestep[-1, -1]
-        final_action = final_action[None]
+        # Step 2: Smooth across current step from all stored sequences, preserving the grippers from the most recent
+        # rollout
+        final_action = self.ensemble_buffer.step()[None]
 
         self.step_counter += 1
 
@@ -186,7 +131,6 @@ class OGB1KPolicyWrapper():
             Shape: (10, 16)
         """
         # breakpoint()
-        input_obs = self.process_obs(input_obs)
         if self.control_mode == 'receeding_temporal':
             return torch.from_numpy(self.act_receeding_temporal(input_obs))
         
@@ -196,22 +140,7 @@ class OGB1KPolicyWrapper():
                 final_action = self.action_queue.popleft()[None]
                 return torch.from_numpy(final_action)
         
-        nbatch = copy.deepcopy(input_obs)
-        if nbatch["observation"].shape[-1] != 3: 
-            # make B, num_cameras, H, W, C  from B, num_cameras, C, H, W
-            # permute if pytorch
-            nbatch["observation"] = np.transpose(nbatch["observation"], (0, 1, 3, 4, 2))
-
-        # nbatch["proprio"] is B, 16, where B=1
-        joint_positions = nbatch["proprio"][0]
-        batch = {
-            "observation/egocentric_camera": nbatch["observation"][0, 0],
-            "observation/wrist_image_left": nbatch["observation"][0, 1],
-            "observation/wrist_image_right": nbatch["observation"][0, 2],
-            "observation/state": joint_positions,
-            "prompt": nbatch["prompt"],
-            "task_index": nbatch["task_index"],
-        }
+        batch = self.process_obs(input_obs)
         # print(f"batch['prompt']: {batch['prompt']}")
 
         try:
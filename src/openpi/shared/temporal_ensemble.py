@@ -0,0 +1,116 @@
+"""Temporal ensembling of overlapping action chunks for receding-horizon control.
+
+The policy predicts a chunk of future actions every few control steps. Chunks that were predicted at different times
+overlap, and the executed action is a weighted average over all chunks that still cover the current step. Weights grow
+exponentially with the age rank of a chunk, so that with `exp_k_value > 0` newer chunks count more.
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+
+class TemporalEnsembleBuffer:
+    """A fixed-size ring buffer of action chunks.
+
+    Chunks are stored in a preallocated `(ensemble_max, max_len, action_dim)` array. Adding a chunk overwrites the
+    oldest exhausted chunk, or the oldest chunk if all of them still cover the current step. The active chunks and their
+    weights only change when a chunk is added or runs out, so they are cached in between, and every `step` is a single
+    weighted reduction over the rows of the active chunks.
+    """
+
+    def __init__(
+        self,
+        ensemble_max: int,
+        max_len: int,
+        action_dim: int,
+        exp_k_value: float,
+        *,
+        passthrough_dims: Sequence[int] = (),
+        dtype: npt.DTypeLike = np.float64,
+    ) -> None:
+        """Creates an empty buffer.
+
+        Args:
+            ensemble_max: Maximum number of chunks that are averaged.
+            max_len: Maximum number of actions kept from every chunk. Longer chunks are truncated.
+            action_dim: Size of a single action.
+            exp_k_value: The weight of the i-th oldest active chunk is proportional to `exp(exp_k_value * i)`.
+            passthrough_dims: Action dimensions taken from the newest chunk instead of being averaged, e.g. grippers.
+            dtype: Dtype of the returned actions.
+        """
+        if ensemble_max < 1 or max_len < 1:
+            raise ValueError(f"Invalid buffer size: ensemble_max={ensemble_max}, max_len={max_len}")
+        self._buffer = np.zeros((ensemble_max, max_len, action_dim), dtype=dtype)
+        self._passthrough_dims = np.asarray(passthrough_dims, dtype=np.int64)
+        # Row n holds the normalized weights of n active chunks, oldest first.
+        self._weight_table = np.zeros((ensemble_max + 1, ensemble_max), dtype=dtype)
+        for n in range(1, ensemble_max + 1):
+            weights = np.exp(exp_k_value * np.arange(n))
+            self._weight_table[n, :n] = weights / weights.sum()
+        self.reset()
+
+    @property
+    def ensemble_max(self) -> int:
+        return self._buffer.shape[0]
+
+    @property
+    def max_len(self) -> int:
+        return self._buffer.shape[1]
+
+    def __len__(self) -> int:
+        """The number of chunks that cover the current step."""
+        return int(np.count_nonzero(self._starts + self._lengths > self._time))
+
+    def reset(self) -> None:
+        """Removes all chunks."""
+        self._time = 0
+        self._starts = np.zeros(self.ensemble_max, dtype=np.int64)
+        self._lengths = np.zeros(self.ensemble_max, dtype=np.int64)
+        # Slots ordered from the oldest to the newest chunk.
+        self._order = list(range(self.ensemble_max))
+        self._invalidate()
+
+    def add(self, actions: np.ndarray) -> None:
+        """Adds a chunk of shape `(chunk_len, action_dim)` whose first action is executed at the next `step`."""
+        actions = actions[: self.max_len]
+        if len(actions) == 0:
+            return
+        exhausted = [slot for slot in self._order if self._starts[slot] + self._lengths[slot] <= self._time]
+        slot = exhausted[0] if exhausted else self._order[0]
+        self._buffer[slot, : len(actions)] = actions
+        self._starts[slot] = self._time
+        self._lengths[slot] = len(actions)
+        self._order.remove(slot)
+        self._order.append(slot)
+        self._invalidate()
+
+    def step(self) -> np.ndarray:
+        """Returns the ensembled action of shape `(action_dim,)` for the current step and advances to the next one.
+
+        Raises:
+            ValueError: If no chunk covers the current step.
+        """
+        if self._time >= self._valid_until:
+            self._update_active()
+        rows = self._buffer[self._active_slots, self._time - self._active_starts]
+        action = self._active_weights @ rows
+        action[self._passthrough_dims] = rows[-1, self._passthrough_dims]
+        self._time += 1
+        return action
+
+    def _invalidate(self) -> None:
+        self._valid_until = self._time
+
+    def _update_active(self) -> None:
+        order = np.asarray(self._order)
+        ends = self._starts[order] + self._lengths[order]
+        active = order[ends > self._time]
+        if len(active) == 0:
+            raise ValueError("No action chunk covers the current step.")
+        self._active_slots = active
+        self._active_starts = self._starts[active]
+        self._active_weights = self._weight_table[len(active), : len(active)]
+        # The active chunks don't change until the first of them runs out or a chunk is added.
+        self._valid_until = int((self._starts[active] + self._lengths[active]).min())
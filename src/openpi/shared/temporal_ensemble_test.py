@@ -0,0 +1,61 @@
+import collections
+
+import numpy as np
+import pytest
+
+from openpi.shared import temporal_ensemble
+
+
+def _reference_ensemble(chunks: dict[int, np.ndarray], num_steps: int, ensemble_max: int, max_len: int, k: float):
+    # The deque-based implementation the buffer replaces.
+    queue = collections.deque()
+    actions = []
+    for step in range(num_steps):
+        if step in chunks:
+            queue.append(collections.deque(chunks[step][:max_len]))
+            while len(queue) > ensemble_max:
+                queue.popleft()
+        current = np.stack([q.popleft() for q in queue])
+        queue = collections.deque(q for q in queue if q)
+        weights = np.exp(k * np.arange(len(current)))
+        action = (current * (weights / weights.sum())[:, None]).sum(axis=0)
+        action[-1] = current[-1, -1]
+        actions.append(action)
+    return np.stack(actions)
+
+
+@pytest.mark.parametrize(
+    ("ensemble_max", "max_len", "replan_interval", "k"),
+    [(6, 72, 12, 0.005), (6, 72, 12, 0.5), (1, 50, 50, 1.0), (3, 10, 2, 0.1), (4, 5, 5, 0.0)],
+)
+def test_matches_reference(ensemble_max: int, max_len: int, replan_interval: int, k: float):
+    rng = np.random.default_rng(0)
+    num_steps = 100
+    chunks = {step: rng.normal(size=(max_len + 3, 5)) for step in range(0, num_steps, replan_interval)}
+
+    buffer = temporal_ensemble.TemporalEnsembleBuffer(ensemble_max, max_len, 5, k, passthrough_dims=[-1])
+    actions = []
+    for step in range(num_steps):
+        if step in chunks:
+            buffer.add(chunks[step])
+        actions.append(buffer.step())
+
+    expected = _reference_ensemble(chunks, num_steps, ensemble_max, max_len, k)
+    np.testing.assert_allclose(np.stack(actions), expected, rtol=1e-12)
+
+
+def test_exhausted():
+    buffer = temporal_ensemble.TemporalEnsembleBuffer(2, 3, 1, 0.0)
+    with pytest.raises(ValueError, match="No action chunk"):
+        buffer.step()
+
+    buffer.add(np.arange(3.0)[:, None])
+    assert [buffer.step()[0] for _ in range(3)] == [0.0, 1.0, 2.0]
+    assert len(buffer) == 0
+    with pytest.raises(ValueError, match="No action chunk"):
+        buffer.step()
+
+    buffer.reset()
+    buffer.add(np.ones((2, 1)))
+    assert len(buffer) == 1
+    assert buffer.step()[0] == 1.0
@@ -1,6 +1,7 @@
 from collections.abc import Callable, Mapping, Sequence
 import dataclasses
 import re
+from types import ModuleType
 from typing import Protocol, TypeAlias, TypeVar, runtime_checkable
 import json
 from pathlib import Path
@@ -8,6 +9,7 @@ import random
 
 import flax.traverse_util as traverse_util
 import jax
+import jax.numpy as jnp
 import numpy as np
 from openpi_client import image_tools
 
@@ -39,6 +41,15 @@ class DataTransformFn(Protocol):
         """
 
 
+class JittableTransformFn(DataTransformFn):
+    """A transform that can also be applied to batched jax arrays inside `jax.jit`.
+
+    Such transforms only do array math with constants held by the transform (e.g. the norm stats) and support both
+    numpy and jax arrays (see `array_namespace`). They must not depend on the batch dimension, so that `Policy` can
+    apply them to a whole batch inside its compiled inference function.
+    """
+
+
 @dataclasses.dataclass(frozen=True)
 class Group:
     """A group of transforms."""
@@ -115,7 +126,7 @@ class InjectDefaultPrompt(DataTransformFn):
 
 
 @dataclasses.dataclass(frozen=True)
-class Normalize(DataTransformFn):
+class Normalize(JittableTransformFn):
     norm_stats: at.PyTree[NormStats] | None
     # If true, will use quantile normalization. Otherwise, normal z-score normalization will be used.
     use_quantiles: bool = False
@@ -149,7 +160,7 @@ class Normalize(DataTransformFn):
 
 
 @dataclasses.dataclass(frozen=True)
-class Unnormalize(DataTransformFn):
+class Unnormalize(JittableTransformFn):
     norm_stats: at.PyTree[NormStats] | None
     # If true, will use quantile normalization. Otherwise, normal z-score normalization will be used.
     use_quantiles: bool = False
@@ -180,7 +191,8 @@ class Unnormalize(DataTransformFn):
         assert stats.q99 is not None
         q01, q99 = stats.q01, stats.q99
         if (dim := q01.shape[-1]) < x.shape[-1]:
-            return np.concatenate([(x[..., :dim] + 1.0) / 2.0 * (q99 - q01 + 1e-6) + q01, x[..., dim:]], axis=-1)
+            xp = array_namespace(x)
+            return xp.concatenate([(x[..., :dim] + 1.0) / 2.0 * (q99 - q01 + 1e-6) + q01, x[..., dim:]], axis=-1)
         return (x + 1.0) / 2.0 * (q99 - q01 + 1e-6) + q01
 
 
@@ -394,7 +406,7 @@ class ExtractTaskID(DataTransformFn):
 
 
 @dataclasses.dataclass(frozen=True)
-class PadStatesAndActions(DataTransformFn):
+class PadStatesAndActions(JittableTransformFn):
     """Zero-pads states and actions to the model action dimension."""
 
     model_action_dim: int
@@ -527,10 +539,15 @@ def pad_to_dim(x: np.ndarray, target_dim: int, axis: int = -1, value: float = 0.
     if current_dim < target_dim:
         pad_width = [(0, 0)] * len(x.shape)
         pad_width[axis] = (0, target_dim - current_dim)
-        return np.pad(x, pad_width, constant_values=value)
+        return array_namespace(x).pad(x, pad_width, constant_values=value)
     return x
 
 
+def array_namespace(x) -> ModuleType:
+    """Returns `jax.numpy` for jax arrays (including tracers inside `jax.jit`) and `numpy` for everything else."""
+    return jnp if isinstance(x, jax.Array) else np
+
+
 def make_bool_mask(*dims: int) -> tuple[bool, ...]:
     """Make a boolean mask for the given dimensions.
 
@@ -1,3 +1,4 @@
+import jax
 import numpy as np
 import pytest
 
@@ -319,3 +320,34 @@ def test_proprio_dropout_with_multidim_state():
     assert "proprio_visibility_mask" in transformed
     expected_mask = np.array([[0.0, 1.0, 1.0], [0.0, 1.0, 1.0]])
     assert np.all(transformed["proprio_visibility_mask"] == expected_mask)
+
+
+@pytest.mark.parametrize("use_quantiles", [False, True])
+def test_jittable_transforms(use_quantiles):
+    rng = np.random.default_rng(0)
+    stats = {
+        key: _transforms.NormStats(
+            mean=rng.normal(size=5),
+            std=rng.uniform(0.5, 2.0, size=5),
+            q01=rng.uniform(-2.0, -1.0, size=5),
+            q99=rng.uniform(1.0, 2.0, size=5),
+        )
+        for key in ("state", "actions")
+    }
+    transform = _transforms.compose(
+        [
+            _transforms.Normalize(stats, use_quantiles=use_quantiles),
+            _transforms.PadStatesAndActions(8),
+            _transforms.Unnormalize(stats, use_quantiles=use_quantiles),
+        ]
+    )
+    # Batched, as in the compiled function of a policy.
+    data = {"state": rng.normal(size=(2, 5)), "actions": rng.normal(size=(2, 3, 5))}
+
+    expected = transform(dict(data))
+    actual = jax.jit(lambda data: transform(data))(dict(data))
+    assert actual["state"].shape == (2, 8)
+    assert actual["actions"].shape == (2, 3, 8)
+    for key, value in data.items():
+        np.testing.assert_allclose(actual[key], expected[key], atol=1e-5)
+        np.testing.assert_allclose(actual[key][..., :5], value, atol=1e-5)